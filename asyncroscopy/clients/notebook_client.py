@@ -9,21 +9,284 @@ Compatible with:
  - Central orchestration commands (Central_*)
 '''
 
+import ast
+import itertools
+import queue
 import socket
 import struct
-import numpy as np
+import weakref
 import threading
-from typing import List, Dict, Any, Tuple, Sequence
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from asyncroscopy.servers.protocols.utils import package_message, unpackage_message
+import time
+from typing import List, Any, Tuple, Sequence
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from asyncroscopy.servers.protocols.utils import (
+    unpackage_message, package_request, is_stream_head, StreamAssembler,
+    message_tag, HEADER_SIZE, TAG_SIZE,
+)
+from asyncroscopy.servers.protocols.shm import read_segment
+
+
+def _decode(data):
+    """Decoded payload of a reply; replies passed in shared memory are mapped, not copied."""
+    dtype, shape, payload = unpackage_message(data)
+    if dtype == "shm":
+        dtype, shape, payload = read_segment(payload)
+    return payload
+
+
+def _as_dict(reply):
+    """A dict reply; servers in legacy-header mode send dicts as their repr."""
+    if isinstance(reply, str):
+        try:
+            return ast.literal_eval(reply)
+        except (ValueError, SyntaxError):
+            pass
+    return reply
+
+
+def _recv_length(sock: socket.socket) -> int:
+    return struct.unpack("!I", _recv_exact(sock, 4))[0]
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytearray:
+    """Receive exactly n bytes, written in place with recv_into."""
+    buf = bytearray(n)
+    _recv_into(sock, memoryview(buf))
+    return buf
+
+
+def _recv_into(sock: socket.socket, view: memoryview):
+    """Fill view from the socket."""
+    got, n = 0, len(view)
+    while got < n:
+        read = sock.recv_into(view[got:], n - got)
+        if not read:
+            raise ConnectionError("Socket closed early")
+        got += read
+
+
+class Subscription:
+    """
+    Messages published on a topic, as they arrive. Iterate over it (or call
+    get()) to receive them decoded; close() ends the subscription. Only the
+    latest `keep` messages are kept, older ones are dropped if the consumer
+    falls behind (counted in dropped).
+    """
+
+    def __init__(self, name: str, keep: int = 4):
+        self.name = name
+        self.dropped = 0
+        self.closed = False
+        self._queue = queue.Queue(maxsize=keep)
+        self._close = None   # set by the connection
+
+    def _push(self, data):
+        while True:
+            try:
+                self._queue.put_nowait(data)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout: float | None = None):
+        """The next message (decoded payload); raises queue.Empty after timeout, StopIteration once closed."""
+        data = self._queue.get(timeout=timeout)
+        if data is None:
+            self._queue.put_nowait(None)
+            raise StopIteration
+        return unpackage_message(data)[2]
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get()
+            except StopIteration:
+                return
+
+    def close(self):
+        """Unsubscribe; iteration ends after the messages already received."""
+        if not self.closed and self._close is not None:
+            self._close()
+        self._ended()
+
+    def _ended(self):
+        if not self.closed:
+            self.closed = True
+            self._push(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Connection:
+    """
+    One persistent connection to Central carrying many requests at once.
+    Every request is tagged; a reader thread receives the replies (streams go
+    straight into preallocated buffers) and resolves the Future of the request
+    with the same tag, so replies may arrive in any order. Untagged replies
+    (older Central) resolve the oldest pending request.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.closed = False
+        self._lock = threading.Lock()
+        self._pending = {}   # tag -> Future, in the order requests were sent
+        self._subscriptions = {}   # tag -> Subscription
+        self._tags = itertools.count(1)
+        threading.Thread(target=self._read_loop, name="Client-reader", daemon=True).start()
+
+    def submit(self, command: str, args: dict, destination: str, timeout_s: float | None = None,
+               shm: bool = False) -> Future:
+        """
+        Send one request (with a timeout_s budget in seconds, and asking for a large
+        reply in shared memory with shm); returns a Future for its raw reply.
+        """
+        return self._submit(command, args, destination, timeout_s=timeout_s, shm=shm)[1]
+
+    def _submit(self, command: str, args: dict, destination: str, timeout_s: float | None = None,
+                shm: bool = False, subscription: Subscription | None = None):
+        """submit(), returning (tag, Future); messages following the reply go to subscription."""
+        future = Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("Connection to central server is closed")
+            tag = next(self._tags) & 0xFFFFFFFF
+            self._pending[tag] = future
+            # registered before the request is written, so no publication can arrive ahead of it
+            if subscription is not None:
+                self._subscriptions[tag] = subscription
+            payload = package_request(command, args, destination=destination, tag=tag, timeout_s=timeout_s,
+                                      shm=shm)
+            try:
+                self.sock.sendall(struct.pack("!I", len(payload)) + payload)
+            except OSError:
+                del self._pending[tag]
+                self._subscriptions.pop(tag, None)
+                raise
+        return tag, future
+
+    def cancel(self, future: Future):
+        """
+        Stop waiting for a request's reply (e.g. after a timeout) and ask Central to
+        cancel it, freeing its place in the backend's queue. A late reply is dropped.
+        """
+        with self._lock:
+            tag = next((t for t, pending in self._pending.items() if pending is future), None)
+            if tag is None:
+                return
+            del self._pending[tag]
+        try:
+            ack = self.submit("cancel", {"tag": tag}, "Central")
+        except (OSError, ConnectionError):
+            return
+        with self._lock:
+            self._pending = {t: f for t, f in self._pending.items() if f is not ack}
+
+    def subscribe(self, route: str, topic: str, subscription: Subscription) -> Future:
+        """Subscribe to route/topic; publications are pushed into subscription. Returns the ack's Future."""
+        tag, future = self._submit("subscribe", {"route": route, "topic": topic}, "Central",
+                                   subscription=subscription)
+        subscription._close = lambda: self._unsubscribe(tag)
+        return future
+
+    def _unsubscribe(self, tag):
+        with self._lock:
+            self._subscriptions.pop(tag, None)
+        try:
+            self.submit("unsubscribe", {"tag": tag}, "Central")
+        except (OSError, ConnectionError):
+            pass
+
+    def close(self, error: Exception | None = None):
+        with self._lock:
+            self.closed = True
+            subscriptions, self._subscriptions = self._subscriptions, {}
+            pending, self._pending = self._pending, {}
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error or ConnectionError("Connection to central server closed"))
+        for subscription in subscriptions.values():
+            subscription._ended()
+
+    def _deliver(self, tag, data):
+        with self._lock:
+            if tag is None:
+                tag = next(iter(self._pending), None)
+            future = self._pending.pop(tag, None)
+            # once the subscribe request is answered, messages with its tag are publications
+            subscription = self._subscriptions.get(tag) if future is None else None
+        if future is not None and not future.done():
+            future.set_result(data)
+        elif subscription is not None:
+            subscription._push(data)
+
+    def _read_loop(self):
+        sock = self.sock
+        streams = {}   # tag -> StreamAssembler of a reply stream in progress
+        try:
+            while True:
+                length = _recv_length(sock)
+                head = _recv_exact(sock, min(length, HEADER_SIZE + TAG_SIZE))
+                tag = message_tag(head)
+
+                stream = streams.get(tag)
+                if stream is not None:
+                    n = stream.feed_header(head)
+                    if length - n not in (HEADER_SIZE, HEADER_SIZE + TAG_SIZE):
+                        raise ConnectionError("Malformed stream chunk")
+                    view = stream.reserve(n)
+                    got = len(head) - (length - n)   # payload bytes already read with the header
+                    if got > 0:
+                        view[:got] = head[-got:]
+                    _recv_into(sock, view[max(got, 0):])
+                    if stream.done:
+                        del streams[tag]
+                        self._deliver(tag, stream.buffer)
+                    continue
+
+                data = bytearray(length)
+                data[:len(head)] = head
+                _recv_into(sock, memoryview(data)[len(head):])
+                if is_stream_head(data):
+                    streams[tag] = StreamAssembler(data)
+                else:
+                    self._deliver(tag, data)
+        except Exception as e:
+            self.close(e if isinstance(e, ConnectionError) else ConnectionError(str(e)))
+
 
 class NotebookClient:
-    """Client for TEM central server."""
+    """
+    Client for TEM central server.
+    Typed commands share one persistent connection, so several commands (from
+    several threads, or send_parallel_commands) can be in flight at once and
+    each returns as soon as its own reply arrives.
+
+    With shared_memory=True (only when Central and the backends run on this
+    host), large backend replies are passed in shared memory instead of over
+    the socket, and arrays are returned as views on it.
+    """
 
-    def __init__(self, host="localhost", port=9000):
-        self.executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="Client")
+    def __init__(self, host="localhost", port=9000, timeout: float | None = None,
+                 shared_memory: bool = False):
         self.host = host
         self.port = port
+        self.timeout = timeout   # default for send_command, in s; None (default) waits forever
+        self.shared_memory = shared_memory
+        self._conn = None
+        self._conn_lock = threading.Lock()
 
     @classmethod
     def connect(cls, host="127.0.0.1", port=9000):
@@ -37,13 +300,62 @@ class NotebookClient:
             print(f"Could not connect to central server at {host}:{port}")
             return None
 
+    def close(self):
+        """Close the connection to the central server (reopened by the next command)."""
+        with self._conn_lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+    def _connection(self, timeout: float | None = None) -> _Connection:
+        """The shared connection to Central, opened on first use or after it dropped."""
+        with self._conn_lock:
+            if self._conn is None or self._conn.closed:
+                sock = socket.create_connection((self.host, self.port), timeout=timeout)
+                sock.settimeout(None)
+                self._conn = _Connection(sock)
+                weakref.finalize(self, self._conn.close)
+            return self._conn
+
     def send_command(self, destination: str, command: str,
                      args: dict | None = None,
-                     timeout: float | None = None):
-        """Send command + args, return decoded response payload."""
+                     timeout: float | None = None,
+                     envelope: bool = True):
+        """
+        Send command + args, return decoded response payload.
+        By default the request goes out as a typed envelope, so argument values keep
+        their types (numbers, lists, ndarrays, strings with spaces), over the shared
+        connection. envelope=False sends the legacy "dest_cmd key=value" text form
+        on a connection of its own.
+
+        timeout (default: self.timeout, no deadline unless set) travels with the request as
+        a budget in seconds: Central and the backend give up on it once it is spent (measured
+        on their own clocks), and a request that times out here is cancelled.
+        """
         if args is None:
             args = {}
+        if timeout is None:
+            timeout = self.timeout
+        if not envelope:
+            return self._send_text(destination, command, args, timeout)
+
+        try:
+            conn = self._connection(timeout)
+            future = conn.submit(command, args, destination, timeout_s=timeout,
+                                 shm=self.shared_memory and destination != "Central")
+        except (ConnectionRefusedError, socket.timeout):
+            print(f"Could not connect to {self.host}:{self.port} after {timeout} seconds")
+            return None
+        try:
+            data = future.result(timeout)
+        except FutureTimeout:
+            conn.cancel(future)
+            print(f"No reply from {self.host}:{self.port} after {timeout} seconds")
+            return None
+        return _decode(data)
 
+    def _send_text(self, destination: str, command: str, args: dict, timeout: float | None):
+        """Send a legacy text command on its own connection."""
         cmd = f"{destination}_{command} " + " ".join(f"{k}={v}" for k, v in args.items())
         payload = cmd.encode()
         header = struct.pack("!I", len(payload))
@@ -51,11 +363,7 @@ class NotebookClient:
             with socket.create_connection((self.host, self.port), timeout=timeout) as sock:
                 # Send
                 sock.sendall(header + payload)
-                # Receive 4-byte response header
-                resp_hdr = self._recv_exact(sock, 4)
-                resp_len = struct.unpack("!I", resp_hdr)[0]
-                # Receive payload
-                data = self._recv_exact(sock, resp_len)
+                data = self._recv_message(sock)
                 dtype, shape, payload = unpackage_message(data)
 
                 return payload
@@ -64,15 +372,144 @@ class NotebookClient:
             print(f"Could not connect to {self.host}:{self.port} after {timeout} seconds")
             return None
 
-    def _recv_exact(self, sock: socket.socket, n: int) -> bytes:
-        """Receive exactly n bytes."""
-        buf = b""
-        while len(buf) < n:
-            chunk = sock.recv(n - len(buf))
-            if not chunk:
-                raise ConnectionError("Socket closed early")
-            buf += chunk
-        return buf
+    def _recv_message(self, sock: socket.socket) -> bytearray:
+        """
+        Receive one Int32-framed message into a single preallocated buffer.
+        Chunked streams are received straight into the buffer announced by the head frame.
+        """
+        data = _recv_exact(sock, _recv_length(sock))
+        if not is_stream_head(data):
+            return data
+        stream = StreamAssembler(data)
+        while not stream.done:
+            length = _recv_length(sock)
+            n = stream.feed_header(_recv_exact(sock, HEADER_SIZE))
+            if length != HEADER_SIZE + n:
+                raise ConnectionError("Malformed stream chunk")
+            if n:
+                _recv_into(sock, stream.reserve(n))
+        return stream.buffer
+
+    def set_compression(self, codec: str = "zlib", level: int = 1, shuffle: bool = True,
+                        threshold: int = 64 * 1024, route: str | None = None):
+        """
+        Ask Central to compress replies relayed to clients (all routes, or one route prefix).
+        codec is "zlib", "lzma" or "none"; shuffle enables the byte-shuffle filter
+        for typed arrays; payloads below threshold bytes are sent uncompressed.
+        """
+        args = {"codec": codec, "level": level, "shuffle": int(shuffle), "threshold": threshold}
+        if route is not None:
+            args["route"] = route
+        return self.send_command("Central", "set_compression", args)
+
+    def set_cache(self, command: str, ttl: float | None = None, invalidates: Sequence[str] | None = None):
+        """
+        Set Central's response cache rules for commands matching command ("Ceos_getAberrations",
+        "*_get_status", ...): cache their replies for ttl seconds (0 stops caching them),
+        and/or make them evict the cached replies of the commands matching invalidates.
+        """
+        args = {"command": command}
+        if ttl is not None:
+            args["ttl"] = ttl
+        if invalidates is not None:
+            args["invalidates"] = list(invalidates)
+        return self.send_command("Central", "set_cache", args)
+
+    def stats(self, destination: str = "Central", reset: bool = False) -> dict:
+        """
+        Request counters: Central's per-route and per-command stats (default),
+        or those of one backend (e.g. "AS", "Ceos"). reset clears them afterwards.
+        """
+        return _as_dict(self.send_command(destination, "stats", {"reset": int(reset)}))
+
+    def health(self) -> dict:
+        """
+        Central's view of each backend: circuit state ("closed", "open", "half_open"),
+        consecutive failures, last success/failure times, last error and probe latency.
+        """
+        return _as_dict(self.send_command("Central", "health"))
+
+    def trace_dump(self, last: int | None = None, clear: bool = False) -> dict:
+        """
+        Central's trace of recently completed requests, as columns (time, route, command,
+        bytes_in, bytes_out, latency, error), oldest first; "dropped" counts overwritten records.
+        """
+        args = {"clear": int(clear)}
+        if last is not None:
+            args["last"] = last
+        return self.send_command("Central", "trace_dump", args)
+
+    def set_route_limits(self, route: str, max_in_flight: int | None = None, max_queued: int | None = None):
+        """Limit how many requests Central runs at once on a route, and how many it queues."""
+        args = {"route": route}
+        if max_in_flight is not None:
+            args["max_in_flight"] = max_in_flight
+        if max_queued is not None:
+            args["max_queued"] = max_queued
+        return self.send_command("Central", "set_route_limits", args)
+
+    def set_priority(self, command: str, priority: str | int | None):
+        """
+        Set the priority class ("safety", "high", "normal", "low" or a number) of the commands
+        matching command (e.g. "AS_get_scanned_image"); None restores the default.
+        "safety" commands are never queued behind others.
+        """
+        args = {"command": command, "priority": "default" if priority is None else priority}
+        return self.send_command("Central", "set_priority", args)
+
+    def set_balancing(self, route: str | None = None, policy: str = "least",
+                      sticky: str | None = None, enable: bool = True):
+        """
+        For routes served by several replicas: pick replicas by "least" requests in flight
+        or "p2c" (power of two choices), and/or make the commands matching sticky
+        (e.g. "AS_set_*") pin a client to its replica (enable=False stops that).
+        """
+        args = {}
+        if route is not None:
+            args.update(route=route, policy=policy)
+        if sticky is not None:
+            args.update(sticky=sticky, enable=int(enable))
+        return self.send_command("Central", "set_balancing", args)
+
+    def set_coalescing(self, command: str, enable: bool = True):
+        """
+        Let identical concurrent requests of the commands matching command (e.g. "AS_get_status")
+        share one backend call (enable=False sends each one separately).
+        """
+        return self.send_command("Central", "set_coalescing", {"command": command, "enable": int(enable)})
+
+    def start_recording(self, path: str):
+        """
+        Have Central log every backend request and its reply to path (appending),
+        for serving the session again with Replay_server. With several Central
+        workers each writes its own log, path.w0, path.w1, ...
+        """
+        return self.send_command("Central", "start_recording", {"path": path})
+
+    def stop_recording(self):
+        """Stop Central's session recording."""
+        return self.send_command("Central", "stop_recording")
+
+    def clear_cache(self, command: str | None = None):
+        """Drop Central's cached replies (all, or those of commands matching command)."""
+        return self.send_command("Central", "clear_cache", {"command": command} if command else {})
+
+    def subscribe(self, route: str, topic: str, keep: int = 4, timeout: float | None = None) -> Subscription:
+        """
+        Subscribe to a topic a backend publishes (e.g. subscribe("AS", "live") for live frames).
+        Central fans each message out to all subscribers, so viewers do not each poll
+        the backend. Returns a Subscription: iterate over it, or call get(timeout).
+        """
+        if timeout is None:
+            timeout = self.timeout
+        subscription = Subscription(f"{route}/{topic}", keep)
+        conn = self._connection(timeout)
+        ack = conn.subscribe(route, topic, subscription).result(timeout)
+        reply = unpackage_message(ack)[2]
+        if isinstance(reply, str) and "ERROR" in reply:
+            subscription._close()
+            raise RuntimeError(reply)
+        return subscription
 
     def send_parallel_commands(
         self,
@@ -80,7 +517,7 @@ class NotebookClient:
         timeout: float = 30.0
     ) -> List[Any]:
         """
-        Send many commands in parallel (fire-and-forget style, but ordered results).
+        Send many commands at once, pipelined on the shared connection (ordered results).
 
         Example:
             results = client.send_parallel_commands([
@@ -97,27 +534,52 @@ class NotebookClient:
         if not commands:
             return []
 
-        futures = []
-        for dest, cmd, args in commands:
-            future = self.executor.submit(
-                self.send_command,
-                destination=dest,
-                command=cmd,
-                args=args or {},
-                timeout=timeout
-            )
-            futures.append(future)
-
-        # Preserve original order
+        try:
+            conn = self._connection(timeout)
+            deadline = time.monotonic() + timeout
+            futures = [conn.submit(cmd, args or {}, dest, timeout_s=timeout,
+                                   shm=self.shared_memory and dest != "Central")
+                       for dest, cmd, args in commands]
+        except (ConnectionRefusedError, socket.timeout):
+            print(f"Could not connect to {self.host}:{self.port} after {timeout} seconds")
+            return [None] * len(commands)
+
+        # All requests are in flight on the shared connection; collect in order
         results = []
-        for future in as_completed(futures):
-            # Find which index this future belongs to
-            idx = futures.index(future)
+        for future in futures:
             try:
-                results.append((idx, future.result()))
-            except Exception as e:
-                results.append((idx, e))
+                data = future.result(max(0.0, deadline - time.monotonic()))
+                results.append(_decode(data))
+            except Exception:
+                conn.cancel(future)
+                results.append(None)
+        return results
 
-        # Sort by original index and extract values
-        results.sort(key=lambda x: x[0])
-        return [r if not isinstance(r, Exception) else None for _, r in results]
\ No newline at end of file
+    def send_batch(
+        self,
+        commands: Sequence[Tuple[str, str, dict | None]],
+        timeout: float | None = 30.0,
+        with_status: bool = False,
+    ) -> List[Any]:
+        """
+        Send many commands in one frame; Central runs them concurrently and
+        answers with one bundled reply, in order.
+
+        Returns the list of decoded payloads (None for entries that failed), or
+        with with_status a list of (status, payload) where status is "ok" or
+        "error" and the payload of a failed entry is its error message.
+        """
+        if not commands:
+            return []
+        entries = [[dest, cmd, args or {}] for dest, cmd, args in commands]
+        reply = self.send_command("Central", "batch", {"commands": entries}, timeout=timeout)
+        if reply is None:
+            # timed out or could not connect (already reported by send_command)
+            results = [("error", "no reply")] * len(entries)
+            return results if with_status else [None] * len(entries)
+        if not isinstance(reply, dict) or "status" not in reply:
+            raise RuntimeError(f"Unexpected batch reply: {reply!r}")
+        results = [(status, reply[str(i)]) for i, status in enumerate(reply["status"])]
+        if with_status:
+            return results
+        return [value if status == "ok" else None for status, value in results]
@@ -9,7 +9,7 @@ import numpy as np
 import time
 import sys
 
-from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol
+from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol, blocking
 from asyncroscopy.servers.protocols.utils import package_message, unpackage_message
 # sys.path.insert(0, "C:\\AE_future\\autoscript_1_14\\")
 sys.path.insert(0, "/Users/austin/Desktop/Projects/autoscript_tem_microscope_client")
@@ -33,9 +33,13 @@ class ASFactory(protocol.Factory):
 
 # PROTOCOL — handles per-connection command execution
 class ASProtocol(ExecutionProtocol):
+    # AutoScript calls block; run them one at a time, off the reactor
+    BLOCKING_THREADS = 1
+
     def __init__(self):
         super().__init__()
 
+    @blocking
     def connect_AS(self, args: dict):
         """Connect to the microscope via AutoScript"""
         host = args.get('host')
@@ -52,6 +56,7 @@ class ASProtocol(ExecutionProtocol):
             self.factory.microscope = None
         self.sendString(package_message(msg))
 
+    @blocking
     def get_scanned_image(self, scanning_detector, size, dwell_time):
         """Return a scanned image using the indicated detector"""
         size = int(size)
@@ -66,8 +71,9 @@ class ASProtocol(ExecutionProtocol):
                 size = size, 
                 dwell_time = dwell_time)
             self.factory.status = "Ready"
-            self.sendString(package_message(image))
+            self.sendMessage(image)
 
+    @blocking
     def get_stage(self):
         """Return current stage position"""
         positions = self.factory.microscope.specimen.stage.position
@@ -8,13 +8,16 @@ with electron beam damage effects.
 Tracks accumulated dose and simulates atom knockout probabilistically.
 """
 import ast
+import os
 import sys
+import threading
 import time
 import numpy as np
 
 from asyncroscopy.clients.notebook_client import NotebookClient
-from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol
-from asyncroscopy.servers.protocols.utils import package_message, unpackage_message
+from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol, RequestContext, blocking
+from asyncroscopy.servers.protocols.processes import attach_state
+from asyncroscopy.servers.protocols.utils import package_message, unpackage_message, Bundle
 
 from pathlib import Path
 from ase.io import read
@@ -38,6 +41,7 @@ import pyTEMlib.image_tools as it
 
 from twisted.internet import reactor, protocol
 from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
+from twisted.internet.task import LoopingCall
 
 import autoscript_tem_microscope_client as auto_script
 
@@ -69,6 +73,13 @@ class ASFactory(protocol.Factory):
         self.healing_rate = 0.01  # probability per second
         self.damage_threshold = 1e6  # e/Å² before significant damage
 
+        # Continuous acquisition published on the "live" topic
+        self.live_view = None  # LoopingCall
+
+        # held while acquisitions (in several threads) read and damage the sample, and while
+        # commands replace it; reentrant since an acquisition may load the default sample
+        self.sample_lock = threading.RLock()
+
     def buildProtocol(self, addr):
         """Create a new protocol instance and attach the factory (shared state)."""
         proto = ASProtocol()
@@ -76,8 +87,28 @@ class ASFactory(protocol.Factory):
         return proto
 
 
+def simulate_frame(ab, atoms, fov, pixel_size, counts):
+    """
+    Image synthesis for an acquisition, run in a worker process: pseudo potential, probe,
+    FFT convolution and noise. atoms is the StateHandle of the sample's positions and numbers.
+    """
+    state = attach_state(atoms)
+    xtal = Atoms(numbers=state["numbers"], positions=state["positions"])
+    frame = (0, fov, 0, fov)
+    potential = dg.create_pseudo_potential(xtal, pixel_size, sigma=1, bounds=frame, atom_frame=11)
+    probe = dg.get_probe(ab, potential)
+    image = dg.convolve_kernel(potential, probe)
+    noisy_image = dg.lowfreq_noise(image, noise_level=0.5, freq_scale=.04)
+    sim_im = dg.poisson_noise(noisy_image, counts=counts)
+    return np.array(sim_im, dtype=np.float32)
+
+
 # PROTOCOL — handles per-connection command execution
 class ASProtocol(ExecutionProtocol):
+    # acquisitions wait on Central for the probe, then on a worker process for the frame;
+    # the shared sample is only read and damaged under factory.sample_lock
+    BLOCKING_THREADS = os.cpu_count() or 4
+
     def __init__(self):
         super().__init__()
         allowed = []
@@ -123,17 +154,18 @@ class ASProtocol(ExecutionProtocol):
         xtal = read(cif_path)
         xtal = xtal * replicate
         xtal.set_pbc((True, True, False))
-        # Store atoms in factory (persistent state)
-        self.factory.atoms = xtal
-        
-        # Initialize dose map
-        ny = int(self.factory.fov / self.factory.pixel_size)
-        nx = int(self.factory.fov / self.factory.pixel_size)
-        self.factory.grid_shape = (ny, nx)
-        self.factory.dose_map = np.zeros((ny, nx), dtype=np.float64)
-        
-        # Initialize beam position at center
-        self.factory.beam_position = (self.factory.fov / 2, self.factory.fov / 2)
+        with self.factory.sample_lock:
+            # Store atoms in factory (persistent state)
+            self.factory.atoms = xtal
+
+            # Initialize dose map
+            ny = int(self.factory.fov / self.factory.pixel_size)
+            nx = int(self.factory.fov / self.factory.pixel_size)
+            self.factory.grid_shape = (ny, nx)
+            self.factory.dose_map = np.zeros((ny, nx), dtype=np.float64)
+
+            # Initialize beam position at center
+            self.factory.beam_position = (self.factory.fov / 2, self.factory.fov / 2)
         
         msg = f"Loaded sample with {len(xtal)} atoms. Dose map initialized."
         self.sendString(package_message(msg))
@@ -164,6 +196,7 @@ class ASProtocol(ExecutionProtocol):
         self.log.info(f"[AS] {msg}")
         self.sendString(package_message(msg))
 
+    @blocking
     def unblank_beam(self, args: dict):
         """Unblank the electron beam and start dose accumulation"""
         duration = float(args.get('duration', 1))  # seconds
@@ -190,21 +223,22 @@ class ASProtocol(ExecutionProtocol):
     def set_fov(self, args: dict):
         """Set the field of view in angstroms"""
         fov = float(args.get('fov'))
-        old_fov = self.factory.fov
-        self.factory.fov = fov
-        
-        # Update grid shape if atoms are loaded
-        if self.factory.atoms is not None:
-            ny = int(self.factory.fov / self.factory.pixel_size)
-            nx = int(self.factory.fov / self.factory.pixel_size)
-            old_shape = self.factory.grid_shape
-            self.factory.grid_shape = (ny, nx)
-            
-            # Resize dose map (interpolate or recreate)
-            self.factory.dose_map = np.zeros((ny, nx), dtype=np.float64)
-            msg = f"FOV changed from {old_fov} to {fov} Å. Grid: {old_shape} → {self.factory.grid_shape}. Dose map reset."
-        else:
-            msg = f"FOV set to {fov} Å"
+        with self.factory.sample_lock:
+            old_fov = self.factory.fov
+            self.factory.fov = fov
+
+            # Update grid shape if atoms are loaded
+            if self.factory.atoms is not None:
+                ny = int(self.factory.fov / self.factory.pixel_size)
+                nx = int(self.factory.fov / self.factory.pixel_size)
+                old_shape = self.factory.grid_shape
+                self.factory.grid_shape = (ny, nx)
+
+                # Resize dose map (interpolate or recreate)
+                self.factory.dose_map = np.zeros((ny, nx), dtype=np.float64)
+                msg = f"FOV changed from {old_fov} to {fov} Å. Grid: {old_shape} → {self.factory.grid_shape}. Dose map reset."
+            else:
+                msg = f"FOV set to {fov} Å"
         
         self.log.info(f"[AS] {msg}")
         self.sendString(package_message(msg))
@@ -226,7 +260,7 @@ class ASProtocol(ExecutionProtocol):
         # Get real probe from microscope model
         tem = NotebookClient.connect(host='localhost', port=9000)
         ab = tem.send_command(destination='Ceos', command='getAberrations', args={})
-        ab = ast.literal_eval(ab)
+        ab = dict(ab)  # Ceos replies with a structured dict
         ab['acceleration_voltage'] = self.factory.acceleration_voltage
         ab['FOV'] = self.factory.fov / 12
         ab['convergence_angle'] = 30  # mrad
@@ -235,24 +269,26 @@ class ASProtocol(ExecutionProtocol):
 
 
         print('probe created')
-        # Convert normalized position → pixel indices
-        x_norm, y_norm = self.factory.beam_position
-        ny, nx = self.factory.grid_shape
-        x_pix = int(x_norm * nx)
-        y_pix = int(y_norm * ny)
-        cx = nx // 2
-        cy = ny // 2
-        shift_x = x_pix - cx
-        shift_y = y_pix - cy
-
-        # this can lead to unphysical results near edge
-        beam_profile = np.roll(probe,shift=(shift_y, shift_x),axis=(0, 1))
-
-        pixel_area = self.factory.pixel_size ** 2  # Å²
-        dose_increment = beam_profile * total_electrons / pixel_area
-        self.factory.dose_map += dose_increment
-
-        self._apply_damage_model()
+        with self.factory.sample_lock:
+            # Convert normalized position → pixel indices
+            x_norm, y_norm = self.factory.beam_position
+            ny, nx = self.factory.grid_shape
+            x_pix = int(x_norm * nx)
+            y_pix = int(y_norm * ny)
+            cx = nx // 2
+            cy = ny // 2
+            shift_x = x_pix - cx
+            shift_y = y_pix - cy
+
+            # this can lead to unphysical results near edge
+            beam_profile = np.roll(probe,shift=(shift_y, shift_x),axis=(0, 1))
+
+            pixel_area = self.factory.pixel_size ** 2  # Å²
+            dose_increment = beam_profile * total_electrons / pixel_area
+            self.factory.dose_map += dose_increment
+
+            self._apply_damage_model()
+        self._publish_dose_map()
 
     def _apply_damage_model(self, dose_map=None):
         """
@@ -354,6 +390,40 @@ class ASProtocol(ExecutionProtocol):
                 f"(knock-on + radiolysis + instability)")
 
 
+    def start_live_view(self, args: dict):
+        """Acquire frames continuously (same args as get_scanned_image, plus interval in s) for "live" subscribers"""
+        interval = float(args.get('interval', 1.0))
+        self.stop_live_view(None, reply=False)
+        self.factory.live_view = LoopingCall(self._live_frame, dict(args))
+        self.factory.live_view.start(interval, now=False)
+        msg = f"Live view started, one frame every {interval} s while subscribed to 'live'"
+        self.log.info(f"[AS] {msg}")
+        self.sendString(package_message(msg))
+
+    def stop_live_view(self, args=None, reply=True):
+        """Stop the continuous acquisition"""
+        if self.factory.live_view is not None and self.factory.live_view.running:
+            self.factory.live_view.stop()
+        self.factory.live_view = None
+        if reply:
+            self.sendString(package_message("Live view stopped"))
+
+    def _live_frame(self, args: dict):
+        # nobody is watching: stop scanning rather than dosing the sample for nothing
+        if not self.topics.subscribers("live"):
+            self.log.info("[AS] No live viewers left, stopping live view")
+            self.stop_live_view(reply=False)
+            return
+        # in the acquisition thread, like get_scanned_image; the next frame waits for this one.
+        # It answers no request: anything it would send besides publishing is dropped
+        context = RequestContext()
+        context.replied = True
+        return self._run_blocking(self._acquire_image, args, context)
+
+    def _publish_dose_map(self):
+        if self.topics.subscribers("dose_map"):
+            self.topics.publish("dose_map", np.array(self.factory.dose_map, dtype=np.float32))
+
     def get_dose_map(self, args=None):
         """Return the current accumulated dose map"""
         if self.factory.dose_map is None:
@@ -361,7 +431,7 @@ class ASProtocol(ExecutionProtocol):
             self.sendString(package_message(msg))
         else:
             dose_map = np.array(self.factory.dose_map, dtype=np.float32)
-            self.sendString(package_message(dose_map))
+            self.sendMessage(dose_map)
 
     def get_atom_count(self, args=None):
         """Return the current number of atoms in the sample"""
@@ -382,8 +452,43 @@ class ASProtocol(ExecutionProtocol):
         self.log.info(f"[AS] {msg}")
         self.sendString(package_message(msg))
 
+    @blocking
     def get_scanned_image(self, args: dict):
         """Return a scanned image using the indicated detector"""
+        image = self._acquire_image(args)
+        if image is not None:
+            self.sendMessage(image)
+
+    @blocking
+    def get_scan_bundle(self, args: dict):
+        """Return a scanned image together with the dose map, atom count and acquisition parameters"""
+        # the sample as this scan left it, taken under the same lock as the frame's atoms
+        snapshot = {}
+        image = self._acquire_image(args, snapshot)
+        if image is None:
+            self.sendString(package_message("Error: acquisition rejected"))
+            return
+        self.sendMessage(Bundle(
+            image=image,
+            dose_map=snapshot["dose_map"],
+            atom_count=np.array([snapshot["atom_count"]], dtype=np.int64),
+            params={
+                "scanning_detector": args.get('scanning_detector'),
+                "size": int(args.get('size')),
+                "dwell_time": float(args.get('dwell_time')),
+                "fov": snapshot["fov"],
+                "pixel_size": snapshot["pixel_size"],
+                "beam_current": snapshot["beam_current"],
+                "beam_blanked": self.factory.beam_blanked,
+            },
+        ))
+
+    def _acquire_image(self, args: dict, snapshot=None):
+        """
+        Simulate a scanned image and apply the scan dose; returns None if rejected.
+        If given, snapshot is filled with the dose map, atom count and scan parameters
+        read under the same sample_lock as the atoms the frame is simulated from.
+        """
         scanning_detector = args.get('scanning_detector')
         size = args.get('size')
         dwell_time = args.get('dwell_time')
@@ -400,41 +505,48 @@ class ASProtocol(ExecutionProtocol):
             # Get probe
             tem = NotebookClient.connect(host='localhost', port=9000)
             ab = tem.send_command(destination='Ceos', command='getAberrations', args={})
-            ab = ast.literal_eval(ab)
+            ab = dict(ab)  # Ceos replies with a structured dict
             ab['acceleration_voltage'] = self.factory.acceleration_voltage
-            fov = self.factory.fov
-            ab['FOV'] = fov / 12
             ab['convergence_angle'] = 30  # mrad
             ab['wavelength'] = it.get_wavelength(ab['acceleration_voltage'])
 
-            # Use current atoms state (with damage applied)
-            if self.factory.atoms is None:
-                self.log.warning("[AS] No sample loaded. Loading default...")
-                self.load_sample({})
-            
-            xtal = self.factory.atoms
-            positions = xtal.get_positions()[:, :2]
-            pixel_size = self.factory.pixel_size
-            frame = (0, fov, 0, fov)
-            
-            # Generate image from current atom configuration
-            potential = dg.create_pseudo_potential(xtal, pixel_size, sigma=1, bounds=frame, atom_frame=11)
-            probe = dg.get_probe(ab, potential)
-            image = dg.convolve_kernel(potential, probe)
-            noisy_image = dg.lowfreq_noise(image, noise_level=0.5, freq_scale=.04)
-
-            scan_time = dwell_time * size * size
-            counts = scan_time * (self.factory.beam_current * 1e-12) / (1.602e-19)
-            sim_im = dg.poisson_noise(noisy_image, counts=counts)
-
-            # Apply dose during scan
-            self.factory.dose_map += dwell_time * (self.factory.beam_current * 1e-12) / (1.602e-19)
-            delta_dose = np.zeros_like(self.factory.dose_map) + dwell_time * (self.factory.beam_current * 1e-12) / (1.602e-19)
-            self._apply_damage_model(dose_map=delta_dose)
-
-            image = np.array(sim_im, dtype=np.float32)
+            # Snapshot the sample for the frame, then apply the scan's dose to it
+            with self.factory.sample_lock:
+                if self.factory.atoms is None:
+                    self.log.warning("[AS] No sample loaded. Loading default...")
+                    self.load_sample({})
+
+                xtal = self.factory.atoms
+                atoms = self.processes.state.publish(
+                    "atoms", positions=xtal.get_positions(), numbers=xtal.get_atomic_numbers())
+                fov = self.factory.fov
+                pixel_size = self.factory.pixel_size
+                beam_current = self.factory.beam_current
+                scan_time = dwell_time * size * size
+                counts = scan_time * (beam_current * 1e-12) / (1.602e-19)
+
+                # Apply dose during scan
+                self.factory.dose_map += dwell_time * (beam_current * 1e-12) / (1.602e-19)
+                delta_dose = np.zeros_like(self.factory.dose_map) + dwell_time * (beam_current * 1e-12) / (1.602e-19)
+                self._apply_damage_model(dose_map=delta_dose)
+
+                if snapshot is not None:
+                    snapshot.update(
+                        dose_map=np.array(self.factory.dose_map, dtype=np.float32),
+                        atom_count=len(self.factory.atoms),
+                        fov=fov,
+                        pixel_size=pixel_size,
+                        beam_current=beam_current,
+                    )
+            self._publish_dose_map()
+            ab['FOV'] = fov / 12
+
+            # Generate image from the atom configuration it was scanned with
+            image = self.processes.run(simulate_frame, ab, atoms, fov, pixel_size, counts)
+            # every acquired frame also goes to live viewers
+            self.topics.publish("live", image)
             self.factory.status = "Ready"
-            self.sendString(package_message(image))
+            return image
 
 
     def get_stage(self, args=None):
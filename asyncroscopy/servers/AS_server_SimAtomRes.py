@@ -7,17 +7,20 @@ designed to work ith Ceos digital twin
 to get real probes and simulate images
 mirrors the real thing.
 """
-import ast
+import os
 import sys
+import threading
 import time
 import numpy as np
 
 from asyncroscopy.clients.notebook_client import NotebookClient
-from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol
+from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol, blocking
+from asyncroscopy.servers.protocols.processes import attach_state
 from asyncroscopy.servers.protocols.utils import package_message, unpackage_message
 
 from pathlib import Path
 from ase.io import read
+from ase import Atoms
 
 HERE = Path(__file__).resolve().parent
 PROJECT_ROOT = HERE.parent  # removes "servers"
@@ -51,6 +54,22 @@ class ASFactory(protocol.Factory):
         self.microscope = None
         self.detectors = {}
         self.status = "Offline"
+        self._crystal = None
+        self._crystal_lock = threading.Lock()
+
+    def crystal(self):
+        """The simulated sample (read from its CIF once)"""
+        with self._crystal_lock:
+            if self._crystal is None:
+                cif_path = (
+                    PROJECT_ROOT
+                    / "cloned_repos"
+                    / "pystemsim"
+                    / "WS2_ortho.cif"
+                )
+                print("Reading CIF from:", cif_path)
+                self._crystal = read(cif_path) * (30, 20, 1)
+            return self._crystal
 
     def buildProtocol(self, addr):
         """Create a new protocol instance and attach the factory (shared state)."""
@@ -59,8 +78,25 @@ class ASFactory(protocol.Factory):
         return proto
 
 
+def simulate_image(ab, atoms, fov, pixel_size):
+    """
+    Image synthesis for get_scanned_image, run in a worker process: pseudo potential,
+    probe and FFT convolution. atoms is the StateHandle of the sample's positions and numbers.
+    """
+    state = attach_state(atoms)
+    xtal = Atoms(numbers=state["numbers"], positions=state["positions"])
+    frame = (0, fov, 0, fov)  # limits of the image in angstroms
+    potential = dg.create_pseudo_potential(xtal, pixel_size, sigma=1, bounds=frame, atom_frame=11)
+    probe = dg.get_probe(ab, potential)
+    image = dg.convolve_kernel(potential, probe)
+    return np.array(image, dtype=np.float32)
+
+
 # PROTOCOL — handles per-connection command execution
 class ASProtocol(ExecutionProtocol):
+    # frames are simulated in worker processes, one per core; these threads wait for them
+    BLOCKING_THREADS = os.cpu_count() or 4
+
     def __init__(self):
         super().__init__()
         allowed = []
@@ -88,6 +124,7 @@ class ASProtocol(ExecutionProtocol):
         msg = f"Beam current set to {beam_current} pA"
         self.sendString(package_message(msg))
 
+    @blocking
     def get_scanned_image(self, args: dict):
         """Return a scanned image using the indicated detector"""
         scanning_detector = args.get('scanning_detector')
@@ -107,44 +144,21 @@ class ASProtocol(ExecutionProtocol):
             # connect to central through the client
             tem = NotebookClient.connect(host='localhost',port=9000)
             ab = tem.send_command(destination = 'Ceos', command = 'getAberrations', args = {})
-            ab = ast.literal_eval(ab)
+            ab = dict(ab)  # Ceos replies with a structured dict
             ab['acceleration_voltage'] = 60e3 # eV
             fov = 96 # angstroms
             ab['FOV'] = fov /12 # Angstroms
             ab['convergence_angle'] = 30 # mrad
             ab['wavelength'] = it.get_wavelength(ab['acceleration_voltage'])
 
-            # make image
+            # make image in a worker process
             # with pystemsim data generator
-            # print("check the cif path ")
-            cif_path = (
-                PROJECT_ROOT
-                / "cloned_repos"
-                / "pystemsim"
-                / "WS2_ortho.cif"
-            )
-            print("Reading CIF from:", cif_path)
-            xtal = read(cif_path)
-            # xtal = read('asyncroscopy/cloned_repos/pystemsim/WS2_ortho.cif')
-            xtal = xtal * (30, 20, 1)
-            positions = xtal.get_positions()[:, :2]
-            pixel_size = 0.106 # angstrom/pixel
-            frame = (0,fov,0,fov) # limits of the image in angstroms
-            potential = dg.create_pseudo_potential(xtal, pixel_size, sigma=1, bounds=frame, atom_frame=11)
-            probe = dg.get_probe(ab, potential)
-            image = dg.convolve_kernel(potential, probe)
-            noisy_image = dg.lowfreq_noise(image, noise_level=0.5, freq_scale=.04)
-
-            scan_time = dwell_time * size * size
-            counts = scan_time * (self.factory.beam_current * 1e-12) / (1.602e-19)
-            sim_im = dg.poisson_noise(noisy_image, counts=counts)
-            # convert args dict
-
-            # time.sleep(1)
-            image = np.array(image, dtype=np.float32)
-            # image = (np.random.rand(size, size) * 255).astype(np.uint8)
+            xtal = self.factory.crystal()
+            atoms = self.processes.state.publish(
+                "atoms", positions=xtal.get_positions(), numbers=xtal.get_atomic_numbers())
+            image = self.processes.run(simulate_image, ab, atoms, fov, 0.106)  # 0.106 angstrom/pixel
             self.factory.status = "Ready"
-            self.sendString(package_message(image))
+            self.sendMessage(image)
 
 
     def get_stage(self, args=None):
@@ -160,7 +174,8 @@ class ASProtocol(ExecutionProtocol):
 
 
 if __name__ == "__main__":
-    port = 9001
+    # run several on different ports to give Central a replica set, e.g. "AS": [("localhost", 9001), ("localhost", 9011)]
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 9001
     print(f"[AS] Server running on port {port}...")
     reactor.listenTCP(port, ASFactory())
     reactor.run()
\ No newline at end of file
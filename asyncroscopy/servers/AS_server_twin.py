@@ -9,7 +9,7 @@ import numpy as np
 import time
 import sys
 
-from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol
+from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol, blocking
 from asyncroscopy.servers.protocols.utils import package_message, unpackage_message
 # sys.path.insert(0, "C:\\AE_future\\autoscript_1_14\\")
 sys.path.insert(0, "/Users/austin/Desktop/Projects/autoscript_tem_microscope_client")
@@ -52,6 +52,7 @@ class ASProtocol(ExecutionProtocol):
         msg = "Connected to Digital Twin microscope."
         self.sendString(package_message(msg))
 
+    @blocking
     def get_scanned_image(self, args: dict):
         """Return a scanned image using the indicated detector"""
         scanning_detector = args.get('scanning_detector')
@@ -68,7 +69,7 @@ class ASProtocol(ExecutionProtocol):
             time.sleep(5)
             image = (np.random.rand(size, size) * 255).astype(np.uint8)
             self.factory.status = "Ready"
-            self.sendString(package_message(image))
+            self.sendMessage(image)
 
     def get_stage(self, args=None):
         """Return current stage position (placeholder)"""
@@ -2,8 +2,8 @@
 
 """
 the real thing.
-not async yet (socket)
 this one is really just a translator for the real CEOS server.
+requests go to CEOS over a blocking socket, in the blocking-handler thread.
 """
 
 import logging
@@ -11,13 +11,17 @@ import json
 import traceback
 import socket
 from twisted.internet import reactor,defer, protocol
-from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol
-from asyncroscopy.servers.protocols.utils import package_message, unpackage_message
+from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol, RequestContext
+from asyncroscopy.servers.protocols.utils import (
+    package_message, unpackage_message, parse_request, message_tag, request_deadline,
+)
 
 logging.basicConfig()
 log = logging.getLogger('CEOS_acquisition')
 log.setLevel(logging.INFO)
 
+CEOS_TIMEOUT = 3000   # seconds to wait for CEOS when the request has no deadline
+
 # FACTORY — holds shared state (persistent across all connections)
 class CeosFactory(protocol.Factory):
     def __init__(self):
@@ -35,6 +39,9 @@ class CeosFactory(protocol.Factory):
 
 # PROTOCOL — handles per-connection command execution
 class CeosProtocol(ExecutionProtocol):
+    # one request at a time to CEOS (message ids are numbered per server)
+    BLOCKING_THREADS = 1
+
     def __init__(self):
         super().__init__()
         self.host = "10.46.217.241"
@@ -44,12 +51,37 @@ class CeosProtocol(ExecutionProtocol):
 
     # Override stringReceived for special case of Ceos commands
     def stringReceived(self, data: bytes):
-        msg = data.decode().strip()
-        print(f"[Exec] Received: {msg}")
-        parts = msg.split()
-        cmd, *args_parts = parts
+        self._request = RequestContext(message_tag(data))
+        try:
+            request = parse_request(data)
+            print(f"[Exec] Received: {request}")
+            if request is None:
+                raise ValueError("Empty command")
+            self._request.deadline = request_deadline(request)
+            self._request.timer = self.metrics.start(type(self).__name__, request["cmd"], len(data))
+            if request["cmd"] == "stats":
+                self.stats(request.get("args"))
+            elif request["cmd"] == "ping":
+                self.ping()
+            else:
+                context = self._request
+                self._run_blocking(self._forward_to_ceos, request, context).addErrback(
+                    self._ceos_failed, context)
+        except Exception:
+            err = traceback.format_exc()
+            log.error("CEOS request failed: %s", err)
+            self._send_error(err)
+        finally:
+            self._request = None
 
-        args_dict = dict(arg.split('=', 1) for arg in args_parts if '=' in arg)
+    def _ceos_failed(self, failure, context):
+        err = failure.getTraceback()
+        log.error("CEOS request failed: %s", err)
+        self._send_error(err, context)
+
+    def _forward_to_ceos(self, request: dict):
+        cmd = request["cmd"]
+        args_dict = request.get("args") or {}
         payload = {
             "jsonrpc":"2.0",
             "id":self._nextMessageID,
@@ -58,13 +90,20 @@ class CeosProtocol(ExecutionProtocol):
         }
         print("[Exec] Sending payload to CEOS:", payload)
         # Serialize dict to JSON bytes
-        payload_bytes = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        # typed envelopes may carry ndarrays; CEOS expects plain JSON lists
+        payload_bytes = json.dumps(payload, separators=(",", ":"),
+                                   default=lambda o: o.tolist()).encode("utf-8")
         netstring = f"{len(payload_bytes)}:".encode("ascii") + payload_bytes + b","
         print("[Exec] Netstring to send:", netstring)
 
         self._nextMessageID += 1
 
-        with socket.create_connection((self.host, self.port), timeout=3000) as sock:
+        # wait for CEOS no longer than the caller waits for us
+        timeout = CEOS_TIMEOUT if self.time_left is None else self.time_left
+        if timeout <= 0:
+            raise TimeoutError(f"Deadline of '{cmd}' passed before it could run")
+
+        with socket.create_connection((self.host, self.port), timeout=timeout) as sock:
             sock.sendall(netstring)
 
             # Read until we hit a complete netstring (ends with b",")
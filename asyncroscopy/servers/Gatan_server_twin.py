@@ -9,7 +9,7 @@ import numpy as np
 import time
 import sys
 
-from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol
+from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol, blocking
 from asyncroscopy.servers.protocols.utils import package_message, unpackage_message
 
 
@@ -38,6 +38,7 @@ class GatanProtocol(ExecutionProtocol):
         msg = "[Gatan] Connected to Gatan."
         self.sendString(package_message(msg))
 
+    @blocking
     def get_spectrum(self, args: dict):
         """Simulate a core-loss eels spectrum"""
         size = args.get('size')
@@ -51,7 +52,7 @@ class GatanProtocol(ExecutionProtocol):
          + np.random.normal(0, 5, size)).astype(np.float32)
         print(package_message(spectrum))
 
-        self.sendString(package_message(spectrum))
+        self.sendMessage(spectrum)
 
     def get_status(self, args=None):
         """Return the status"""
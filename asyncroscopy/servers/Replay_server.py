@@ -0,0 +1,146 @@
+# Replay_server.py
+
+"""
+Serves a session recorded by Central (Central_start_recording) in place of a
+backend, at the recorded speed or faster, so that Central and client code can
+be benchmarked on real runs without the simulator or the microscope.
+
+    python -m asyncroscopy.servers.Replay_server session.rec --route AS --port 9001 --speed 10
+"""
+
+import argparse
+import logging
+import mmap
+
+from twisted.internet import reactor, protocol
+from twisted.internet.defer import Deferred
+
+from asyncroscopy.servers.protocols.execution_protocol import ExecutionProtocol
+from asyncroscopy.servers.protocols.cache import ResponseCache
+from asyncroscopy.servers.protocols.recording import record_spans
+from asyncroscopy.servers.protocols.utils import decode_object
+
+logging.basicConfig()
+log = logging.getLogger("Replay")
+log.setLevel(logging.INFO)
+
+
+class ReplaySession:
+    """
+    The recorded replies of one route, looked up by command and arguments.
+    A request gets the next recorded reply of the same command with the same
+    arguments, cycling through them once all were served. A request with
+    arguments that were never recorded gets the next reply of the command
+    whatever its arguments (counted as a miss), so runs that explore other
+    parameters than the recorded one still replay. The logs are memory mapped:
+    the index keeps the offsets of the records, and a record is decoded when it
+    is served, its reply frames as views on the log.
+    """
+
+    def __init__(self, paths, route: str | None = None):
+        self.maps = []
+        self.by_args = {}      # (cmd, encoded args) -> [(log, start, end) of a record]
+        self.by_command = {}   # cmd -> [(log, start, end) of a record]
+        self.cursors = {}
+        self.hits = self.misses = 0
+        for path in paths:
+            with open(path, "rb") as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps.append(buf)
+            for start, end in record_spans(buf):
+                # the reply frames are skipped over, not copied out of the log
+                record = decode_object(memoryview(buf)[start:end], views=True)
+                if route is not None and record["route"] != route:
+                    continue
+                location = (buf, start, end)
+                cmd = record["cmd"]
+                self.by_args.setdefault(self._key(cmd, record["args"]), []).append(location)
+                self.by_command.setdefault(cmd, []).append(location)
+                del record
+        log.info("[Replay] %d recorded requests of %d commands", sum(map(len, self.by_command.values())),
+                 len(self.by_command))
+
+    @staticmethod
+    def _key(cmd: str, args: dict):
+        return ResponseCache.key("", cmd, args)
+
+    @property
+    def commands(self):
+        return self.by_command.keys()
+
+    def next(self, cmd: str, args: dict):
+        """The record to answer a request with (None if cmd was never recorded)."""
+        key = self._key(cmd, args)
+        if key in self.by_args:
+            self.hits += 1
+            locations = self.by_args[key]
+        elif cmd in self.by_command:
+            self.misses += 1
+            key, locations = cmd, self.by_command[cmd]
+        else:
+            return None
+        i = self.cursors.get(key, 0)
+        self.cursors[key] = (i + 1) % len(locations)
+        buf, start, end = locations[i]
+        return decode_object(memoryview(buf)[start:end], views=True)
+
+
+# FACTORY — holds the session shared by all connections
+class ReplayFactory(protocol.Factory):
+    def __init__(self, session: ReplaySession, speed: float = 1.0):
+        self.session = session
+        self.speed = speed   # 1: recorded latencies, 10: ten times faster, 0: no delay
+
+    def buildProtocol(self, addr):
+        proto = ReplayBackend()
+        proto.factory = self
+        return proto
+
+
+# PROTOCOL — answers recorded commands with their recorded replies
+class ReplayBackend(ExecutionProtocol):
+    """
+    Backend that answers every recorded command with a recorded reply, after
+    the recorded latency divided by the factory's speed. The ExecutionProtocol
+    commands (ping, stats, subscribe, ...) are served as by any backend.
+    """
+
+    def _command(self, cmd: str):
+        if cmd in self.allowed_commands or cmd not in self.factory.session.commands:
+            return super()._command(cmd)
+        return lambda args: self._replay(cmd, args)
+
+    def _replay(self, cmd: str, args: dict):
+        record = self.factory.session.next(cmd, args)
+        request = self._request
+        request.error = record["error"]
+        reply = record["reply"]
+        # a whole reply may go through shared memory if the request asked for it
+        frames = self._message_frames(reply, request) if len(reply) == 1 else [[frame] for frame in reply]
+        speed = self.factory.speed
+        if not speed:
+            self._reply(frames)
+            return None
+        d = Deferred()
+        reactor.callLater(record["elapsed"] / speed, d.callback, None)
+        d.addCallback(lambda _: self._reply(frames, request))
+        return d
+
+    def replay_stats(self, args=None):
+        """How many requests matched a recorded one exactly (hits) or only by command (misses)."""
+        session = self.factory.session
+        self.sendMessage({"hits": session.hits, "misses": session.misses, "speed": self.factory.speed})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a recorded session in place of a backend")
+    parser.add_argument("paths", nargs="+", help="session logs written by Central_start_recording")
+    parser.add_argument("--route", default=None, help="serve the requests recorded for this route only")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay latencies this many times faster (0: answer at once)")
+    options = parser.parse_args()
+    factory = ReplayFactory(ReplaySession(options.paths, options.route), options.speed)
+    print(f"[Replay] Server running on port {options.port}...")
+    reactor.listenTCP(options.port, factory)
+    reactor.run()
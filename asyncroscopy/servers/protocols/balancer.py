@@ -0,0 +1,122 @@
+'''
+Replica sets: routes served by several identical backends, and how Central picks one.
+'''
+
+import logging
+import random
+from fnmatch import fnmatchcase
+
+log = logging.getLogger("central")
+
+POLICIES = ("least", "p2c")
+
+# "<route>_<command>" patterns of commands that change backend state: a client
+# that sends one is pinned to the replica that ran it (see ReplicaBalancer)
+DEFAULT_STICKY = [
+    "*_connect_AS",
+    "*_set_*",
+    "*_load_sample",
+    "*_reset_sample",
+    "*_place_beam",
+    "*_unblank_beam",
+]
+
+
+def replicas_of(entry) -> list:
+    """Routing table entry, (host, port) or a list of them -> list of (host, port)."""
+    if len(entry) == 2 and isinstance(entry[0], str):
+        return [(entry[0], int(entry[1]))]
+    return [(host, int(port)) for host, port in entry]
+
+
+def normalize_route(entry):
+    """Routing table entry as stored: (host, port) for one backend, a list of them for a replica set."""
+    replicas = replicas_of(entry)
+    if not replicas:
+        raise ValueError("A route needs at least one (host, port)")
+    return replicas[0] if len(replicas) == 1 else replicas
+
+
+class ReplicaBalancer:
+    """
+    Picks the replica of a route that runs a request.
+
+    Policies (per route, default "least"):
+      least: the replica with the fewest requests in flight from this Central.
+      p2c:   the less loaded of two replicas picked at random (power of two choices),
+             which spreads load better when several Centrals share the replicas.
+
+    Sticky routing: replicas do not share state, so a client that sends a
+    command matching a sticky pattern (e.g. AS_set_current) is pinned to the
+    replica that ran it, and all its later requests on that route go there.
+    Clients that never change state are balanced freely. A pin is dropped when
+    the client disconnects; if the pinned replica goes down, the client is
+    moved to another one (and its state there is whatever that replica has).
+    """
+
+    def __init__(self, policy: str = "least", sticky=None, rng=None):
+        self.policy = policy
+        self.policies = {}   # route -> policy
+        self.sticky = list(DEFAULT_STICKY if sticky is None else sticky)
+        self.in_flight = {}  # (host, port) -> requests running
+        self.pins = {}       # (client, route) -> (host, port)
+        self.rng = rng or random.Random()
+
+    def is_sticky(self, name: str) -> bool:
+        return any(fnmatchcase(name, pattern) for pattern in self.sticky)
+
+    def set_sticky(self, pattern: str, sticky: bool = True):
+        if pattern in self.sticky:
+            self.sticky.remove(pattern)
+        if sticky:
+            self.sticky.append(pattern)
+
+    def set_policy(self, route: str, policy: str):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown balancing policy '{policy}' (use one of {', '.join(POLICIES)})")
+        self.policies[route] = policy
+
+    def pick(self, route: str, replicas: list, client=None, sticky: bool = False, usable=None):
+        """
+        The replica to send a request to, or None if no replica is usable.
+        usable(address) is asked about the chosen replica only (it may reserve a trial
+        request on a recovering backend); replicas it refuses are skipped.
+        """
+        pinned = self.pins.get((client, route)) if client is not None else None
+        if pinned in replicas and (usable is None or usable(pinned)):
+            return pinned
+
+        candidates = list(replicas)
+        while candidates:
+            address = self._choose(route, candidates)
+            if usable is None or usable(address):
+                if client is not None and (sticky or pinned is not None):
+                    if pinned is not None:
+                        log.warning("[Central] %s replica %s:%d is unavailable, moving a pinned client to %s:%d",
+                                    route, *pinned, *address)
+                    self.pins[(client, route)] = address
+                return address
+            candidates.remove(address)
+        return None
+
+    def _choose(self, route: str, candidates: list):
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.policies.get(route, self.policy) == "p2c":
+            candidates = self.rng.sample(candidates, 2)
+        pinned = list(self.pins.values())
+        # least loaded; ties go to the replica with fewer pinned clients, then at random
+        return min(candidates, key=lambda a: (self.in_flight.get(a, 0), pinned.count(a), self.rng.random()))
+
+    def acquire(self, address):
+        self.in_flight[address] = self.in_flight.get(address, 0) + 1
+
+    def release(self, result, address):
+        """Count a request on address as finished; passes result through."""
+        self.in_flight[address] -= 1
+        return result
+
+    def unpin(self, client):
+        """Forget the pins of a client (it disconnected)."""
+        for key in [key for key in self.pins if key[0] is client]:
+            del self.pins[key]
@@ -0,0 +1,211 @@
+'''
+Response cache and single-flight coalescing for read-only backend commands, used by Central.
+'''
+
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+from twisted.internet.defer import Deferred
+
+from asyncroscopy.servers.protocols.utils import encode_object, is_error_reply
+
+# "<route>_<command>" pattern -> seconds a reply stays valid
+DEFAULT_CACHE_TTLS = {
+    "Ceos_getAberrations": 30.0,
+    "*_get_status": 0.5,
+    "*_discover_commands": 300.0,
+    "*_get_help": 300.0,
+}
+
+# write command pattern -> patterns of the cached reads it makes stale
+DEFAULT_CACHE_INVALIDATIONS = {
+    "Ceos_uploadAberrations": ["Ceos_getAberrations"],
+    "Ceos_correctAberration": ["Ceos_getAberrations"],
+    "Ceos_runTableau": ["Ceos_getAberrations"],
+}
+
+# "<route>_<command>" patterns of reads whose identical concurrent requests share one backend call
+DEFAULT_COALESCED = [
+    "Ceos_getAberrations",
+    "*_get_status",
+    "*_get_stage",
+    "*_discover_commands",
+    "*_get_help",
+]
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of raw backend replies, keyed by route, command and arguments.
+
+    Only commands matching a TTL rule are cached. A command matching an
+    invalidation rule evicts the cached replies of the commands its rule
+    names, both when it is sent and when its reply arrives. A read that was
+    in flight while an invalidation happened is not stored, so a reply that
+    predates a write never lands in the cache.
+    """
+
+    def __init__(self, ttls=None, invalidations=None, max_entries: int = 256,
+                 max_bytes: int = 64 * 1024 * 1024, clock=time.monotonic):
+        self.ttls = dict(DEFAULT_CACHE_TTLS if ttls is None else ttls)
+        self.invalidations = {
+            k: list(v) for k, v in (DEFAULT_CACHE_INVALIDATIONS if invalidations is None else invalidations).items()
+        }
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.generation = 0   # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (expires, reply)
+        self._size = 0
+        self.on_write = None   # called with the name of every write noted (to tell other Central workers)
+
+    # ----- rules -----
+    def ttl(self, name: str):
+        """TTL in seconds for "<route>_<command>", or None if it is not cacheable."""
+        ttl = self.ttls.get(name)
+        if ttl is None:
+            for pattern, value in self.ttls.items():
+                if fnmatchcase(name, pattern):
+                    ttl = value
+                    break
+        return ttl if ttl and ttl > 0 else None
+
+    def set_ttl(self, pattern: str, ttl: float):
+        """Cache replies of commands matching pattern for ttl seconds (0 stops caching them)."""
+        if ttl > 0:
+            self.ttls[pattern] = ttl
+        else:
+            self.ttls.pop(pattern, None)
+        self.invalidate_matching(pattern)
+
+    def set_invalidation(self, pattern: str, stale):
+        """Commands matching pattern evict cached replies matching any of the stale patterns."""
+        if stale:
+            self.invalidations[pattern] = list(stale)
+        else:
+            self.invalidations.pop(pattern, None)
+
+    @staticmethod
+    def key(route: str, cmd: str, args: dict):
+        return route, cmd, encode_object(dict(sorted(args.items(), key=lambda kv: str(kv[0]))))
+
+    # ----- lookups -----
+    def get(self, key):
+        """Return the cached reply for key, or None."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, reply = entry
+            if expires > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return reply
+            self._evict(key)
+        self.misses += 1
+        return None
+
+    def put(self, key, reply, ttl: float, generation: int):
+        """
+        Store a reply obtained by a request started at generation (see self.generation).
+        Error replies (raw bytes without a binary header, or wrapped into a
+        "bytes" message) and replies that raced an invalidation are not stored.
+        """
+        if reply is None or generation != self.generation or len(reply) > self.max_bytes:
+            return
+        if is_error_reply(reply):
+            return
+        self._evict(key)
+        self._entries[key] = (self.clock() + ttl, reply)
+        self._size += len(reply)
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            self._evict(next(iter(self._entries)))
+
+    # ----- invalidation -----
+    def note_command(self, name: str, notify: bool = True) -> bool:
+        """Apply the invalidation rules for a command about to be (or just) run; True if it is a write."""
+        stale = [p for pattern, targets in self.invalidations.items()
+                 if fnmatchcase(name, pattern) for p in targets]
+        for pattern in stale:
+            self.invalidate_matching(pattern)
+        if stale and notify and self.on_write is not None:
+            self.on_write(name)
+        return bool(stale)
+
+    def invalidate_matching(self, pattern: str):
+        """Evict every cached reply whose "<route>_<command>" matches pattern."""
+        self.generation += 1
+        for key in [k for k in self._entries if fnmatchcase(f"{k[0]}_{k[1]}", pattern)]:
+            self._evict(key)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+        self._size = 0
+
+    def _evict(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SingleFlight:
+    """
+    Identical read requests in flight at the same time share one backend call:
+    the first starts it, later ones wait for its reply, and all get the same reply
+    (or failure). Each requester gets its own Deferred; cancelling it only drops
+    that requester, and the backend call is cancelled once nobody waits for it.
+    """
+
+    def __init__(self, patterns=None):
+        self.patterns = list(DEFAULT_COALESCED if patterns is None else patterns)
+        self.shared = 0   # requests answered by a call another request started
+        self._calls = {}  # key -> [Deferred of the backend call, waiting Deferreds]
+
+    def enabled(self, name: str) -> bool:
+        """True if "<route>_<command>" is coalesced."""
+        return any(fnmatchcase(name, pattern) for pattern in self.patterns)
+
+    def set_enabled(self, pattern: str, enabled: bool = True):
+        if pattern in self.patterns:
+            self.patterns.remove(pattern)
+        if enabled:
+            self.patterns.append(pattern)
+
+    def call(self, key, start) -> Deferred:
+        """Join the call in flight for key, or start one with start() (returning a Deferred)."""
+        entry = self._calls.get(key)
+        waiter = Deferred(lambda d: self._leave(key, d))
+        if entry is not None:
+            self.shared += 1
+            entry[1].append(waiter)
+            return waiter
+        entry = self._calls[key] = [None, [waiter]]
+        entry[0] = start()
+        entry[0].addBoth(self._done, key, entry)
+        return waiter
+
+    def _done(self, result, key, entry):
+        if self._calls.get(key) is entry:
+            del self._calls[key]
+        for waiter in entry[1]:
+            if hasattr(result, "check"):
+                waiter.errback(result)
+            else:
+                waiter.callback(result)
+
+    def _leave(self, key, waiter):
+        entry = self._calls.get(key)
+        if entry is None or waiter not in entry[1]:
+            return
+        entry[1].remove(waiter)
+        if not entry[1]:
+            del self._calls[key]
+            entry[0].cancel()
+
+    def __len__(self):
+        return len(self._calls)
@@ -1,27 +1,57 @@
 # central_server.py
+import argparse
 import json
 import inspect
 import logging
+import os
 import socket
 import struct
+import time
+from itertools import count
 from typing import Dict, Tuple, Optional
 from datetime import datetime
 
 import numpy as np
-from twisted.internet import reactor
-from twisted.internet.defer import Deferred, inlineCallbacks, returnValue, gatherResults
+from twisted.internet import reactor, threads
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue, gatherResults, succeed, fail
 from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+from twisted.internet.error import ConnectionLost, ConnectError
 from twisted.protocols.basic import Int32StringReceiver
 from twisted.internet.protocol import Factory
+from twisted.python.failure import Failure
 
-from asyncroscopy.servers.protocols.utils import package_message, unpackage_message
+from asyncroscopy.servers.protocols.utils import (
+    package_message, unpackage_message, compress_message, Compression, CODECS,
+    is_stream_head, is_stream_end, StreamAssembler, parse_request, package_request, MAGIC,
+    message_tag, set_tag, message_frames, package_message_parts, Bundle, PackagedMessage,
+    is_error_reply, error_text, request_deadline, with_timeout,
+)
+from asyncroscopy.servers.protocols.framing import FrameWriterMixin
+from asyncroscopy.servers.protocols.cache import ResponseCache, SingleFlight
+from asyncroscopy.servers.protocols.metrics import Metrics
+from asyncroscopy.servers.protocols.trace import TraceBuffer
+from asyncroscopy.servers.protocols.health import HealthMonitor, BackendUnavailable
+from asyncroscopy.servers.protocols.balancer import ReplicaBalancer, replicas_of, normalize_route
+from asyncroscopy.servers.protocols.pubsub import TopicRelay
+from asyncroscopy.servers.protocols.recording import SessionRecorder
+from asyncroscopy.servers.protocols.workers import (
+    ControlChannel, CONTROL_OFFSET, listen_reuseport, control_peers, spawn_workers,
+)
+from asyncroscopy.servers.protocols.scheduler import (
+    RouteScheduler, DEFAULT_PRIORITIES, DEFAULT_MAX_IN_FLIGHT, priority_of, parse_priority,
+)
 
 
 # ---------- Logging ----------
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("central")
 
+# Per-message INFO logging is opt-in (env ASYNCROSCOPY_CENTRAL_VERBOSE=1 or
+# Central_set_logging verbose=1); requests are always recorded in the trace buffer.
+VERBOSE = os.environ.get("ASYNCROSCOPY_CENTRAL_VERBOSE", "0") not in ("", "0")
+
 # ---------- Defaults ----------
+# route prefix -> (host, port), or a list of (host, port) replicas serving the same commands
 DEFAULT_ROUTING_TABLE = {
     "AS": ("localhost", 9001),
     "Gatan": ("localhost", 9002),
@@ -30,47 +60,297 @@ DEFAULT_ROUTING_TABLE = {
 }
 
 
+# Central commands that change configuration: with several workers, each is
+# replayed on the other workers so that they all route and cache alike
+SHARED_COMMANDS = {
+    "set_routing_table", "set_compression", "set_logging", "set_route_limits", "set_priority",
+    "set_cache", "clear_cache", "set_balancing", "set_coalescing", "start_recording", "stop_recording",
+}
+
+
 # ---------- BackendClient ----------
-class BackendClient(Int32StringReceiver):
+class NoReplyError(ConnectionLost):
+    """The backend connection was lost before any frame of the reply arrived."""
+
+
+class NotSentError(NoReplyError):
+    """The backend connection was closed before the request was written: it never ran."""
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before its reply arrived."""
+
+
+def _discard(frame):
+    pass
+
+
+class _PendingReply:
+    """State of one request in flight on a BackendClient."""
+
+    __slots__ = ("deferred", "relay", "received", "relaying", "stream", "cancelled")
+
+    def __init__(self, relay=None, canceller=None):
+        self.deferred = Deferred(canceller)
+        self.relay = relay
+        self.received = 0        # frames received so far
+        self.relaying = False    # inside a stream passed on to relay
+        self.stream = None       # StreamAssembler for a stream reassembled here
+        self.cancelled = False   # nobody waits for the reply; its frames are dropped
+
+
+class BackendClient(FrameWriterMixin, Int32StringReceiver):
     """
     Lightweight protocol used by Central to talk to backends.
-    Completes the provided Deferred with the raw framed response bytes.
+    The connection stays open and carries any number of requests at once:
+    every request is sent as a tagged envelope and the backend echoes the tag
+    on every frame of its reply, so replies are matched by tag and may arrive
+    out of order. Untagged replies (older backends) are matched in order.
+    Each request's Deferred fires with the raw framed response bytes.
+
+    Chunked stream replies are either passed frame by frame to the request's
+    relay (and its Deferred fires with None once the terminator went through),
+    or, without relay, reassembled into one message.
+
+    Cancelling a request's Deferred stops counting it as in flight; the
+    frames of its reply are dropped when (if ever) they arrive.
     """
     MAX_LENGTH = 10_000_000
 
-    def __init__(self, finished: Deferred):
+    def __init__(self):
         super().__init__()
-        self.finished = finished
+        self.alive = False
+        self._pending = {}   # tag -> _PendingReply, in the order requests were sent
+        self._tags = count(1)
 
     def connectionMade(self):
+        self.alive = True
         peer = self.transport.getPeer()
         log.debug("BackendClient connectionMade to %s", peer)
 
+    @property
+    def in_flight(self) -> int:
+        """Number of requests waiting for (the end of) their reply."""
+        return sum(1 for pending in self._pending.values() if not pending.cancelled)
+
+    def request(self, command, relay=None) -> Deferred:
+        """
+        Send a command (text or request envelope); returns a Deferred for its reply.
+        Text commands are sent as envelopes so that they can be tagged too.
+        """
+        if not self.alive or self.transport.disconnecting:
+            return fail(NotSentError("Backend connection closed before the request was sent"))
+        if isinstance(command, str):
+            parsed = parse_request(command.encode("utf-8"))
+            command = package_request(parsed["cmd"], parsed["args"])
+        tag = next(self._tags) & 0xFFFFFFFF
+        pending = self._pending[tag] = _PendingReply(relay, lambda d: self._cancel(tag))
+        self.sendCommand(set_tag([command], tag))
+        return pending.deferred
+
+    def _cancel(self, tag):
+        pending = self._pending.get(tag)
+        if pending is not None:
+            pending.cancelled = True
+            pending.relay = _discard
+
     def stringReceived(self, data: bytes):
-        if not self.finished.called:
-            self.finished.callback(data)
-        # close transport after receiving
-        try:
-            self.transport.loseConnection()
-        except Exception:
-            pass
+        tag = message_tag(data)
+        if tag is None and self._pending:
+            tag = next(iter(self._pending))
+        pending = self._pending.get(tag)
+        if pending is None:
+            log.warning("Dropping unsolicited backend frame (len=%d)", len(data))
+            return
+        pending.received += 1
+
+        if pending.relaying or (pending.relay is not None and is_stream_head(data)):
+            pending.relay(data)
+            pending.relaying = not is_stream_end(data)
+            if pending.relaying:
+                return
+            data = None
+        elif pending.stream is not None:
+            if not pending.stream.feed(data):
+                return
+            data = pending.stream.buffer
+        elif is_stream_head(data):
+            pending.stream = StreamAssembler(data)
+            return
+
+        del self._pending[tag]
+        if not pending.deferred.called:
+            pending.deferred.callback(data)
 
     def connectionLost(self, reason):
-        if not self.finished.called:
-            self.finished.errback(reason)
+        self.alive = False
+        pending, self._pending = self._pending, {}
+        for reply in pending.values():
+            if reply.deferred.called:
+                continue
+            if reply.received:
+                reply.deferred.errback(reason)
+            else:
+                reply.deferred.errback(NoReplyError(reason.getErrorMessage()))
 
-    def sendCommand(self, cmd: str):
-        """Send a framed command to backend using Int32 framing used by Int32StringReceiver."""
+    def sendCommand(self, cmd):
+        """
+        Send a framed command to backend using Int32 framing used by Int32StringReceiver.
+        cmd is a text command, an already packaged request envelope (bytes),
+        or a frame given as a list of buffers.
+        """
         log.debug("Central → Exec: %s", cmd)
-        self.sendString(cmd.encode("utf-8"))
+        if isinstance(cmd, str):
+            cmd = cmd.encode("utf-8")
+        self.sendFrame(cmd if isinstance(cmd, list) else [cmd])
+
+
+# ---------- BackendPool ----------
+class BackendPool:
+    """
+    Persistent connections to one backend, shared by all client connections.
+    Requests are pipelined: each goes to the open connection with the fewest
+    requests in flight, and a new connection is opened only while all are busy
+    and fewer than max_connections exist. TCP setup and protocol construction
+    are paid once per connection instead of once per command, and a slow
+    command does not hold up the others on the same connection.
+    Connections that drop are discarded; a request that finds its connection
+    already closing is sent on a fresh one. A request lost with its connection
+    after it was written is not sent again, since the backend may have run it.
+    """
+
+    def __init__(self, host: str, port: int, max_connections: int = 4,
+                 connect_timeout: Optional[float] = 5.0):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self._conns = []
+        self._opening = 0
+        self._waiting = []   # Deferreds waiting for a connection being opened
+
+    @property
+    def connections(self) -> int:
+        """Number of open connections."""
+        return sum(1 for proto in self._conns if proto.alive)
+
+    def _connect(self) -> Deferred:
+        endpoint = TCP4ClientEndpoint(reactor, self.host, self.port, timeout=self.connect_timeout)
+        return connectProtocol(endpoint, BackendClient())
+
+    def _checkout(self) -> Deferred:
+        """Fires with (BackendClient, reused)."""
+        self._conns = [proto for proto in self._conns if proto.alive and not proto.transport.disconnecting]
+        best = min(self._conns, key=lambda proto: proto.in_flight, default=None)
+        if best is not None and (best.in_flight == 0
+                                 or len(self._conns) + self._opening >= self.max_connections):
+            return succeed((best, True))
+        if best is None and self._opening >= self.max_connections:
+            d = Deferred()
+            self._waiting.append(d)
+            return d
+
+        self._opening += 1
+
+        def opened(proto):
+            self._opening -= 1
+            self._conns.append(proto)
+            waiting, self._waiting = self._waiting, []
+            for d in waiting:
+                d.callback((proto, False))
+            return proto, False
+
+        def failed(failure):
+            self._opening -= 1
+            if not self._opening:
+                waiting, self._waiting = self._waiting, []
+                for d in waiting:
+                    d.errback(failure)
+            return failure
+
+        return self._connect().addCallbacks(opened, failed)
+
+    @inlineCallbacks
+    def request(self, command, relay=None):
+        """Send a command on a pooled connection; fires with the raw reply (None if relayed)."""
+        proto, _ = yield self._checkout()
+        try:
+            reply = yield proto.request(command, relay)
+        except NotSentError:
+            log.info("Pooled connection to %s:%d went stale, reconnecting", self.host, self.port)
+            proto, _ = yield self._checkout()
+            reply = yield proto.request(command, relay)
+        returnValue(reply)
+
+    def close(self):
+        """Close all connections."""
+        conns, self._conns = self._conns, []
+        for proto in conns:
+            if proto.alive:
+                proto.transport.loseConnection()
+
+
+def get_pool(pools: dict, host: str, port: int, timeout: Optional[float] = 5.0) -> BackendPool:
+    """The BackendPool for (host, port) in pools, created on first use."""
+    pool = pools.get((host, port))
+    if pool is None:
+        pool = pools[(host, port)] = BackendPool(host, port, connect_timeout=timeout)
+    return pool
+
 
 # ---------- CentralProtocol ----------
-class CentralProtocol(Int32StringReceiver):
+class CentralProtocol(FrameWriterMixin, Int32StringReceiver):
     MAX_LENGTH = 10_000_000
 
-    def __init__(self, routing_table: Optional[Dict[str, Tuple[str,int]]] = None):
+    def __init__(self, routing_table: Optional[Dict[str, object]] = None,
+                 compression: Optional[Dict[str, Compression]] = None,
+                 pools: Optional[Dict[Tuple[str,int], BackendPool]] = None,
+                 cache: Optional[ResponseCache] = None,
+                 schedulers: Optional[Dict[str, RouteScheduler]] = None,
+                 priorities: Optional[Dict[str, str]] = None,
+                 metrics: Optional[Metrics] = None,
+                 trace: Optional[TraceBuffer] = None,
+                 options: Optional[dict] = None,
+                 health: Optional[HealthMonitor] = None,
+                 balancer: Optional[ReplicaBalancer] = None,
+                 topics: Optional[TopicRelay] = None,
+                 single_flight: Optional[SingleFlight] = None,
+                 control: Optional[ControlChannel] = None,
+                 recorder: Optional[SessionRecorder] = None):
         super().__init__()
         self.routing_table = routing_table or dict(DEFAULT_ROUTING_TABLE)
+        # route prefix (or "*" for all routes) -> Compression applied to relayed replies
+        self.compression = compression if compression is not None else {}
+        # (host, port) -> BackendPool, shared across client connections by the factory
+        self.pools = pools if pools is not None else {}
+        # replies of read-only commands, shared across client connections by the factory
+        self.cache = cache if cache is not None else ResponseCache()
+        # identical reads in flight at once share one backend call
+        self.single_flight = single_flight if single_flight is not None else SingleFlight()
+        # channel to the other workers of a multi-process Central (None when running alone)
+        self.control = control
+        # route prefix -> RouteScheduler, and "<route>_<command>" pattern -> priority class
+        self.schedulers = schedulers if schedulers is not None else {}
+        self.priorities = priorities if priorities is not None else dict(DEFAULT_PRIORITIES)
+        # per-route and per-command counters for Central_stats
+        self.metrics = metrics if metrics is not None else Metrics()
+        # ring buffer of completed requests for Central_trace_dump
+        self.trace = trace if trace is not None else TraceBuffer()
+        # runtime switches shared by the factory ("verbose": per-message INFO logging)
+        self.options = options if options is not None else {"verbose": VERBOSE}
+        # circuit breakers per route (probed in the background when run by the factory)
+        self.health = health if health is not None else HealthMonitor(self._replica_table, None)
+        # replica choice for routes served by several backends
+        self.balancer = balancer if balancer is not None else ReplicaBalancer()
+        # live topics of the backends, fanned out to subscribed clients
+        self.topics = topics if topics is not None else TopicRelay(self._topic_source)
+        # session log of backend requests and replies, while Central_start_recording is on
+        self.recorder = recorder if recorder is not None else SessionRecorder()
+        # tag and deadline of the client request being handled
+        self._tag = None
+        self._deadline = None
+        # client tag -> Deferred of a forwarded request, for Central_cancel
+        self._in_progress = {}
 
     def connectionMade(self):
         peer = self.transport.getPeer()
@@ -78,9 +358,33 @@ class CentralProtocol(Int32StringReceiver):
 
     def connectionLost(self, reason):
         log.info("[Central] Connection lost: %s", reason)
+        # nobody is left to read the replies: free queue slots and backend connections
+        in_progress, self._in_progress = self._in_progress, {}
+        for d in in_progress.values():
+            d.cancel()
+        self.balancer.unpin(self)
+        self.topics.drop(self)
+
+    def sendString(self, string):
+        """Send a reply, tagged with the tag of the client request being handled."""
+        self.sendFrame(set_tag([string], self._tag))
+
+    def sendFrame(self, parts):
+        # commands replayed from another worker have nobody to reply to
+        if self.transport is not None:
+            super().sendFrame(parts)
 
     def stringReceived(self, data: bytes):
         """Main entry point for incoming client/backend messages."""
+        # Typed request envelopes (binary header), possibly tagged
+        if data[:4] == MAGIC:
+            self._tag = message_tag(data)
+            try:
+                self._handle_request(data)
+            finally:
+                self._tag = self._deadline = None
+            return
+
         try:
             msg = data.decode("utf-8").strip()
         except Exception:
@@ -88,7 +392,8 @@ class CentralProtocol(Int32StringReceiver):
             self.sendString(package_message("[Central] Invalid UTF-8 in request"))
             return
 
-        log.info("[Central] Received command: %s", msg)
+        if self.options["verbose"]:
+            log.info("[Central] Received command: %s", msg)
 
         # 1) Central_* messages (handled by subclass override if present)
         if msg.startswith("Central_"):
@@ -104,59 +409,342 @@ class CentralProtocol(Int32StringReceiver):
         # 3) Unknown command
         self.sendString(package_message(f"Unknown command prefix in '{msg}'"))
 
+    def _handle_request(self, data: bytes):
+        """
+        Dispatch a typed request envelope. The envelope names its route in "dest";
+        without it the route prefix is taken from "cmd" as for text commands.
+        Envelopes addressed to a backend are forwarded unchanged; the client's
+        tag is swapped for one of the backend connection and restored on the reply.
+        """
+        try:
+            request = parse_request(data)
+        except Exception as e:
+            self.sendString(package_message(f"[Central ERROR] Malformed request: {e}"))
+            return
+
+        cmd = request["cmd"]
+        args = request.get("args") or {}
+        dest = request.get("dest")
+        shm = bool(request.get("shm"))
+        self._deadline = request_deadline(request)
+        if dest is None:
+            for prefix in ["Central", *self.routing_table]:
+                if cmd.startswith(prefix + "_"):
+                    dest, cmd = prefix, cmd[len(prefix) + 1:]
+                    data = package_request(cmd, args, destination=dest, timeout_s=request.get("timeout_s"), shm=shm)
+                    break
+
+        if self.options["verbose"]:
+            log.info("[Central] Received request: %s_%s", dest, cmd)
+
+        if dest == "Central":
+            if not self._handle_central_request(cmd, args):
+                self.sendString(package_message(f"[Central] Unknown central command: {cmd}"))
+            return
+
+        if dest in self.routing_table:
+            self._forward_to_backend(data, route=dest, cmd=cmd, args=args, shm=shm)
+            return
+
+        self.sendString(package_message(f"Unknown command prefix in '{dest}_{cmd}'"))
+
     # ----- routing helpers -----
     def _route_if_backend_message(self, msg: str) -> bool:
         """
         If msg starts with a registered prefix (e.g. "AS_..."), forward to that backend.
         Returns True if a route was found and forwarding started.
         """
-        for prefix, (host, port) in self.routing_table.items():
+        for prefix in self.routing_table:
             if msg.startswith(prefix + "_"):
                 routed_cmd = msg[len(prefix) + 1 :]
-                log.info("[Central] Routing '%s' to %s backend at %s:%d", msg, prefix, host, port)
-                self._forward_to_backend(host, port, routed_cmd)
+                if self.options["verbose"]:
+                    log.info("[Central] Routing '%s' to %s backend", msg, prefix)
+                request = parse_request(routed_cmd.encode("utf-8"))
+                self._forward_to_backend(routed_cmd, route=prefix,
+                                         cmd=request["cmd"], args=request["args"])
                 return True
         return False
 
     def _handle_central_command(self, msg: str) -> bool:
+        """Text form of Central_* commands: Central_<name> key=value ..."""
         parts = msg.split()
         if not parts:
             return False
-        cmd_name = parts[0]
-        if cmd_name == "Central_set_routing_table":
+        cmd_name = parts[0][len("Central_"):]
+        if cmd_name == "set_routing_table":
+            try:
+                args = {"table": self._parse_routing_table(parts[1:])}
+            except Exception as e:
+                log.exception("Failed to parse routing table")
+                self.sendString(package_message(f"[Central ERROR] {e}"))
+                return True
+        else:
+            args = dict(tok.split("=", 1) for tok in parts[1:] if "=" in tok)
+        return self._handle_central_request(cmd_name, args)
+
+    def _handle_central_request(self, cmd_name: str, args: dict) -> bool:
+        """
+        Run a Central command with already parsed arguments, and have the other
+        workers (if any) apply configuration changes too.
+        Returns False if the command is unknown.
+        """
+        handled = self._run_central_request(cmd_name, args)
+        if handled and self.control is not None and cmd_name in SHARED_COMMANDS:
+            self.control.broadcast("command", cmd=cmd_name, args=args)
+        return handled
+
+    def _run_central_request(self, cmd_name: str, args: dict) -> bool:
+        if cmd_name == "set_routing_table":
             try:
-                # Re-assemble split tokens like  AS=('127.0.0.1', 9001)
-                cleaned, buf = [], []
-                for tok in parts[1:]:
-                    buf.append(tok)
-                    if tok.endswith(")"):
-                        cleaned.append(" ".join(buf))
-                        buf = []
-
-                routing_table = {}
-                for item in cleaned:
-                    k, v = item.split("=", 1)
-                    inner = v.strip()[1:-1]                     # remove ( )
-                    host_part, port_part = inner.split(",", 1)
-                    host = host_part.strip().strip("'\"")
-                    port = int(port_part.strip())
-                    routing_table[k.strip()] = (host, port)
-
-                self.set_routing_table(routing_table)
+                # {"table": {...}} (text form, Central_set_routing_table), or the table itself
+                # (send_command("Central", "set_routing_table", routing_table) in the notebooks)
+                table = args["table"] if isinstance(args.get("table"), dict) else args
+                if not isinstance(table, dict) or not table:
+                    raise ValueError(f"Expected a non-empty routing table, got {table!r}")
+                self.set_routing_table({k: normalize_route(v) for k, v in table.items()})
                 self.sendString(package_message("[Central] Routing table updated"))
             except Exception as e:
                 log.exception("Failed to set routing table")
                 self.sendString(package_message(f"[Central ERROR] {e}"))
             return True
 
+        if cmd_name == "set_compression":
+            try:
+                args = dict(args)
+                route = args.pop("route", "*")
+                codec = args.get("codec", "zlib")
+                if codec == "none":
+                    self.compression.pop(route, None)
+                    self.sendString(package_message(f"[Central] Compression disabled for {route}"))
+                    return True
+                if codec not in CODECS:
+                    raise ValueError(f"Unknown codec '{codec}'")
+                defaults = Compression()
+                self.compression[route] = Compression(
+                    codec=codec,
+                    level=int(args.get("level", defaults.level)),
+                    shuffle=str(args.get("shuffle", 1)) not in ("0", "false", "False"),
+                    threshold=int(args.get("threshold", defaults.threshold)),
+                )
+                log.info("Compression for %s: %s", route, self.compression[route])
+                self.sendString(package_message(f"[Central] Compression for {route}: {self.compression[route]}"))
+            except Exception as e:
+                log.exception("Failed to set compression")
+                self.sendString(package_message(f"[Central ERROR] {e}"))
+            return True
+
+        if cmd_name == "batch":
+            try:
+                commands = args.get("commands") or []
+                if isinstance(commands, str):
+                    commands = json.loads(commands)
+                self._batch(commands)
+            except Exception as e:
+                log.exception("Failed to run batch")
+                self.sendString(package_message(f"[Central ERROR] {e}"))
+            return True
+
+        if cmd_name == "stats":
+            self.sendString(package_message(self._stats(args)))
+            return True
+
+        if cmd_name == "health":
+            self.sendString(package_message(self.health.snapshot()))
+            return True
+
+        if cmd_name == "trace_dump":
+            last = args.get("last")
+            self.sendString(package_message(self.trace.dump_columns(int(last) if last else None)))
+            if str(args.get("clear", 0)) not in ("0", "false", "False"):
+                self.trace.clear()
+            return True
+
+        if cmd_name == "set_logging":
+            self.options["verbose"] = str(args.get("verbose", 0)) not in ("0", "false", "False")
+            self.sendString(package_message(f"[Central] Verbose logging: {self.options['verbose']}"))
+            return True
+
+        if cmd_name == "cancel":
+            try:
+                tag = int(args["tag"])
+                d = self._in_progress.get(tag)
+                if d is not None:
+                    d.cancel()
+                    self.sendString(package_message(f"[Central] Cancelled request {tag}"))
+                else:
+                    self.sendString(package_message(f"[Central] No request {tag} in progress"))
+            except Exception as e:
+                log.exception("Failed to cancel request")
+                self.sendString(package_message(f"[Central ERROR] {e}"))
+            return True
+
+        if cmd_name == "set_route_limits":
+            try:
+                route = args["route"]
+                scheduler = self._scheduler(route)
+                scheduler.set_limits(
+                    max_in_flight=int(args["max_in_flight"]) if "max_in_flight" in args else None,
+                    max_queued=int(args["max_queued"]) if "max_queued" in args else None,
+                )
+                self.sendString(package_message(
+                    f"[Central] Limits for {route}: max_in_flight={scheduler.max_in_flight} "
+                    f"max_queued={scheduler.max_queued}"))
+            except Exception as e:
+                log.exception("Failed to set route limits")
+                self.sendString(package_message(f"[Central ERROR] {e}"))
+            return True
+
+        if cmd_name == "set_priority":
+            try:
+                pattern = args["command"]
+                priority = args.get("priority")
+                if priority in (None, "", "default"):
+                    self.priorities.pop(pattern, None)
+                else:
+                    parse_priority(priority)
+                    # explicit rules take precedence over the defaults
+                    self.priorities.pop(pattern, None)
+                    rules = {pattern: priority, **self.priorities}
+                    self.priorities.clear()
+                    self.priorities.update(rules)
+                self.sendString(package_message(f"[Central] Priority for {pattern}: {priority}"))
+            except Exception as e:
+                log.exception("Failed to set priority")
+                self.sendString(package_message(f"[Central ERROR] {e}"))
+            return True
+
+        if cmd_name == "set_balancing":
+            try:
+                messages = []
+                if "route" in args:
+                    self.balancer.set_policy(args["route"], args.get("policy", "least"))
+                    messages.append(f"policy for {args['route']}: {self.balancer.policies[args['route']]}")
+                if "sticky" in args:
+                    pattern = args["sticky"]
+                    sticky = str(args.get("enable", 1)) not in ("0", "false", "False")
+                    self.balancer.set_sticky(pattern, sticky)
+                    messages.append(f"{pattern} {'pins' if sticky else 'does not pin'} clients to a replica")
+                self.sendString(package_message(f"[Central] Balancing {'; '.join(messages) or 'unchanged'}"))
+            except Exception as e:
+                log.exception("Failed to set balancing")
+                self.sendString(package_message(f"[Central ERROR] {e}"))
+            return True
+
+        if cmd_name == "subscribe":
+            try:
+                route, topic = args["route"], args["topic"]
+                if route not in self.routing_table:
+                    raise ValueError(f"Unknown route '{route}'")
+                # acknowledge first: every later message with this tag is a publication
+                self.sendString(package_message(f"[Central] Subscribed to {route}/{topic}"))
+                self.topics.subscribe(route, topic, self, self._tag)
+            except Exception as e:
+                log.exception("Failed to subscribe")
+                self.sendString(package_message(f"[Central ERROR] {e}"))
+            return True
+
+        if cmd_name == "unsubscribe":
+            tag = args.get("tag")
+            removed = self.topics.unsubscribe(self, None if tag is None else int(tag),
+                                              args.get("route"), args.get("topic"))
+            self.sendString(package_message(f"[Central] Removed {removed} subscription(s)"))
+            return True
+
+        if cmd_name == "set_cache":
+            try:
+                pattern = args["command"]
+                if "ttl" in args:
+                    self.cache.set_ttl(pattern, float(args["ttl"]))
+                if "invalidates" in args:
+                    stale = args["invalidates"]
+                    if isinstance(stale, str):
+                        stale = [p for p in stale.split(",") if p]
+                    self.cache.set_invalidation(pattern, stale)
+                self.sendString(package_message(f"[Central] Cache rules updated for {pattern}"))
+            except Exception as e:
+                log.exception("Failed to set cache rules")
+                self.sendString(package_message(f"[Central ERROR] {e}"))
+            return True
+
+        if cmd_name == "set_coalescing":
+            try:
+                pattern = args["command"]
+                enabled = str(args.get("enable", 1)) not in ("0", "false", "False")
+                self.single_flight.set_enabled(pattern, enabled)
+                self.sendString(package_message(
+                    f"[Central] Coalescing {'enabled' if enabled else 'disabled'} for {pattern}"))
+            except Exception as e:
+                log.exception("Failed to set coalescing")
+                self.sendString(package_message(f"[Central ERROR] {e}"))
+            return True
+
+        if cmd_name == "start_recording":
+            try:
+                path = args["path"]
+                worker = self.options.get("worker")
+                if worker is not None:
+                    # one log per worker, each recording the connections it serves
+                    path = f"{path}.w{worker}"
+                self.recorder.start(path)
+                self.sendString(package_message(f"[Central] Recording session to {path}"))
+            except Exception as e:
+                log.exception("Failed to start recording")
+                self.sendString(package_message(f"[Central ERROR] {e}"))
+            return True
+
+        if cmd_name == "stop_recording":
+            snapshot = self.recorder.snapshot()
+            self.recorder.stop()
+            self.sendString(package_message(
+                f"[Central] Recorded {snapshot['records']} requests ({snapshot['bytes']} bytes)"))
+            return True
+
+        if cmd_name == "clear_cache":
+            pattern = args.get("command")
+            if pattern:
+                self.cache.invalidate_matching(pattern)
+            else:
+                self.cache.clear()
+            self.sendString(package_message(f"[Central] Cache cleared for {pattern or 'all commands'}"))
+            return True
+
         return False
 
+    def _stats(self, args: dict) -> dict:
+        """Snapshot of the route metrics, with queue depth, backend connections and cache counters."""
+        routes = self.metrics.snapshot()
+        for route, entry in routes.items():
+            scheduler = self.schedulers.get(route)
+            entry["queued"] = scheduler.queued if scheduler is not None else 0
+            entry["connections"] = 0
+            entry["replicas"] = {}
+            for address in replicas_of(self.routing_table.get(route, ())):
+                pool = self.pools.get(address)
+                entry["connections"] += pool.connections if pool is not None else 0
+                entry["replicas"]["%s:%d" % address] = self.balancer.in_flight.get(address, 0)
+        stats = {
+            # with several workers, each reports on the connections it serves
+            "worker": self.options.get("worker"),
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - self.metrics.started, 1),
+            "routes": routes,
+            "cache": {"entries": len(self.cache), "hits": self.cache.hits, "misses": self.cache.misses,
+                      "coalesced": self.single_flight.shared},
+            "topics": self.topics.snapshot(),
+            "recording": self.recorder.snapshot(),
+        }
+        if str(args.get("reset", 0)) not in ("0", "false", "False"):
+            self.metrics.reset()
+            self.cache.hits = self.cache.misses = self.single_flight.shared = 0
+        return stats
+
     def _parse_routing_table(self, tokens):
         """
         Parse incoming routing-table tokens. Accepts either:
-          - JSON string (single token) e.g. '{"AS":["host",9001], ...}'
+          - JSON string (single token) e.g. '{"AS":["host",9001], ...}'; a replica set
+            is a list of addresses, e.g. '{"AS":[["host",9001],["host",9011]]}'
           - Legacy tokens like: AS=('localhost', 9001) Gatan=('localhost', 9002)
-        Returns dict mapping key -> (host, port)
+        Returns dict mapping key -> (host, port), or to a list of them
         """
         # try JSON first if only one token and looks like JSON
         if len(tokens) == 1:
@@ -167,8 +755,8 @@ class CentralProtocol(Int32StringReceiver):
                     # normalize to tuple(host,port)
                     out = {}
                     for k, v in parsed.items():
-                        if isinstance(v, (list, tuple)) and len(v) >= 2:
-                            out[k] = (v[0], int(v[1]))
+                        if isinstance(v, (list, tuple)) and len(v) >= 1:
+                            out[k] = normalize_route(v)
                         else:
                             raise ValueError("Invalid JSON routing entry for %s" % k)
                     return out
@@ -196,54 +784,211 @@ class CentralProtocol(Int32StringReceiver):
             table[key.strip()] = (host, port)
         return table
 
-    def set_routing_table(self, routing_table: Dict[str, Tuple[str,int]]):
-        self.routing_table = routing_table
+    def set_routing_table(self, routing_table: Dict[str, object]):
+        # updated in place: the table is shared by all client connections and the health monitor
+        self.routing_table.clear()
+        self.routing_table.update(routing_table)
+        self.cache.clear()
         log.info("Routing table updated: %s", self.routing_table)
 
     # ----- connection/send helpers -----
-    def _connect_and_send(self, host: str, port: int, command: str, timeout: Optional[float] = 5.0) -> Deferred:
+    def _pool(self, host: str, port: int, timeout: Optional[float] = 5.0) -> BackendPool:
+        return get_pool(self.pools, host, port, timeout)
+
+    def _replica_table(self) -> dict:
+        """{route: [(host, port), ...]}"""
+        return {route: replicas_of(entry) for route, entry in self.routing_table.items()}
+
+    def _topic_source(self, route: str):
+        """The backend a topic subscription of route is opened to: a healthy replica."""
+        return self.balancer.pick(route, replicas_of(self.routing_table.get(route, ())),
+                                  usable=lambda a: self.health.breaker(a).available)
+
+    def _scheduler(self, route: Optional[str]) -> RouteScheduler:
+        scheduler = self.schedulers.get(route)
+        if scheduler is None:
+            # a replica set runs as many requests at once as its replicas together
+            replicas = len(replicas_of(self.routing_table.get(route, ()))) or 1
+            scheduler = self.schedulers[route] = RouteScheduler(DEFAULT_MAX_IN_FLIGHT * replicas)
+        return scheduler
+
+    def _connect_and_send(self, host: str, port: int, command, timeout: Optional[float] = 5.0,
+                          relay=None) -> Deferred:
         """
-        Connect to a backend and send a framed command.
+        Send a framed command to a backend over a pooled connection.
         Returns a Deferred that fires with the raw framed reply bytes from backend (not yet unpacked).
+        With relay, chunked stream replies are passed on frame by frame and the Deferred fires with None.
         """
-        d = Deferred()
-        endpoint = TCP4ClientEndpoint(reactor, host, port, timeout=timeout)
+        return self._pool(host, port, timeout).request(command, relay=relay)
 
-        backend_proto = BackendClient(d)
+    def _send_to_replica(self, route: str, command, cmd: Optional[str] = None, relay=None,
+                         tried: tuple = ()) -> Deferred:
+        """
+        Send a command to one backend of the route: the replica the client is pinned
+        to, else a healthy one chosen by the balancer. Fires like _connect_and_send.
+        If the replica cannot be connected to, nothing was sent, and the next replica is tried.
+        """
+        replicas = [a for a in replicas_of(self.routing_table.get(route, ())) if a not in tried]
+        address = self.balancer.pick(route, replicas, client=self,
+                                     sticky=self.balancer.is_sticky(f"{route}_{cmd}"),
+                                     usable=lambda a: self.health.breaker(a).allow())
+        if address is None:
+            return fail(BackendUnavailable(f"No healthy {route} backend, not sending {cmd}"))
+        self.balancer.acquire(address)
+        d = self._connect_and_send(*address, command, relay=relay)
+        d.addBoth(self.health.breaker(address).outcome)
+        d.addBoth(self.balancer.release, address)
+        if len(replicas) > 1:
+            def next_replica(failure):
+                failure.trap(ConnectError)
+                return self._send_to_replica(route, command, cmd=cmd, relay=relay, tried=tried + (address,))
+            d.addErrback(next_replica)
+        return d
 
-        def on_connect(proto):
-            try:
-                proto.sendCommand(command)
-            except Exception as exc:
-                if not d.called:
-                    d.errback(exc)
-                return d
-            return d
+    def _relay_frame(self, frame: bytes, tag: Optional[int] = None):
+        """Pass one frame of a backend reply on to the client, carrying the client's tag."""
+        self.sendFrame(set_tag([frame], tag))
+
+    def _send_reply(self, payload: bytes, tag: Optional[int] = None):
+        """Send a complete backend reply to the client, as a chunked stream if it is large."""
+        for frame in message_frames(set_tag([payload], None)):
+            self.sendFrame(set_tag(frame, tag))
 
-        conn_d = connectProtocol(endpoint, backend_proto)
-        conn_d.addCallback(on_connect)
-        conn_d.addErrback(lambda f: d.errback(f))
+    def _compression_for(self, route: Optional[str]) -> Optional[Compression]:
+        return self.compression.get(route) or self.compression.get("*")
+
+    def _compress_reply(self, route: Optional[str], payload_bytes: bytes):
+        """
+        Compress a backend reply according to the route's (or the global) settings.
+        Returns a Deferred; compression runs in a worker thread (zlib/lzma release the GIL).
+        """
+        compression = self._compression_for(route)
+        if compression is None or payload_bytes is None or len(payload_bytes) < compression.threshold:
+            return succeed(payload_bytes)
+        return threads.deferToThread(compress_message, payload_bytes, compression)
+
+    def _request_backend(self, command, route: str,
+                         cmd: Optional[str] = None, args: Optional[dict] = None, relay=None,
+                         deadline: Optional[float] = None, shm: bool = False) -> Deferred:
+        """
+        Send a command to a backend of route; fires with the raw reply (None if relayed).
+        Given the parsed cmd and args, replies of cacheable commands are served
+        from (and stored in) the response cache instead of being relayed, and
+        writes invalidate it, and identical reads in flight at the same time share one
+        backend call (see SingleFlight). Requests go through the route's scheduler, which
+        limits how many run at once and queues the rest by priority class.
+        A request still waiting (queued or for its reply) at its deadline
+        (local time.monotonic()) is cancelled and fails with DeadlineExceeded;
+        the backend is sent the time left when the request leaves the queue.
+        Every request is counted in the route's metrics, and logged with its
+        reply while a session is being recorded.
+        A reply passed in shared memory (shm) can be read once only, so such
+        requests are neither cached, coalesced nor recorded.
+        """
+        timer = self.metrics.start(route, cmd or "?", len(command))
+        d, ttl, coalesce = None, None, False
+        if deadline is not None and deadline <= time.monotonic():
+            d = fail(DeadlineExceeded(f"Deadline of {route}_{cmd} passed before it was sent"))
+        elif cmd is not None:
+            name = f"{route}_{cmd}"
+            is_write = self.cache.note_command(name)
+            ttl = None if shm else self.cache.ttl(name)
+            coalesce = not (shm or is_write) and self.single_flight.enabled(name)
+            key = self.cache.key(route, cmd, args or {}) if ttl is not None or coalesce else None
+            generation = self.cache.generation
+            if ttl is not None:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    log.debug("[Central] Cache hit for %s", name)
+                    d = succeed(cached)
+
+        if d is None:
+            # shared (cacheable or coalesced) replies are collected whole instead of relayed frame by frame
+            if ttl is not None or coalesce:
+                relay = None
+            elif relay is not None:
+                relay = self._counting_relay(relay, timer)
+            priority = priority_of(f"{route}_{cmd}", self.priorities)
+            breakers = [self.health.breaker(a) for a in replicas_of(self.routing_table.get(route, ()))]
+            if any(breaker.available for breaker in breakers):
+                def send(relay):
+                    sent = command if deadline is None else with_timeout(command, deadline - time.monotonic())
+                    return self._send_to_replica(route, sent, cmd=cmd, relay=relay)
+
+                def start():
+                    if cmd is None or shm:
+                        return self._scheduler(route).submit(priority, lambda: send(relay))
+                    return self._scheduler(route).submit(
+                        priority, lambda: self.recorder.record(route, cmd, args or {}, send, relay))
+                # a call started before a write is not shared with reads issued after it
+                d = self.single_flight.call((key, generation), start) if coalesce else start()
+            else:
+                errors = sorted({str(breaker.last_error) for breaker in breakers})
+                d = fail(BackendUnavailable(f"{route} backend is down ({'; '.join(errors)}), not sending {cmd}"))
+            if ttl is not None:
+                d.addCallback(self._remember, key, ttl, generation)
+            elif cmd is not None and is_write:
+                d.addCallback(self._invalidate_after, name)
+            if deadline is not None:
+                d.addTimeout(deadline - time.monotonic(), reactor,
+                             onTimeoutCancel=lambda result, timeout: Failure(
+                                 DeadlineExceeded(f"No reply from {route}_{cmd} within {timeout:.3g} s")))
+        d.addBoth(self._measure, timer, self.trace)
         return d
 
-    def _forward_to_backend(self, host: str, port: int, command: str):
+    @staticmethod
+    def _counting_relay(relay, timer):
+        def counted(frame):
+            timer.sent(len(frame))
+            relay(frame)
+        return counted
+
+    @staticmethod
+    def _measure(result, timer, trace):
+        """Record a backend request as complete in the metrics and the trace; passes result through."""
+        if isinstance(result, Failure):
+            error = True
+        else:
+            if result is not None:
+                timer.sent(len(result))
+            error = result is not None and is_error_reply(result)
+        if timer.finish(error=error):
+            trace.record(timer.group, timer.cmd, timer.bytes_in, timer.bytes_out, timer.elapsed, error)
+        return result
+
+    def _forward_to_backend(self, command, route: str,
+                            cmd: Optional[str] = None, args: Optional[dict] = None, shm: bool = False):
         """
         Forward a command to a backend and automatically send the response back to the client.
-        Returns the Deferred created by _connect_and_send.
+        The reply is tagged like the client request being handled, so replies to
+        pipelined requests can be sent as soon as they arrive.
+        Returns the Deferred created by _request_backend.
         """
-        d = self._connect_and_send(host, port, command)
+        tag = self._tag
+        # a compressed route gets large replies whole, to compress them before they are chunked again
+        relay = None if self._compression_for(route) else lambda frame: self._relay_frame(frame, tag)
+        d = self._request_backend(command, route=route, cmd=cmd, args=args, relay=relay,
+                                  deadline=self._deadline, shm=shm)
+        self._track(tag, d)
+        d.addCallback(lambda payload_bytes: self._compress_reply(route, payload_bytes))
 
         def on_success(payload_bytes):
-            # payload_bytes is already a framed package from the backend; send directly
-            log.info("[Central] Received backend response (len=%d)", len(payload_bytes))
+            if payload_bytes is None:
+                # chunked stream, already relayed frame by frame
+                return
+            # payload_bytes is already a framed package from the backend; relay it
+            # as its own piece so the transport never concatenates it with the prefix
+            if self.options["verbose"]:
+                log.info("[Central] Received backend response (len=%d)", len(payload_bytes))
             try:
-                self.sendString(payload_bytes)
+                self._send_reply(payload_bytes, tag)
             except Exception:
                 log.exception("Failed to send backend response to client")
 
         def on_error(failure):
             log.error("Error talking to backend: %s", failure)
             try:
-                self.sendString(package_message(f"[Central ERROR] {failure}"))
+                self._relay_frame(package_message(f"[Central ERROR] {failure}"), tag)
             except Exception:
                 log.exception("Failed to send error to client")
 
@@ -251,26 +996,167 @@ class CentralProtocol(Int32StringReceiver):
         d.addErrback(on_error)
         return d
 
+    def _track(self, tag: Optional[int], d: Deferred):
+        """
+        Remember a request in progress, so that it is cancelled if the client goes
+        away, and (when tagged) so that Central_cancel can cancel it.
+        """
+        key = tag if tag is not None else d
+        self._in_progress[key] = d
+
+        def untrack(result):
+            if self._in_progress.get(key) is d:
+                del self._in_progress[key]
+            return result
+
+        d.addBoth(untrack)
+
+    def _batch(self, commands):
+        """
+        Run a list of (prefix, command, args) entries concurrently and send one
+        Bundle back: parts "0", "1", ... hold the replies in order (or the error
+        message of a failed entry), part "status" lists "ok" or "error" per entry.
+        """
+        tag, deadline = self._tag, self._deadline
+        pending = []
+        for entry in commands:
+            try:
+                prefix, cmd, cmd_args = entry
+                cmd_args = cmd_args or {}
+                if prefix not in self.routing_table:
+                    raise KeyError(prefix)
+            except KeyError:
+                d = fail(ValueError(f"Unknown command prefix '{entry[0]}'"))
+            except (TypeError, ValueError) as e:
+                d = fail(ValueError(f"Malformed batch entry {entry!r}: {e}"))
+            else:
+                timeout_s = None if deadline is None else deadline - time.monotonic()
+                d = self._request_backend(package_request(cmd, cmd_args, timeout_s=timeout_s),
+                                          route=prefix, cmd=cmd, args=cmd_args, deadline=deadline)
+            d.addCallbacks(lambda reply: ("error", error_text(reply)) if is_error_reply(reply)
+                           else ("ok", PackagedMessage(reply)),
+                           lambda failure: ("error", failure.getErrorMessage()))
+            pending.append(d)
+
+        def send(results):
+            reply = Bundle((str(i), value) for i, (_, value) in enumerate(results))
+            reply["status"] = [status for status, _ in results]
+            # Bundles have no legacy form; clients that send batches read the binary header
+            for frame in message_frames(package_message_parts(reply, legacy=False)):
+                self.sendFrame(set_tag(frame, tag))
+
+        def failed(failure):
+            log.error("Failed to send batch reply: %s", failure)
+            self._relay_frame(package_message(f"[Central ERROR] {failure.getErrorMessage()}"), tag)
+
+        batch = gatherResults(pending)
+        batch.addCallback(send).addErrback(failed)
+        self._track(tag, batch)
+
+    def _remember(self, payload_bytes, key, ttl: float, generation: int):
+        self.cache.put(key, payload_bytes, ttl, generation)
+        return payload_bytes
+
+    def _invalidate_after(self, payload_bytes, name: str):
+        """Apply a write's invalidation rules again once it has completed."""
+        self.cache.note_command(name)
+        return payload_bytes
+
     # Exposed for SmartProxy / orchestration: returns Deferred with backend raw bytes
     def _ask_backend(self, prefix: str, command: str) -> Deferred:
         if prefix not in self.routing_table:
             raise ValueError(f"No backend named '{prefix}'")
-        host, port = self.routing_table[prefix]
-        return self._connect_and_send(host, port, command)
+        return self._send_to_replica(prefix, command)
 
 # ---------- Factory ----------
 class CentralFactory(Factory):
-    def __init__(self, routing_table= DEFAULT_ROUTING_TABLE):
+    def __init__(self, routing_table= DEFAULT_ROUTING_TABLE, probe_interval: float = 5.0):
         super().__init__()
-        self.routing_table = routing_table
+        # shared by all client connections, updated in place
+        self.routing_table = {route: normalize_route(entry) for route, entry in routing_table.items()}
+        self.compression = {}   # shared by all client connections
+        self.pools = {}
+        self.cache = ResponseCache()
+        self.single_flight = SingleFlight()
+        self.schedulers = {}
+        self.priorities = dict(DEFAULT_PRIORITIES)
+        self.metrics = Metrics()
+        self.trace = TraceBuffer()
+        self.options = {"verbose": VERBOSE, "worker": None}
+        self.control = None
+        self.recorder = SessionRecorder()
+        self.health = HealthMonitor(
+            lambda: {route: replicas_of(entry) for route, entry in self.routing_table.items()},
+            self._probe, interval=probe_interval)
+        self.balancer = ReplicaBalancer()
+        self.topics = TopicRelay(lambda route: self.balancer.pick(
+            route, replicas_of(self.routing_table.get(route, ())),
+            usable=lambda a: self.health.breaker(a).available))
         self.protocol = CentralProtocol
 
+    def startFactory(self):
+        self.health.start()
+
+    def stopFactory(self):
+        self.health.stop()
+        self.recorder.stop()
+
+    def attach_control(self, control: ControlChannel):
+        """Run as one worker of several: share configuration changes and cache invalidations over control."""
+        self.control = control
+        self.options["worker"] = control.worker
+        self.cache.on_write = lambda name: control.broadcast("write", name=name)
+        control.on("write", lambda message: self.cache.note_command(message["name"], notify=False))
+        control.on("command", self._replay_command)
+
+    def _replay_command(self, message: dict):
+        """Apply a configuration command another worker received."""
+        proto = self.buildProtocol(None)
+        proto.control = None   # applied here only, not broadcast again
+        if not proto._run_central_request(message["cmd"], message.get("args") or {}):
+            log.warning("[Central] Worker %s sent unknown command '%s'", message.get("worker"), message["cmd"])
+
+    def _probe(self, host: str, port: int) -> Deferred:
+        """Heartbeat for the health monitor: a ping over the backend's pooled connections."""
+        return get_pool(self.pools, host, port).request(package_request("ping"))
+
     def buildProtocol(self, addr):
-        return self.protocol(routing_table=self.routing_table)
+        return self.protocol(routing_table=self.routing_table, compression=self.compression,
+                             pools=self.pools, cache=self.cache, schedulers=self.schedulers,
+                             priorities=self.priorities, metrics=self.metrics, trace=self.trace,
+                             options=self.options, health=self.health, balancer=self.balancer,
+                             topics=self.topics, single_flight=self.single_flight,
+                             control=self.control, recorder=self.recorder)
 
 # ---------- Run server ----------
-if __name__ == "__main__":
-    log.info("Central server running on port 9000...")
+def run_worker(port: int, worker: int, workers: int, control_port: int):
+    """One of several Central processes sharing port (see --workers)."""
     factory = CentralFactory(routing_table=DEFAULT_ROUTING_TABLE)
-    reactor.listenTCP(9000, factory)
-    reactor.run()
\ No newline at end of file
+    control = ControlChannel(worker, control_peers(worker, workers, control_port))
+    reactor.listenUDP(control_port + worker, control, interface="127.0.0.1")
+    factory.attach_control(control)
+    listen_reuseport(port, factory)
+    log.info("Central worker %d/%d (pid %d) running on port %d...", worker + 1, workers, os.getpid(), port)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Central server")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes sharing the port (SO_REUSEPORT) to spread relaying over cores")
+    parser.add_argument("--worker", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--control-port", type=int, default=None,
+                        help="first loopback UDP port of the workers' control channel (default: port + 1000)")
+    options = parser.parse_args()
+    control_port = options.control_port or options.port + CONTROL_OFFSET
+
+    if options.worker is not None:
+        run_worker(options.port, options.worker, options.workers, control_port)
+    elif options.workers > 1:
+        spawn_workers("asyncroscopy.servers.protocols.central_server", options.workers, options.port, control_port)
+    else:
+        log.info("Central server running on port %d...", options.port)
+        factory = CentralFactory(routing_table=DEFAULT_ROUTING_TABLE)
+        reactor.listenTCP(options.port, factory)
+        reactor.run()
\ No newline at end of file
@@ -5,11 +5,24 @@ Packages responses in a standard format.
 """
 
 from twisted.protocols.basic import Int32StringReceiver
+from twisted.internet import reactor, threads
 from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
-from asyncroscopy.servers.protocols.utils import package_message, unpackage_message
+from twisted.python.threadpool import ThreadPool
+from twisted.python.threadable import isInIOThread
+from asyncroscopy.servers.protocols.utils import (
+    package_message, unpackage_message, package_message_parts, message_frames, parse_request,
+    message_tag, set_tag, request_deadline,
+)
+from asyncroscopy.servers.protocols.framing import FrameWriterMixin
+from asyncroscopy.servers.protocols.metrics import Metrics
+from asyncroscopy.servers.protocols.pubsub import TopicHub
+from asyncroscopy.servers.protocols.shm import SegmentWriter, SHM_THRESHOLD
+from asyncroscopy.servers.protocols.processes import ProcessPool
 
 import json
 import logging
+import threading
+import time
 import traceback
 import inspect
 import numpy as np
@@ -28,12 +41,83 @@ def get_protocol_logger(instance):
         logger.propagate = False
     return logger
 
-class ExecutionProtocol(Int32StringReceiver):
+
+# protocol class name -> Metrics / TopicHub shared by all its connections
+_METRICS = {}
+_TOPICS = {}
+
+# shared-memory segments holding replies to requests that asked for them
+_SEGMENTS = SegmentWriter()
+
+# protocol class name -> ThreadPool running its blocking handlers / ProcessPool for its CPU-bound work
+_POOLS = {}
+_PROCESS_POOLS = {}
+_PROCESS_POOLS_LOCK = threading.Lock()   # the first users of a class's processes may be blocking handlers
+
+# in a thread running a blocking handler: .blocking is True and .request is the
+# RequestContext it runs for (None for work not serving a request)
+_THREAD = threading.local()
+
+
+def blocking(handler):
+    """
+    Mark a command handler as blocking (it sleeps, waits on hardware or does
+    synchronous I/O). It then runs in the class's thread pool instead of on the
+    reactor thread, so the backend keeps answering other commands meanwhile;
+    its messages are sent from the reactor thread. It must not return a Deferred.
+    """
+    handler.blocking = True
+    return handler
+
+
+class RequestContext:
+    """Reply state of one request: its tag, deadline, whether it has been answered and its timer."""
+
+    __slots__ = ("tag", "deadline", "replied", "error", "timer", "shm")
+
+    def __init__(self, tag=None, deadline=None, timer=None):
+        self.tag = tag
+        self.deadline = deadline   # local time.monotonic()
+        self.replied = False
+        self.error = False
+        self.timer = timer   # metrics.RequestTimer
+        self.shm = False     # a large reply may be passed in shared memory
+
+
+class ExecutionProtocol(FrameWriterMixin, Int32StringReceiver):
     """
     Protocol for executing registered commands.
     Command handling can be overridden in subclasses.
+
+    Every request gets exactly one reply, so Central can keep connections open
+    and match replies to requests: the first message a handler sends is the
+    reply, further messages for the same request are dropped. If the handler
+    sends nothing, its return value is sent instead (a Deferred's result once
+    it fires). Replies to tagged requests carry the request's tag, so requests
+    answered through a Deferred may complete out of order.
+
+    Requests may carry a deadline: a request that expired before it was
+    dispatched is answered with an error instead of being run, and long
+    running handlers can check time_left / expired to give up early.
+
+    A request can ask for its reply in shared memory (the client runs on this
+    host): replies above SHM_THRESHOLD are then written into a segment and
+    only a handle is sent.
+
+    Connections can also subscribe to topics; a handler (or a timer) pushes
+    live data to all of them with self.topics.publish(topic, data).
+
+    Handlers run on the reactor thread, except those marked @blocking, which
+    run in a pool of BLOCKING_THREADS threads shared by the class (set it to 1
+    when the hardware must not be driven from two threads at once).
+    CPU-bound work (simulation) goes to self.processes, a pool of CPU_PROCESSES
+    worker processes shared by the class (default: one per core).
     """
 
+    MAX_LENGTH = 10_000_000   # same request size limit as Central
+    BLOCKING_THREADS = 4
+    CPU_PROCESSES = None
+
     def __init__(self):
         super().__init__()
 
@@ -50,6 +134,15 @@ class ExecutionProtocol(Int32StringReceiver):
         # For awaiting proxy responses
         self._pendingCommands = {}
 
+        # RequestContext of the request being dispatched, None outside of one
+        self._dispatching = None
+
+        # Counters for the stats command, shared by all connections of this class
+        self.metrics = _METRICS.setdefault(type(self).__name__, Metrics())
+
+        # Topic subscriptions, shared by all connections of this class
+        self.topics = _TOPICS.setdefault(type(self).__name__, TopicHub())
+
     # ----------------------------------------------------------------------
     # Connection events
     # ----------------------------------------------------------------------
@@ -64,57 +157,251 @@ class ExecutionProtocol(Int32StringReceiver):
         for d in self._pendingCommands.values():
             d.errback(reason)
         self._pendingCommands.clear()
+        self.topics.drop(self)
 
     def disconnect(self):
         """Disconnect cleanly."""
         self.log.debug("Disconnect requested")
         self.transport.loseConnection()
 
+    def sendMessage(self, data, compression=None):
+        """
+        Package data and send it as one frame.
+        ndarray payloads are written straight from the array buffer (no copy),
+        so the array must not be modified after the call.
+        compression is an optional utils.Compression for this message.
+        Large messages go out as a chunked stream.
+        """
+        self._reply(self._message_frames(package_message_parts(data, compression=compression)))
+
+    def sendString(self, string):
+        """Send a packaged message, as a chunked stream if it is large."""
+        self._reply(self._message_frames([string]))
+
+    @property
+    def processes(self) -> ProcessPool:
+        """Worker processes of this class; submit() module-level functions with picklable arguments."""
+        name = type(self).__name__
+        with _PROCESS_POOLS_LOCK:
+            pool = _PROCESS_POOLS.get(name)
+            if pool is None:
+                pool = _PROCESS_POOLS[name] = ProcessPool(self.CPU_PROCESSES)
+                trigger = ("during", "shutdown", pool.shutdown)
+                if isInIOThread():
+                    reactor.addSystemEventTrigger(*trigger)
+                else:
+                    reactor.callFromThread(reactor.addSystemEventTrigger, *trigger)
+        return pool
+
+    @property
+    def _request(self):
+        """RequestContext of the request being handled (in a blocking handler, the one it runs for)."""
+        if getattr(_THREAD, "blocking", False):
+            return _THREAD.request
+        return self._dispatching
+
+    @_request.setter
+    def _request(self, context):
+        self._dispatching = context
+
+    @property
+    def time_left(self):
+        """Seconds until the current request's deadline (None without one)."""
+        request = self._request
+        if request is None or request.deadline is None:
+            return None
+        return request.deadline - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        """True once the current request's deadline has passed."""
+        left = self.time_left
+        return left is not None and left <= 0
+
+    def _message_frames(self, parts, request=None):
+        """Frames of a reply; a large one goes into shared memory if the request asked for it."""
+        request = request or self._request
+        if (request is not None and request.shm and not request.replied
+                and sum(len(p) for p in parts) >= SHM_THRESHOLD):
+            parts = [_SEGMENTS.write(parts)]
+        return message_frames(parts)
+
+    def _reply(self, frames, request=None):
+        """
+        Send the frames of one message as the reply to request (default: the
+        request being dispatched), tagged with its tag. Extra messages for a
+        request that was already replied to are dropped.
+        """
+        request = request or self._request
+        if request is not None:
+            if request.replied:
+                self.log.debug("Dropping extra message for an already answered request")
+                return
+            request.replied = True
+            if request.tag is not None:
+                frames = [set_tag(frame, request.tag) for frame in frames]
+        if getattr(_THREAD, "blocking", False):
+            # a blocking handler's reply: transports are written from the reactor thread only
+            reactor.callFromThread(self._write_reply, frames, request)
+        else:
+            self._write_reply(frames, request)
+
+    def _write_reply(self, frames, request=None):
+        for frame in frames:
+            self.sendFrame(frame)
+        if request is not None and request.timer is not None:
+            request.timer.sent(sum(len(part) for frame in frames for part in frame))
+            request.timer.finish(error=request.error)
+
+    def _send_result(self, result, request=None):
+        """Send a handler's return value as the reply (everything going back is bytes)."""
+        if not isinstance(result, (bytes, bytearray)):
+            result = str(result).encode()
+        self._reply(self._message_frames([result], request), request)
+
+    def _send_error(self, err: str, request=None):
+        """Send a traceback as the reply, counted as an error."""
+        request = request or self._request
+        if request is not None:
+            request.error = True
+        self._send_result(err.encode(), request)
+
     # ----------------------------------------------------------------------
     # Message handling
     # ----------------------------------------------------------------------
 
     def stringReceived(self, data: bytes):
-        msg = data.decode().strip()
-        self.log.debug("Received command: %s", msg)
-
-        parts = msg.split()
-        if not parts:
+        context = RequestContext(message_tag(data))
+        try:
+            request = parse_request(data)
+        except Exception:
+            err = traceback.format_exc()
+            self.log.error("Malformed request: %s", err)
+            self._send_error(err, context)
+            return
+        if request is None:
             self.log.warning("Received empty command")
             return
 
-        cmd, *args = parts
-        args_dict = dict(arg.split("=", 1) for arg in args if "=" in arg)
+        cmd = request["cmd"]
+        args_dict = request.get("args") or {}
+        context.deadline = request_deadline(request)
+        context.shm = bool(request.get("shm"))
+        method = self._command(cmd)
+        # unknown commands share one entry, so that clients cannot grow the metrics at will
+        context.timer = self.metrics.start(type(self).__name__, cmd if method is not None else "<unknown>",
+                                           len(data))
+        self.log.debug("Received command: %s %s", cmd, args_dict)
 
+        self._request = context
         try:
-            method = getattr(self, cmd, None)
             if method is None:
                 raise AttributeError(f"Unknown command '{cmd}'")
+            if self.expired:
+                raise TimeoutError(f"Deadline of '{cmd}' passed before it could run")
 
-            result = method(args_dict)
+            if getattr(method, "blocking", False):
+                self._run_blocking(method, args_dict, context).addCallbacks(
+                    lambda value: context.replied or self._send_result(value, context),
+                    lambda failure: self._send_error(failure.getTraceback(), context),
+                )
+                return
 
-            # Everything going back is bytes
-            if not isinstance(result, (bytes, bytearray)):
-                result = str(result).encode()
+            result = method(args_dict)
 
-            self.sendString(result)
+            if isinstance(result, Deferred):
+                result.addCallbacks(
+                    lambda value: context.replied or self._send_result(value, context),
+                    lambda failure: self._send_error(failure.getTraceback(), context),
+                )
+            elif not context.replied:
+                self._send_result(result)
             self.log.debug("Sent response for command '%s'", cmd)
 
         except Exception:
             err = traceback.format_exc()
-            self.log.error("Error executing '%s': %s", msg, err)
-            self.sendString(err.encode())
+            self.log.error("Error executing '%s': %s", cmd, err)
+            self._send_error(err)
+        finally:
+            self._request = None
+
+    def _run_blocking(self, method, args, context: RequestContext) -> Deferred:
+        """Run a handler in the class's thread pool for the request context; fires with its return value."""
+        def run():
+            _THREAD.blocking, _THREAD.request = True, context
+            try:
+                return method(args)
+            finally:
+                _THREAD.blocking, _THREAD.request = False, None
+        return threads.deferToThreadPool(reactor, self._blocking_pool(), run)
+
+    def _blocking_pool(self) -> ThreadPool:
+        name = type(self).__name__
+        pool = _POOLS.get(name)
+        if pool is None:
+            pool = _POOLS[name] = ThreadPool(minthreads=1, maxthreads=self.BLOCKING_THREADS,
+                                             name=f"{name}-blocking")
+            pool.start()
+            reactor.addSystemEventTrigger("during", "shutdown", pool.stop)
+        return pool
+
+    # public methods of the protocol that are not commands
+    _NOT_COMMANDS = frozenset({"connectionMade", "connectionLost", "disconnect", "sendMessage", "sendString",
+                               "stringReceived"})
+
+    @classmethod
+    def _is_handler(cls, name: str) -> bool:
+        """
+        True if name is a command handler: a public method defined by this class
+        or a subclass - not a property, attribute or method of the Twisted protocol.
+        """
+        if name.startswith("_") or name in cls._NOT_COMMANDS:
+            return False
+        for klass in cls.__mro__:
+            if name in klass.__dict__:
+                return issubclass(klass, ExecutionProtocol) and inspect.isfunction(klass.__dict__[name])
+        return False
+
+    def _command(self, cmd: str):
+        """The handler of cmd, None if there is none (subclasses may serve commands without methods)."""
+        return getattr(self, cmd) if self._is_handler(cmd) else None
 
     # ----------------------------------------------------------------------
     # Helpers for central
     # ----------------------------------------------------------------------
 
+    def stats(self, args=None):
+        """Per-command request/error counts, latency percentiles, bytes and in-flight requests."""
+        args = args or {}
+        snapshot = {
+            "server": type(self).__name__,
+            "uptime_s": round(time.time() - self.metrics.started, 1),
+            **self.metrics.snapshot().get(type(self).__name__, {}),
+        }
+        if str(args.get("reset", 0)) not in ("0", "false", "False"):
+            self.metrics.reset()
+        self.sendMessage(snapshot)
+
+    def ping(self, args=None):
+        """Heartbeat: answers without touching hardware (used by Central's health checks)."""
+        self.sendMessage("pong")
+
+    def subscribe(self, args: dict):
+        """Receive every message published on a topic, tagged like this request, until unsubscribed."""
+        topic = args["topic"]
+        # acknowledge first, so the reply is never mistaken for a publication
+        self.sendMessage(f"Subscribed to {topic}")
+        self.topics.subscribe(topic, self, self._request.tag)
+
+    def unsubscribe(self, args: dict):
+        """Stop receiving a topic (all topics without one)."""
+        topic = args.get("topic")
+        removed = self.topics.unsubscribe(self, topic=topic)
+        self.sendMessage(f"Unsubscribed from {removed} topic(s)")
+
     def discover_commands(self, args=None):
         """Return JSON array of all public commands."""
-        cmds = [
-            name for name in dir(self)
-            if not name.startswith("_") and callable(getattr(self, name))
-        ]
+        cmds = [name for name in dir(type(self)) if self._is_handler(name)]
         cmds.sort()
         self.sendString(package_message(json.dumps(cmds)))
 
@@ -122,8 +409,8 @@ class ExecutionProtocol(Int32StringReceiver):
         """Help on a specific command."""
         # args comes from the space-separated string, so first key is the command
         command_name = args.get('command_name')
-        meth = getattr(self, command_name, None)
-        if not meth or not callable(meth):
+        meth = self._command(command_name) if command_name else None
+        if meth is None:
             result = {"error": f"Unknown command '{command_name}'"}
         else:
             sig = str(inspect.signature(meth))
@@ -0,0 +1,107 @@
+'''
+Scatter-gather frame writer for Int32-framed protocols.
+'''
+
+import struct
+from collections import deque
+
+from zope.interface import implementer
+from twisted.internet.interfaces import IPullProducer
+from twisted.protocols.basic import StringTooLongError
+
+CHUNK_SIZE = 1 << 20      # bytes handed to the transport per write
+INLINE_LIMIT = 1 << 16    # frames below this size are written in one go
+
+
+@implementer(IPullProducer)
+class FrameWriter:
+    """
+    Writes length-prefixed frames assembled from several buffers
+    (header bytes, memoryviews of ndarrays, relayed payloads).
+
+    Twisted transports only accept bytes, so instead of joining a frame into
+    one large object the writer registers itself as a pull producer and feeds
+    the transport one piece at a time as it drains: whole bytes objects are
+    passed through untouched, memoryviews are copied CHUNK_SIZE bytes at a time.
+    Buffers must not be modified until they have been written.
+    """
+
+    def __init__(self, transport, struct_format: str = "!I"):
+        self.transport = transport
+        self.struct_format = struct_format
+        self._pieces = deque()
+        self._registered = False
+        self.pending = 0   # bytes queued and not yet handed to the transport
+
+    def write_frame(self, parts):
+        """Queue one frame made of the given buffers (bytes or memoryviews)."""
+        size = sum(len(p) for p in parts)
+        if size >= 2 ** (8 * struct.calcsize(self.struct_format)):
+            raise StringTooLongError(f"Frame of {size} bytes is too long")
+        prefix = struct.pack(self.struct_format, size)
+
+        if size < INLINE_LIMIT and not self._registered:
+            self.transport.write(b"".join([prefix, *parts]))
+            return
+
+        self._pieces.append(prefix)
+        self._pieces.extend(parts)
+        self.pending += len(prefix) + size
+        if not self._registered:
+            self._registered = True
+            self.transport.registerProducer(self, False)
+
+    # ----- IPullProducer -----
+    def resumeProducing(self):
+        pieces = self._pieces
+        out, budget = [], CHUNK_SIZE
+        while pieces and budget > 0:
+            piece = pieces.popleft()
+            if isinstance(piece, bytes) and len(piece) >= CHUNK_SIZE:
+                # a lone bytes object is written by the transport without copying
+                if out:
+                    pieces.appendleft(piece)
+                else:
+                    out.append(piece)
+                break
+            if len(piece) > budget:
+                piece = memoryview(piece)
+                pieces.appendleft(piece[budget:])
+                piece = piece[:budget]
+            out.append(piece)
+            budget -= len(piece)
+
+        if out:
+            self.pending -= sum(len(piece) for piece in out)
+            self.transport.write(b"".join(out))
+        if not pieces:
+            self._registered = False
+            self.transport.unregisterProducer()
+
+    def stopProducing(self):
+        self._pieces.clear()
+        self.pending = 0
+        self._registered = False
+
+
+class FrameWriterMixin:
+    """
+    Routes every outgoing Int32 frame of a protocol through a FrameWriter,
+    so frames queued with sendFrame and plain sendString calls never interleave.
+    """
+
+    _writer = None
+
+    def sendFrame(self, parts):
+        """Send one length-prefixed frame assembled from several buffers."""
+        if self._writer is None or self._writer.transport is not self.transport:
+            self._writer = FrameWriter(self.transport, self.structFormat)
+        self._writer.write_frame(parts)
+
+    @property
+    def pending_bytes(self) -> int:
+        """Bytes of frames queued behind the transport (a measure of how far the peer lags)."""
+        return 0 if self._writer is None else self._writer.pending
+
+    def sendString(self, string):
+        self.sendFrame([string])
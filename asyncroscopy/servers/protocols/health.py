@@ -0,0 +1,173 @@
+'''
+Backend health: circuit breakers fed by live traffic and background probes.
+'''
+
+import time
+
+from twisted.internet import reactor
+from twisted.internet.error import ConnectError, ConnectionLost, TimeoutError as ConnectTimeout
+from twisted.internet.task import LoopingCall
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# failures that say the backend is unreachable, as opposed to a slow or failing command
+BACKEND_DOWN_ERRORS = (ConnectError, ConnectionLost, ConnectTimeout)
+
+
+class BackendUnavailable(Exception):
+    """The route's circuit is open: the backend is considered down and is not contacted."""
+
+
+class CircuitBreaker:
+    """
+    Per-route circuit breaker.
+    closed:    requests pass; failure_threshold consecutive failures open the circuit.
+    open:      requests fail fast; after reset_timeout seconds one trial request
+               (or probe) is let through (half-open).
+    half_open: the trial's success closes the circuit again, its failure reopens it.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 5.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_success = None   # time.time()
+        self.last_failure = None
+        self.last_error = None
+        self._trial = False        # a half-open trial is in flight
+
+    @property
+    def available(self) -> bool:
+        """True if allow() would let a request through now (without taking the trial)."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return self.clock() - self.opened_at >= self.reset_timeout
+        return not self._trial
+
+    def allow(self) -> bool:
+        """True if a request may be sent now; the first one after reset_timeout is the trial."""
+        if not self.available:
+            return False
+        if self.state != CLOSED:
+            self.state = HALF_OPEN
+            self._trial = True
+        return True
+
+    def success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._trial = False
+        self.last_success = time.time()
+
+    def failure(self, error: str = ""):
+        self.failures += 1
+        self._trial = False
+        self.last_failure = time.time()
+        self.last_error = error
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.opened_at = self.clock()
+            self.state = OPEN
+
+    def outcome(self, result):
+        """
+        Record the outcome of a request (its result or Failure); passes it through.
+        Only connection-level failures count against the backend; after any
+        other failure (e.g. a cancelled trial) the next request may try again.
+        """
+        if not hasattr(result, "check"):   # a reply: the backend is up
+            self.success()
+        elif result.check(*BACKEND_DOWN_ERRORS):
+            self.failure(result.getErrorMessage())
+        else:
+            # cancelled, timed out, refused by the scheduler: no verdict
+            self._trial = False
+        return result
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "last_success": self.last_success,
+            "last_failure": self.last_failure,
+            "last_error": self.last_error,
+        }
+
+
+class HealthMonitor:
+    """
+    Keeps a CircuitBreaker per backend (host, port) and probes every backend in
+    the background. routes() returns the current {route: [(host, port), ...]};
+    probe(host, port) sends a heartbeat and returns a Deferred. Probes keep running while a
+    circuit is open, so a backend that comes back closes it again without
+    any client paying for the trial. timeout should exceed the connect timeout,
+    so that an unreachable host is reported as such rather than as a slow probe.
+    """
+
+    def __init__(self, routes, probe, interval: float = 5.0, timeout: float = 10.0,
+                 failure_threshold: int = 3, reset_timeout: float = 5.0):
+        self.routes = routes
+        self.probe = probe
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}     # (host, port) -> CircuitBreaker
+        self.latency = {}      # (host, port) -> seconds of the last successful probe
+        self._probing = set()
+        self._loop = None
+
+    def breaker(self, address) -> CircuitBreaker:
+        breaker = self.breakers.get(address)
+        if breaker is None:
+            breaker = self.breakers[address] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def start(self):
+        if self._loop is None and self.interval:
+            self._loop = LoopingCall(self.probe_all)
+            self._loop.start(self.interval, now=False)
+
+    def stop(self):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+    def probe_all(self):
+        for address in {a for replicas in self.routes().values() for a in replicas}:
+            if address in self._probing:
+                continue
+            self._probing.add(address)
+            started = time.perf_counter()
+            d = self.probe(*address)
+            d.addTimeout(self.timeout, reactor)
+            d.addBoth(self._probed, address, started)
+
+    def _probed(self, result, address, started):
+        self._probing.discard(address)
+        if not hasattr(result, "check"):
+            self.latency[address] = time.perf_counter() - started
+        # a probe stuck behind a long command is no verdict, only connection failures count
+        self.breaker(address).outcome(result)
+
+    def snapshot(self) -> dict:
+        """
+        {route: {"state": ..., "replicas": {"host:port": {breaker state, probe_ms}}}};
+        a route is "closed" while any of its replicas is.
+        """
+        out = {}
+        for route, replicas in self.routes().items():
+            entries = {}
+            for address in replicas:
+                entry = self.breaker(address).snapshot()
+                latency = self.latency.get(address)
+                entry["probe_ms"] = None if latency is None else round(latency * 1e3, 3)
+                entries["%s:%d" % address] = entry
+            states = [entry["state"] for entry in entries.values()]
+            state = next((s for s in (CLOSED, HALF_OPEN) if s in states), OPEN)
+            out[route] = {"state": state, "replicas": entries}
+        return out
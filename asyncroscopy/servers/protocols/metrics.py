@@ -0,0 +1,141 @@
+'''
+Low-overhead request metrics: counters and latency histograms per route and command.
+'''
+
+import math
+import time
+
+# Log-spaced latency buckets: 4 per octave from 10 us up to ~3 h
+_MIN_LATENCY = 1e-5
+_BUCKETS_PER_OCTAVE = 4
+_N_BUCKETS = 4 * 30
+
+
+class Histogram:
+    """Latency histogram with log-spaced buckets (about 19% resolution)."""
+
+    __slots__ = ("counts", "total")
+
+    def __init__(self):
+        self.counts = [0] * _N_BUCKETS
+        self.total = 0
+
+    def record(self, seconds: float):
+        if seconds <= _MIN_LATENCY:
+            idx = 0
+        else:
+            idx = min(int(math.log2(seconds / _MIN_LATENCY) * _BUCKETS_PER_OCTAVE), _N_BUCKETS - 1)
+        self.counts[idx] += 1
+        self.total += 1
+
+    def percentile(self, q: float):
+        """Upper edge (seconds) of the bucket holding the q-th percentile, None if empty."""
+        if not self.total:
+            return None
+        rank = q / 100 * self.total
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return _MIN_LATENCY * 2 ** ((idx + 1) / _BUCKETS_PER_OCTAVE)
+        return None
+
+
+class Counters:
+    """Counters of one route or command."""
+
+    __slots__ = ("requests", "errors", "bytes_in", "bytes_out", "in_flight", "latency")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.in_flight = 0
+        self.latency = Histogram()
+
+    def snapshot(self) -> dict:
+        out = {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "in_flight": self.in_flight,
+        }
+        for q in (50, 95, 99):
+            p = self.latency.percentile(q)
+            out[f"p{q}_ms"] = None if p is None else round(p * 1e3, 3)
+        return out
+
+
+class RequestTimer:
+    """One request being measured; see Metrics.start."""
+
+    __slots__ = ("group", "cmd", "counters", "started", "bytes_in", "bytes_out", "elapsed", "done")
+
+    def __init__(self, group, cmd, counters, started, bytes_in):
+        self.group = group
+        self.cmd = cmd
+        self.counters = counters
+        self.started = started
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+        self.elapsed = None   # seconds, once finished
+        self.done = False
+
+    def sent(self, nbytes: int):
+        """Count reply bytes as they are sent."""
+        self.bytes_out += nbytes
+
+    def finish(self, error: bool = False):
+        """Record the request as complete; only the first call counts (and returns True)."""
+        if self.done:
+            return False
+        self.done = True
+        elapsed = self.elapsed = time.perf_counter() - self.started
+        for counters in self.counters:
+            counters.in_flight -= 1
+            counters.bytes_out += self.bytes_out
+            counters.errors += int(error)
+            counters.latency.record(elapsed)
+        return True
+
+
+class Metrics:
+    """
+    Counters per group (a route, or a backend) and per command within it:
+    request and error counts, bytes in/out, requests in flight and latency
+    percentiles. Recording is a few integer updates and one log2 per request.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._groups = {}     # group -> Counters
+        self._commands = {}   # group -> {cmd -> Counters}
+
+    def start(self, group: str, cmd: str, bytes_in: int = 0) -> RequestTimer:
+        """Count a new request; call finish() on the returned timer when its reply is complete."""
+        total = self._groups.get(group)
+        if total is None:
+            total = self._groups[group] = Counters()
+            self._commands[group] = {}
+        per_cmd = self._commands[group].get(cmd)
+        if per_cmd is None:
+            per_cmd = self._commands[group][cmd] = Counters()
+        for counters in (total, per_cmd):
+            counters.requests += 1
+            counters.in_flight += 1
+            counters.bytes_in += bytes_in
+        return RequestTimer(group, cmd, (total, per_cmd), time.perf_counter(), bytes_in)
+
+    def snapshot(self) -> dict:
+        """{group: {counters..., "commands": {cmd: {counters...}}}}"""
+        out = {}
+        for group, total in self._groups.items():
+            entry = total.snapshot()
+            entry["commands"] = {cmd: c.snapshot() for cmd, c in self._commands[group].items()}
+            out[str(group)] = entry
+        return out
+
+    def reset(self):
+        self.__init__()
@@ -0,0 +1,210 @@
+'''
+Process pool for CPU-bound command work (simulation), with read-only state
+shared with the worker processes through shared memory.
+'''
+
+import logging
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import NamedTuple
+
+import numpy as np
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+
+from asyncroscopy.servers.protocols.shm import _Segment, attach_segment, SHM_PREFIX
+
+log = logging.getLogger("asyncroscopy.processes")
+
+
+class StateHandle(NamedTuple):
+    """Picklable reference to arrays published with SharedState.publish; workers map them with attach_state."""
+    key: str
+    segment: str
+    layout: tuple   # (array name, offset, shape, dtype str) per array
+
+
+class SharedState:
+    """
+    Named sets of read-only arrays (e.g. the atoms of the sample) in shared
+    memory. publish() copies them into a new segment only when they changed
+    since the last publication under that key; tasks are given the handle and
+    map the arrays instead of receiving a pickled copy. Each handle publish()
+    returns holds the segment for one task, which releases it when it ends
+    (release() an unused one), and a segment is unlinked once it has been
+    replaced and no task holds it.
+    Thread-safe: blocking handlers publish from their worker threads.
+    """
+
+    def __init__(self):
+        self.current = {}   # key -> (StateHandle, {name: array view})
+        self.segments = {}  # segment name -> [_Segment, handles held, replaced]
+        self._lock = threading.Lock()
+
+    def publish(self, key: str, **arrays) -> StateHandle:
+        arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+        with self._lock:
+            entry = self.current.get(key)
+            if entry is not None and entry[1].keys() == arrays.keys() and all(
+                    entry[1][name].dtype == a.dtype and np.array_equal(entry[1][name], a)
+                    for name, a in arrays.items()):
+                self.segments[entry[0].segment][1] += 1
+                return entry[0]
+
+            layout, offset = [], 0
+            for name, a in arrays.items():
+                offset = -(-offset // 64) * 64   # 64-byte aligned
+                layout.append((name, offset, a.shape, a.dtype.str))
+                offset += a.nbytes
+            segment = _Segment(name=SHM_PREFIX + secrets.token_hex(8), create=True, size=max(offset, 1))
+            views = {}
+            for (name, start, shape, dtype), a in zip(layout, arrays.values()):
+                view = np.ndarray(shape, dtype, buffer=segment.buf, offset=start)
+                view[...] = a
+                views[name] = view
+            handle = StateHandle(key, segment.name, tuple(layout))
+            self.segments[segment.name] = [segment, 1, False]
+            self.current[key] = (handle, views)
+            if entry is not None:
+                self._retire(entry[0].segment)
+            return handle
+
+    def release(self, handle: StateHandle):
+        with self._lock:
+            entry = self.segments.get(handle.segment)
+            if entry is None:
+                return   # closed
+            entry[1] -= 1
+            if entry[2] and not entry[1]:
+                self._free(handle.segment)
+
+    def _retire(self, name: str):
+        entry = self.segments[name]
+        entry[2] = True
+        if not entry[1]:
+            self._free(name)
+
+    def _free(self, name: str):
+        segment = self.segments.pop(name)[0]
+        segment.close()
+        segment.unlink()
+
+    def close(self):
+        with self._lock:
+            self.current.clear()
+            for name in list(self.segments):
+                self._free(name)
+
+
+# worker side: key -> (segment name, _Segment, {name: array view}) of the last state mapped
+_ATTACHED = {}
+
+
+def attach_state(handle: StateHandle) -> dict:
+    """In a worker process: the arrays of a published state, as read-only views on shared memory."""
+    attached = _ATTACHED.get(handle.key)
+    if attached is not None and attached[0] == handle.segment:
+        return attached[2]
+    segment = attach_segment(handle.segment, shared_tracker=True)   # workers use the server's tracker
+    views = {}
+    for name, offset, shape, dtype in handle.layout:
+        view = np.ndarray(shape, dtype, buffer=segment.buf, offset=offset)
+        view.flags.writeable = False
+        views[name] = view
+    _ATTACHED[handle.key] = (handle.segment, segment, views)
+    if attached is not None:
+        attached[1].close()   # unmapped once views from it are released
+    return views
+
+
+class ProcessPool:
+    """
+    Worker processes running module-level functions, for CPU-bound work that
+    threads cannot parallelise (the GIL). Workers are spawned rather than
+    forked, so they do not inherit the reactor and its threads, and are started
+    on first use. Arguments and results are pickled; large read-only inputs
+    are published in self.state and passed as their StateHandle.
+
+    submit(func, ...) returns a Deferred firing on the reactor thread;
+    run(func, ...) waits for the result (from a @blocking handler's thread).
+    If a worker dies (e.g. a crash in native code), the tasks it broke fail and
+    the next task starts a fresh set of workers.
+    """
+
+    def __init__(self, processes: int | None = None):
+        self.processes = processes or os.cpu_count() or 1
+        self.state = SharedState()
+        self.submitted = self.running = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _executor_for(self, broken=None) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is broken:
+                if broken is not None:
+                    log.warning("Worker processes died, starting new ones")
+                    broken.shutdown(wait=False)
+                self._executor = ProcessPoolExecutor(self.processes, mp_context=get_context("spawn"))
+                log.info("Started %d worker processes", self.processes)
+            return self._executor
+
+    def _start(self, func, args, kwargs):
+        # the task takes over the state handles among its arguments
+        handles = [a for a in (*args, *kwargs.values()) if isinstance(a, StateHandle)]
+
+        def release(_=None):
+            for handle in handles:
+                self.state.release(handle)
+
+        executor = self._executor_for()
+        try:
+            try:
+                future = executor.submit(func, *args, **kwargs)
+            except BrokenProcessPool:
+                future = self._executor_for(broken=executor).submit(func, *args, **kwargs)
+        except Exception:
+            release()
+            raise
+        with self._lock:
+            self.submitted += 1
+            self.running += 1
+
+        def finished(_):
+            release()
+            with self._lock:
+                self.running -= 1
+
+        future.add_done_callback(finished)
+        return future
+
+    def submit(self, func, *args, **kwargs) -> Deferred:
+        """Run func(*args, **kwargs) in a worker process; fires with its return value."""
+        future = self._start(func, args, kwargs)
+        d = Deferred(lambda _: future.cancel())
+
+        def settle(f):
+            if f.cancelled() or d.called:
+                return   # cancelled through d
+            error = f.exception()
+            if error is not None:
+                d.errback(error)
+            else:
+                d.callback(f.result())
+
+        future.add_done_callback(lambda f: reactor.callFromThread(settle, f))
+        return d
+
+    def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in a worker process and return its result (blocks the calling thread)."""
+        return self._start(func, args, kwargs).result()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.state.close()
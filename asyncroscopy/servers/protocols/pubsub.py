@@ -0,0 +1,240 @@
+'''
+Publish/subscribe: topics whose messages are pushed to every subscribed connection.
+'''
+
+import logging
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+from twisted.protocols.basic import Int32StringReceiver
+from twisted.python.threadable import isInIOThread
+
+from asyncroscopy.servers.protocols.utils import (
+    package_message_parts, message_frames, package_request, set_tag,
+    is_stream_head, is_stream_end, is_error_reply,
+)
+
+log = logging.getLogger("central")
+
+# a subscriber with more than this many bytes still queued misses publications
+MAX_PENDING = 8 * 1024 * 1024
+
+
+class _Subscriber:
+    __slots__ = ("proto", "tag", "published", "dropped")
+
+    def __init__(self, proto, tag):
+        self.proto = proto
+        self.tag = tag
+        self.published = 0
+        self.dropped = 0
+
+
+class TopicHub:
+    """
+    Subscriptions of connections (FrameWriterMixin protocols) to named topics.
+    A publication is packaged once and written to every subscriber, tagged with
+    the tag of the request that subscribed. Live data goes stale quickly, so a
+    subscriber that has not drained max_pending bytes of earlier publications
+    skips the new one instead of queueing it (counted as dropped).
+    """
+
+    def __init__(self, max_pending: int = MAX_PENDING):
+        self.max_pending = max_pending
+        self.topics = {}   # topic -> {(proto, tag): _Subscriber}
+
+    def subscribe(self, topic: str, proto, tag=None):
+        self.topics.setdefault(topic, {})[(proto, tag)] = _Subscriber(proto, tag)
+
+    def unsubscribe(self, proto, tag=None, topic: str | None = None) -> int:
+        """Remove the subscriptions of proto made with tag (or to topic); returns how many."""
+        removed = 0
+        for name in [topic] if topic is not None else list(self.topics):
+            subscribers = self.topics.get(name, {})
+            for key in [k for k in subscribers if k[0] is proto and (tag is None or k[1] == tag)]:
+                del subscribers[key]
+                removed += 1
+            if not subscribers:
+                self.topics.pop(name, None)
+        return removed
+
+    def drop(self, proto):
+        """Remove every subscription of a connection (it was closed)."""
+        self.unsubscribe(proto)
+
+    def subscribers(self, topic: str) -> int:
+        return len(self.topics.get(topic, ()))
+
+    def publish(self, topic: str, data, compression=None) -> int:
+        """
+        Send data (anything package_message accepts) to the subscribers of topic;
+        returns how many it was sent to. Arrays are written from their buffer,
+        so publish a copy of an array that will be modified afterwards.
+        From another thread (a blocking handler) the message is packaged there and
+        sent from the reactor thread; the subscribers it will go to are returned.
+        """
+        if not self.topics.get(topic):
+            return 0
+        frames = message_frames(package_message_parts(data, compression=compression))
+        if reactor.running and not isInIOThread():
+            reactor.callFromThread(self.publish_frames, topic, frames)
+            return self.subscribers(topic)
+        return self.publish_frames(topic, frames)
+
+    def publish_frames(self, topic: str, frames) -> int:
+        """Send an already packaged message (its frames, each a list of buffers) to the subscribers of topic."""
+        sent = 0
+        for subscriber in list(self.topics.get(topic, {}).values()):
+            proto = subscriber.proto
+            if not proto.connected:
+                continue
+            if proto.pending_bytes > self.max_pending:
+                subscriber.dropped += 1
+                continue
+            for frame in frames:
+                proto.sendFrame(set_tag(frame, subscriber.tag))
+            subscriber.published += 1
+            sent += 1
+        return sent
+
+    def snapshot(self) -> dict:
+        """{topic: {"subscribers", "published", "dropped"}}"""
+        return {
+            topic: {
+                "subscribers": len(subscribers),
+                "published": sum(s.published for s in subscribers.values()),
+                "dropped": sum(s.dropped for s in subscribers.values()),
+            }
+            for topic, subscribers in self.topics.items()
+        }
+
+
+# ---------- Central side ----------
+class TopicUpstream(Int32StringReceiver):
+    """Central's subscription to one topic of a backend; every message it receives is fanned out."""
+
+    MAX_LENGTH = 10_000_000
+
+    def __init__(self, relay, route: str, topic: str):
+        self.relay = relay
+        self.route = route
+        self.topic = topic
+        self.acked = False
+        self._stream = None   # frames of a chunked message in progress
+
+    def connectionMade(self):
+        self.sendString(package_request("subscribe", {"topic": self.topic}, tag=1))
+
+    def stringReceived(self, data: bytes):
+        if not self.acked:
+            # the reply to the subscribe request
+            self.acked = True
+            if is_error_reply(data):
+                log.warning("[Central] %s refused a subscription to %s", self.route, self.topic)
+            return
+        if self._stream is not None:
+            self._stream.append([data])
+            if is_stream_end(data):
+                frames, self._stream = self._stream, None
+                self.relay.hub.publish_frames(self.relay.name(self.route, self.topic), frames)
+            return
+        if is_stream_head(data):
+            self._stream = [[data]]
+            return
+        self.relay.hub.publish_frames(self.relay.name(self.route, self.topic), [[data]])
+
+    def connectionLost(self, reason):
+        self.relay._lost(self, reason)
+
+
+class TopicRelay:
+    """
+    Central's pub/sub: clients subscribe to "<route>/<topic>"; for each topic with
+    subscribers Central holds one subscription to a backend of the route
+    (resolve(route) -> (host, port) or None) and fans its messages out, so the
+    backend publishes once however many viewers there are. The upstream
+    subscription is closed with the last subscriber and reopened if it drops.
+    """
+
+    def __init__(self, resolve, reconnect_delay: float = 1.0, max_pending: int = MAX_PENDING):
+        self.resolve = resolve
+        self.reconnect_delay = reconnect_delay
+        self.hub = TopicHub(max_pending)
+        self.upstreams = {}   # (route, topic) -> TopicUpstream, or the Deferred of its connection
+
+    @staticmethod
+    def name(route: str, topic: str) -> str:
+        return f"{route}/{topic}"
+
+    def subscribe(self, route: str, topic: str, proto, tag=None):
+        self.hub.subscribe(self.name(route, topic), proto, tag)
+        if (route, topic) not in self.upstreams:
+            self._connect(route, topic)
+
+    def unsubscribe(self, proto, tag=None, route: str | None = None, topic: str | None = None) -> int:
+        name = self.name(route, topic) if route is not None and topic is not None else None
+        removed = self.hub.unsubscribe(proto, tag, name)
+        self._close_idle()
+        return removed
+
+    def drop(self, proto):
+        self.hub.drop(proto)
+        self._close_idle()
+
+    def snapshot(self) -> dict:
+        topics = self.hub.snapshot()
+        for (route, topic), upstream in self.upstreams.items():
+            entry = topics.get(self.name(route, topic))
+            if entry is not None:
+                entry["upstream"] = "connecting" if isinstance(upstream, Deferred) else "open"
+        return topics
+
+    def _connect(self, route: str, topic: str):
+        address = self.resolve(route)
+        if address is None:
+            log.warning("[Central] No %s backend for topic %s, retrying in %g s", route, topic, self.reconnect_delay)
+            reactor.callLater(self.reconnect_delay, self._reconnect, route, topic)
+            return
+        key = (route, topic)
+        endpoint = TCP4ClientEndpoint(reactor, *address, timeout=5)
+        d = self.upstreams[key] = connectProtocol(endpoint, TopicUpstream(self, route, topic))
+
+        def connected(proto):
+            if self.upstreams.get(key) is d:
+                self.upstreams[key] = proto
+            else:
+                proto.transport.loseConnection()
+
+        def failed(failure):
+            if self.upstreams.get(key) is d:
+                del self.upstreams[key]
+                log.warning("[Central] Could not subscribe to %s: %s", self.name(route, topic),
+                            failure.getErrorMessage())
+                reactor.callLater(self.reconnect_delay, self._reconnect, route, topic)
+
+        d.addCallbacks(connected, failed)
+
+    def _reconnect(self, route: str, topic: str):
+        if (route, topic) not in self.upstreams and self.hub.subscribers(self.name(route, topic)):
+            self._connect(route, topic)
+
+    def _lost(self, upstream: TopicUpstream, reason):
+        key = (upstream.route, upstream.topic)
+        if self.upstreams.get(key) is not upstream:
+            return
+        del self.upstreams[key]
+        if self.hub.subscribers(self.name(*key)):
+            log.warning("[Central] Subscription to %s lost (%s), reconnecting",
+                        self.name(*key), reason.getErrorMessage())
+            reactor.callLater(self.reconnect_delay, self._reconnect, *key)
+
+    def _close_idle(self):
+        for key, upstream in list(self.upstreams.items()):
+            if self.hub.subscribers(self.name(*key)):
+                continue
+            del self.upstreams[key]
+            if isinstance(upstream, Deferred):
+                upstream.cancel()
+            else:
+                upstream.transport.loseConnection()
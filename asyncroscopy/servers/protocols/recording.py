@@ -0,0 +1,116 @@
+'''
+Session recording: the backend requests Central relays and their replies, logged
+to a file so that a session can be served again without the hardware (see Replay_server).
+'''
+
+import logging
+import struct
+import time
+
+from twisted.python.failure import Failure
+
+from asyncroscopy.servers.protocols.utils import encode_object, decode_object, set_tag, is_error_reply
+
+log = logging.getLogger("central")
+
+# A session log is RECORD_MAGIC followed by records, each a uint32 length and an
+# encode_object dict: {"t": time.time() sent, "route", "cmd", "args",
+# "elapsed": seconds until the reply, "reply": [frame bytes, untagged], "error": bool}
+RECORD_MAGIC = b"ASYREC1\n"
+_LEN = struct.Struct("!I")
+
+
+class SessionRecorder:
+    """
+    Appends every completed backend request to a session log while recording.
+    Replies are stored as the backend sent them (packaged, compressed if it
+    compressed them; a chunked stream as its frames), so replaying them costs
+    no re-encoding. Requests that failed without a reply are not recorded.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.records = 0
+        self.bytes = 0
+        self._file = None
+
+    @property
+    def active(self) -> bool:
+        return self._file is not None
+
+    def start(self, path: str):
+        """Start appending to path (a new log, or one recorded earlier)."""
+        self.stop()
+        self._file = open(path, "ab", buffering=1 << 20)
+        if self._file.tell() == 0:
+            self._file.write(RECORD_MAGIC)
+        self.path = path
+        self.records = self.bytes = 0
+        log.info("[Central] Recording session to %s", path)
+
+    def stop(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        log.info("[Central] Recorded %d requests (%d bytes) to %s", self.records, self.bytes, self.path)
+
+    def record(self, route: str, cmd: str, args: dict, send, relay=None):
+        """
+        Run send(relay), a backend request returning a Deferred that fires with the
+        reply (None if relayed frame by frame), and log the request with its reply.
+        """
+        if self._file is None:
+            return send(relay)
+        frames = []
+        if relay is not None:
+            def tee(frame):
+                frames.append(bytes(frame))
+                relay(frame)
+        sent, started = time.time(), time.perf_counter()
+        d = send(tee if relay is not None else None)
+
+        def done(result):
+            if self._file is not None and not isinstance(result, Failure):
+                reply = frames if result is None else [bytes(result)]
+                self._write({
+                    "t": sent, "route": route, "cmd": cmd, "args": args,
+                    "elapsed": time.perf_counter() - started,
+                    "reply": [b"".join(set_tag([frame], None)) for frame in reply],
+                    "error": bool(reply) and is_error_reply(reply[0]),
+                })
+            return result
+
+        return d.addBoth(done)
+
+    def _write(self, record: dict):
+        data = encode_object(record)
+        self._file.write(_LEN.pack(len(data)))
+        self._file.write(data)
+        self.records += 1
+        self.bytes += _LEN.size + len(data)
+
+    def snapshot(self) -> dict:
+        return {"path": self.path if self.active else None, "records": self.records, "bytes": self.bytes}
+
+
+def record_spans(buf):
+    """Yield (start, end) of each record in the contents of a session log (bytes or an mmap)."""
+    if buf[:len(RECORD_MAGIC)] != RECORD_MAGIC:
+        raise ValueError("Not a session recording")
+    pos, size = len(RECORD_MAGIC), len(buf)
+    while pos + _LEN.size <= size:
+        (n,) = _LEN.unpack_from(buf, pos)
+        start, pos = pos + _LEN.size, pos + _LEN.size + n
+        if pos > size:
+            log.warning("Session recording ends with a truncated record")
+            return
+        yield start, pos
+
+
+def read_session(path: str):
+    """Yield the records of a session log, oldest first."""
+    with open(path, "rb") as f:
+        buf = f.read()
+    for start, end in record_spans(buf):
+        yield decode_object(buf[start:end])
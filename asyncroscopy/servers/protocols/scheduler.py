@@ -0,0 +1,126 @@
+'''
+Per-route admission control for Central: concurrency limits and priority queues.
+'''
+
+import heapq
+from fnmatch import fnmatchcase
+from itertools import count
+
+from twisted.internet.defer import Deferred, fail, maybeDeferred
+
+# Priority classes, lower runs first. SAFETY is the fast lane: it is never
+# queued and never refused, whatever the route's load.
+PRIORITY_CLASSES = {"safety": 0, "high": 1, "normal": 2, "low": 3}
+SAFETY = PRIORITY_CLASSES["safety"]
+NORMAL = PRIORITY_CLASSES["normal"]
+
+# "<route>_<command>" pattern -> priority class
+DEFAULT_PRIORITIES = {
+    "*_blank_beam": "safety",
+    "*_get_status": "high",
+    "*_get_stage": "high",
+    "*_discover_commands": "high",
+    "*_get_help": "high",
+    "*_get_scanned_image": "low",
+    "*_get_scan_bundle": "low",
+    "*_get_spectrum": "low",
+    "*_get_dose_map": "low",
+}
+
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_MAX_QUEUED = 64
+
+
+class QueueFull(Exception):
+    """A route's queue is full; the request was refused instead of queued."""
+
+
+def parse_priority(value) -> int:
+    """Priority class name ("safety", "high", ...) or number -> number."""
+    if isinstance(value, str) and not value.lstrip("-").isdigit():
+        try:
+            return PRIORITY_CLASSES[value]
+        except KeyError:
+            raise ValueError(f"Unknown priority class '{value}'") from None
+    return int(value)
+
+
+def priority_of(name: str, rules: dict) -> int:
+    """Priority of "<route>_<command>" under rules (pattern -> class); NORMAL if none matches."""
+    value = rules.get(name)
+    if value is None:
+        for pattern, cls in rules.items():
+            if fnmatchcase(name, pattern):
+                value = cls
+                break
+    return NORMAL if value is None else parse_priority(value)
+
+
+class RouteScheduler:
+    """
+    Admission control for one route (backend).
+    At most max_in_flight requests run at once; the rest wait in a bounded
+    priority queue (FIFO within a class) and start as running ones complete.
+    SAFETY requests skip the queue and the limit.
+    Cancelling the Deferred returned by submit removes a queued request from
+    the queue, or cancels a running one (freeing its slot).
+    """
+
+    def __init__(self, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, max_queued: int = DEFAULT_MAX_QUEUED):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.in_flight = 0
+        self._queue = []     # heap of (priority, seq, Deferred, call)
+        self._running = {}   # Deferred handed out by submit -> Deferred of the running call
+        self._seq = count()
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def submit(self, priority: int, call) -> Deferred:
+        """Run call() (returning a Deferred) once admitted; fires with its result."""
+        if priority <= SAFETY or (self.in_flight < self.max_in_flight and not self._queue):
+            return self._run(call)
+        if len(self._queue) >= self.max_queued:
+            return fail(QueueFull(f"{len(self._queue)} requests already queued"))
+        d = Deferred(self._cancel)
+        heapq.heappush(self._queue, (priority, next(self._seq), d, call))
+        return d
+
+    def set_limits(self, max_in_flight: int | None = None, max_queued: int | None = None):
+        if max_in_flight is not None:
+            self.max_in_flight = max_in_flight
+        if max_queued is not None:
+            self.max_queued = max_queued
+        self._drain()
+
+    def _run(self, call) -> Deferred:
+        self.in_flight += 1
+        d = maybeDeferred(call)
+        d.addBoth(self._done)
+        return d
+
+    def _done(self, result):
+        self.in_flight -= 1
+        self._drain()
+        return result
+
+    def _drain(self):
+        while self._queue and self.in_flight < self.max_in_flight:
+            _, _, waiter, call = heapq.heappop(self._queue)
+            running = self._running[waiter] = self._run(call)
+            running.addBoth(self._finished, waiter)
+            running.chainDeferred(waiter)
+
+    def _finished(self, result, waiter):
+        self._running.pop(waiter, None)
+        return result
+
+    def _cancel(self, waiter):
+        running = self._running.pop(waiter, None)
+        if running is not None:
+            running.cancel()
+            return
+        self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+        heapq.heapify(self._queue)
@@ -0,0 +1,120 @@
+'''
+Shared-memory transport for large replies between processes on the same host.
+'''
+
+import os
+import secrets
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+from asyncroscopy.servers.protocols.utils import (
+    pack_header, encode_object, unpackage_message, parse_header,
+)
+
+SHM_THRESHOLD = 1 << 20   # messages smaller than this go over the socket anyway
+SHM_TTL = 30.0            # seconds an unconsumed segment is kept
+SHM_PREFIX = "asy_"
+
+# POSIX segments live on by name once the writer unmaps them; Windows frees a
+# segment when its last handle closes, so the writer keeps it mapped until it expires.
+_KEEP_MAPPED = os.name == "nt"
+
+
+class _Segment(shared_memory.SharedMemory):
+    """
+    SharedMemory whose mapping may outlive it: arrays decoded from a segment keep
+    the memory mapped, and it is unmapped when the last of them is released.
+    """
+
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            pass   # still exported (arrays are using it)
+
+    def __del__(self):
+        try:
+            self.close()
+        except OSError:
+            pass
+
+
+class SegmentWriter:
+    """
+    Writes packaged messages into new shared-memory segments and returns the
+    handle message that replaces them on the wire. A segment is consumed once:
+    the reader unlinks it as soon as it has mapped it. Segments nobody read
+    within ttl seconds are unlinked here.
+    """
+
+    def __init__(self, ttl: float = SHM_TTL):
+        self.ttl = ttl
+        self.live = {}   # name -> _Segment not yet expired
+
+    def write(self, parts) -> bytes:
+        """Copy a packaged message (list of buffers) into a segment; returns its handle message."""
+        size = sum(len(p) for p in parts)
+        segment = _Segment(name=SHM_PREFIX + secrets.token_hex(8), create=True, size=size)
+        pos = 0
+        for part in parts:
+            n = len(part)
+            segment.buf[pos:pos + n] = memoryview(part).cast("B")
+            pos += n
+        if not _KEEP_MAPPED:
+            segment.close()
+        self.live[segment.name] = segment
+        # imported here: clients use read_segment without running a reactor
+        from twisted.internet import reactor
+        # callFromThread: blocking handlers reply from a worker thread
+        reactor.callFromThread(reactor.callLater, self.ttl, self._expire, segment)
+        enc = encode_object({"name": segment.name, "size": size})
+        return pack_header("shm", (len(enc),)) + enc
+
+    def _expire(self, segment):
+        self.live.pop(segment.name, None)
+        segment.close()
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            # consumed: the reader unlinked it already
+            resource_tracker.unregister(segment._name, "shared_memory")
+
+
+def attach_segment(name: str, shared_tracker: bool = False) -> _Segment:
+    """
+    Map an existing segment without leaving it registered with this process's
+    resource tracker: its creator unlinks it, and a tracker that registered it
+    would unlink it too when this process exits. Processes started by the
+    creator (shared_tracker) use its tracker, where the creator's registration
+    must stay.
+    """
+    if sys.version_info >= (3, 13):
+        return _Segment(name=name, track=False)
+    segment = _Segment(name=name)
+    if not shared_tracker:
+        resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def is_shm_handle(packet) -> bool:
+    try:
+        return parse_header(packet)[0] == "shm"
+    except (ValueError, IndexError):
+        return False
+
+
+def read_segment(handle: dict):
+    """
+    Map the segment a handle (decoded "shm" payload) names and unpackage the message
+    in it, like unpackage_message. Arrays are views on the shared memory (no copy);
+    the segment is unlinked here and its memory is freed once they are released.
+    """
+    try:
+        segment = _Segment(name=handle["name"])
+    except FileNotFoundError:
+        raise ConnectionError(f"Shared memory segment {handle['name']} expired before it was read") from None
+    try:
+        return unpackage_message(segment.buf[:handle["size"]])
+    finally:
+        segment.unlink()
+        segment.close()
@@ -0,0 +1,59 @@
+'''
+Fixed-size request trace, recorded into a preallocated ring buffer.
+'''
+
+import time
+
+import numpy as np
+
+TRACE_DTYPE = np.dtype([
+    ("time", "f8"),        # wall clock time the request completed
+    ("route", "S16"),
+    ("command", "S48"),
+    ("bytes_in", "u8"),
+    ("bytes_out", "u8"),
+    ("latency", "f4"),     # seconds
+    ("error", "?"),
+])
+
+
+class TraceBuffer:
+    """
+    The last `capacity` completed requests as structured records.
+    Storage is allocated once; recording overwrites the oldest record in
+    place, so tracing costs one record assignment and never grows.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.records = np.zeros(capacity, dtype=TRACE_DTYPE)
+        self.capacity = capacity
+        self.count = 0   # total records ever written
+
+    def record(self, route, command, bytes_in: int, bytes_out: int, latency: float, error: bool = False):
+        self.records[self.count % self.capacity] = (
+            time.time(), str(route).encode("utf-8")[:16], str(command).encode("utf-8")[:48],
+            bytes_in, bytes_out, latency, error,
+        )
+        self.count += 1
+
+    def dump(self, last: int | None = None) -> np.ndarray:
+        """Copy of the buffered records (or the last `last` of them), oldest first."""
+        n = min(self.count, self.capacity)
+        if last is not None:
+            n = min(n, last)
+        end = self.count % self.capacity
+        idx = (np.arange(end - n, end)) % self.capacity
+        return self.records[idx]
+
+    def dump_columns(self, last: int | None = None) -> dict:
+        """dump() as a dict of columns (arrays, and lists of str), ready for package_message."""
+        recs = self.dump(last)
+        out = {}
+        for name in TRACE_DTYPE.names:
+            col = recs[name]
+            out[name] = [v.decode("utf-8", "replace") for v in col] if col.dtype.kind == "S" else col.copy()
+        out["dropped"] = max(0, self.count - self.capacity)
+        return out
+
+    def clear(self):
+        self.count = 0
@@ -2,82 +2,718 @@
 Serialization helpers
 '''
 
+import lzma
+import os
+import struct
+import time
+import zlib
+from typing import NamedTuple
+
 import numpy as np
 
-def package_message(data) -> bytes:
+# ---------- Binary header ----------
+# Every message starts with a fixed-width, struct-packed header followed by
+# the payload (native byte order, as with the old text header):
+#   magic (4s) | version (B) | dtype code (B) | flags (B) | ndim (B) | shape (6 x uint32)
+MAGIC = b"\x93ASY"
+VERSION = 1
+MAX_NDIM = 6
+HEADER = struct.Struct(f"!4sBBBB{MAX_NDIM}I")
+HEADER_SIZE = HEADER.size
+
+DTYPE_CODES = {
+    "bytes": 0,
+    "str": 1,
+    "uint8": 2,
+    "int8": 3,
+    "int16": 4,
+    "int32": 5,
+    "int64": 6,
+    "float16": 7,
+    "float32": 8,
+    "float64": 9,
+    "bool": 10,
+    "uint16": 11,
+    "uint32": 12,
+    "uint64": 13,
+    "complex64": 14,
+    "complex128": 15,
+    "object": 16,   # dict/list payloads, see encode_object
+    "bundle": 17,   # several named messages in one frame, see Bundle
+    "chunk": 18,    # one piece of a chunked stream, see message_frames
+    "request": 19,  # typed command envelope, see package_request
+    "shm": 20,      # handle of a message in shared memory, see shm.SegmentWriter
+}
+CODE_DTYPES = {code: name for name, code in DTYPE_CODES.items()}
+NUMERIC_DTYPES = {
+    name for name in DTYPE_CODES
+    if name not in ("bytes", "str", "object", "bundle", "chunk", "request", "shm")
+}
+
+# Compatibility mode: emit the old "[dtype,shape...]" text header so clients
+# that predate the binary header keep working. Decoding always accepts both.
+LEGACY_HEADERS = os.environ.get("ASYNCROSCOPY_LEGACY_HEADERS", "0") not in ("", "0")
+
+# ---------- Compression ----------
+# Header flag bits 0-1 hold the codec id, bit 2 marks a byte-shuffled payload.
+FLAG_CODEC_MASK = 0x03
+FLAG_SHUFFLE = 0x04
+CODECS = {"zlib": 1, "lzma": 2}
+COMPRESS_THRESHOLD = 64 * 1024   # payloads smaller than this are sent as is
+
+# ---------- Chunked streams ----------
+# Large messages are sent as a stream of frames, each well below MAX_LENGTH:
+#   head:       message header with FLAG_CHUNKED | total payload length (uint64)
+#   chunks:     "chunk" messages carrying consecutive slices of the payload
+#   terminator: empty "chunk" message with FLAG_END
+FLAG_CHUNKED = 0x08
+FLAG_END = 0x10
+STREAM_CHUNK_SIZE = 1 << 20
+_FLAGS_OFFSET = 6   # byte offset of the flags field in HEADER
+
+# ---------- Request tags ----------
+# A message flagged FLAG_TAGGED carries a uint32 request id right after the
+# header. Replies (and every frame of a reply stream) echo the id of their
+# request, so several requests can share a connection and complete out of order.
+FLAG_TAGGED = 0x20
+_TAG = struct.Struct("!I")
+TAG_SIZE = _TAG.size
+# A frame without a binary header (legacy text header, raw bytes) gets a "bytes"
+# header flagged FLAG_WRAPPED to carry a tag; removing the tag removes the wrapper.
+FLAG_WRAPPED = 0x40
+
+
+def pack_header(dtype: str, shape, flags: int = 0, legacy: bool = False) -> bytes:
     """
-    Produce bytes matching the client's expected format:
-      b"[dtype,shape...]<binary payload>"
+    Build the header for a payload of the given dtype name and shape.
+    Falls back to the text header in legacy mode, or when the dtype/ndim
+    cannot be expressed in the binary header.
+    """
+    code = DTYPE_CODES.get(dtype)
+    if legacy or code is None or len(shape) > MAX_NDIM:
+        dims = ",".join(str(x) for x in shape)
+        return f"[{dtype},{dims}]".encode("ascii")
+    dims = tuple(shape) + (0,) * (MAX_NDIM - len(shape))
+    return HEADER.pack(MAGIC, VERSION, code, flags, len(shape), *dims)
 
-    Handles:
-      - str -> [str,len]<utf8 bytes>
-      - bytes/bytearray -> [uint8,n]<raw bytes>
-      - numpy arrays -> [<dtype>,<dim1>,<dim2>,...]<tobytes()>
-      - int/float -> [float32,1]<4-bytes>
-      - list/tuple -> converted to numpy array
-      - fallback: str(data)
+
+def parse_header(packet):
+    """
+    Parse the header at the start of a packet (bytes, bytearray or memoryview).
+    Returns (dtype: str, shape: tuple[int,...], flags: int, offset: int), where
+    offset is the start of the payload. Raises ValueError on a malformed header.
+    """
+    if packet[:4] == MAGIC:
+        if len(packet) < HEADER_SIZE:
+            raise ValueError("Truncated binary header")
+        _, version, code, flags, ndim, *dims = HEADER.unpack_from(packet)
+        if version > VERSION or code not in CODE_DTYPES or ndim > MAX_NDIM:
+            raise ValueError(f"Unsupported header (version={version}, dtype code={code})")
+        offset = HEADER_SIZE + _TAG.size if flags & FLAG_TAGGED else HEADER_SIZE
+        if len(packet) < offset:
+            raise ValueError("Truncated request tag")
+        return CODE_DTYPES[code], tuple(dims[:ndim]), flags, offset
+
+    # legacy text header: b"[dtype,dim1,dim2,...]"
+    end_idx = bytes(packet[:256]).index(b']') + 1
+    header = bytes(packet[:end_idx]).decode("ascii")
+    dtype, *shape_parts = header[1:-1].split(",")
+    shape = tuple(int(x) for x in shape_parts) if shape_parts else ()
+    return dtype, shape, 0, end_idx
+
+
+def message_tag(packet):
+    """Return the request id of a tagged message, or None if it has none."""
+    if packet[:4] != MAGIC or len(packet) < HEADER_SIZE + _TAG.size:
+        return None
+    if not packet[_FLAGS_OFFSET] & FLAG_TAGGED:
+        return None
+    return _TAG.unpack_from(packet, HEADER_SIZE)[0]
+
+
+def set_tag(parts, tag: int | None) -> list:
+    """
+    Return a frame (list of buffers, header first) carrying request id tag,
+    or with its tag removed when tag is None. Only the header is rebuilt, the
+    payload is passed through as views. Frames without a binary header (raw
+    bytes, legacy text header) are wrapped in a "bytes" message to carry a tag,
+    and given back unwrapped when the tag is removed, byte for byte as they were.
+    """
+    first = memoryview(parts[0]).cast("B")
+    if first[:4] != MAGIC:
+        if tag is None:
+            return list(parts)
+        header = bytearray(pack_header("bytes", (sum(len(p) for p in parts),), flags=FLAG_WRAPPED))
+        rest = list(parts)
+    else:
+        header = bytearray(first[:HEADER_SIZE])
+        start = HEADER_SIZE + _TAG.size if header[_FLAGS_OFFSET] & FLAG_TAGGED else HEADER_SIZE
+        rest = [first[start:], *parts[1:]] if len(first) > start else list(parts[1:])
+        if tag is None and header[_FLAGS_OFFSET] & FLAG_WRAPPED:
+            return [piece for piece in rest if len(piece)]
+    if tag is None:
+        header[_FLAGS_OFFSET] &= ~FLAG_TAGGED
+        return [bytes(header), *rest]
+    header[_FLAGS_OFFSET] |= FLAG_TAGGED
+    return [bytes(header) + _TAG.pack(tag & 0xFFFFFFFF), *rest]
+
+
+class Compression(NamedTuple):
+    """Compression settings for a message, route or connection."""
+    codec: str = "zlib"
+    level: int = 1
+    shuffle: bool = True
+    threshold: int = COMPRESS_THRESHOLD
+
+
+def _compress(payload, codec: str, level: int) -> bytes:
+    if codec == "zlib":
+        return zlib.compress(payload, level)
+    if codec == "lzma":
+        return lzma.compress(payload, preset=level)
+    raise ValueError(f"Unknown codec '{codec}'")
+
+
+def _decompress(payload, codec_id: int) -> bytes:
+    if codec_id == CODECS["zlib"]:
+        return zlib.decompress(payload)
+    if codec_id == CODECS["lzma"]:
+        return lzma.decompress(payload)
+    raise ValueError(f"Unknown codec id {codec_id}")
+
+
+def _decompress_head(payload, codec_id: int, size: int) -> bytes:
+    """The first size bytes of a compressed payload, without decompressing the rest."""
+    if codec_id == CODECS["zlib"]:
+        return zlib.decompressobj().decompress(payload, size)
+    if codec_id == CODECS["lzma"]:
+        return lzma.LZMADecompressor().decompress(payload, max_length=size)
+    raise ValueError(f"Unknown codec id {codec_id}")
+
+
+def _itemsize(dtype: str) -> int:
+    # only typed arrays are shuffled: other payloads are byte streams
+    if dtype not in NUMERIC_DTYPES:
+        return 1
+    return np.dtype(dtype).itemsize
+
+
+def _shuffle(payload, itemsize: int):
+    """Group byte k of every item together; typed arrays compress much better."""
+    return np.frombuffer(payload, dtype=np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(payload, itemsize: int) -> bytes:
+    return np.frombuffer(payload, dtype=np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+def _compressed(dtype: str, payload, compression: Compression):
+    """Return (flags, compressed payload), or None if compression is not worth it."""
+    if len(payload) < compression.threshold:
+        return None
+    flags = CODECS[compression.codec]
+    itemsize = _itemsize(dtype)
+    data = payload
+    if compression.shuffle and itemsize > 1 and len(payload) % itemsize == 0:
+        data = _shuffle(payload, itemsize)
+        flags |= FLAG_SHUFFLE
+    packed = _compress(data, compression.codec, compression.level)
+    if len(packed) >= len(payload):
+        return None
+    return flags, packed
+
+
+def compress_message(packet, compression: Compression) -> bytes:
+    """
+    Compress an already packaged message (e.g. a reply relayed by Central).
+    Legacy text-header, small and already compressed messages are returned unchanged.
+    The other header flags and the request tag are kept.
+    """
+    if compression is None or packet[:4] != MAGIC:
+        return packet
+    dtype, shape, flags, offset = parse_header(packet)
+    if flags & (FLAG_CODEC_MASK | FLAG_CHUNKED | FLAG_END):
+        return packet
+    result = _compressed(dtype, memoryview(packet)[offset:], compression)
+    if result is None:
+        return packet
+    codec_flags, packed = result
+    header = pack_header(dtype, shape, flags=flags | codec_flags)
+    return header + bytes(packet[HEADER_SIZE:offset]) + packed
+
+
+# ---------- Structured (dict/list) payloads ----------
+# Compact tag-length-value encoding, decoded with struct instead of literal_eval:
+#   N None | T True | F False | i int64 | L big int (decimal) | d float64
+#   s str | b bytes | l list | t tuple | m dict | a ndarray (nested message)
+# Lengths and counts are uint32, numbers are big-endian.
+_U32 = struct.Struct("!I")
+_I64 = struct.Struct("!q")
+_F64 = struct.Struct("!d")
+
+
+def _encode_item(obj, out: list):
+    if obj is None:
+        out.append(b"N")
+    elif obj is True or obj is False:
+        out.append(b"T" if obj else b"F")
+    elif isinstance(obj, (np.ndarray, np.number, np.bool_)):
+        # numpy scalars keep their dtype as 0-d arrays
+        parts = package_message_parts(np.asarray(obj), legacy=False)
+        out.append(b"a" + _U32.pack(sum(len(p) for p in parts)))
+        out.extend(parts)
+    elif isinstance(obj, int):
+        if -2**63 <= obj < 2**63:
+            out.append(b"i" + _I64.pack(obj))
+        else:
+            txt = str(obj).encode("ascii")
+            out.append(b"L" + _U32.pack(len(txt)) + txt)
+    elif isinstance(obj, float):
+        out.append(b"d" + _F64.pack(obj))
+    elif isinstance(obj, str):
+        enc = obj.encode("utf-8")
+        out.append(b"s" + _U32.pack(len(enc)) + enc)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        out.append(b"b" + _U32.pack(len(obj)))
+        out.append(bytes(obj))
+    elif isinstance(obj, dict):
+        out.append(b"m" + _U32.pack(len(obj)))
+        for key, value in obj.items():
+            _encode_item(key, out)
+            _encode_item(value, out)
+    elif isinstance(obj, (list, tuple)):
+        out.append((b"t" if isinstance(obj, tuple) else b"l") + _U32.pack(len(obj)))
+        for value in obj:
+            _encode_item(value, out)
+    else:
+        _encode_item(str(obj), out)
+
+
+def encode_object(obj) -> bytes:
+    """Encode a dict/list (nested; str, numbers, bytes, None, ndarrays) to bytes."""
+    out = []
+    _encode_item(obj, out)
+    return b"".join(out)
+
+
+def _decode_item(buf: memoryview, pos: int, views: bool = False):
+    tag = buf[pos]
+    pos += 1
+    if tag == 0x4E:    # N
+        return None, pos
+    if tag == 0x54:    # T
+        return True, pos
+    if tag == 0x46:    # F
+        return False, pos
+    if tag == 0x69:    # i
+        return _I64.unpack_from(buf, pos)[0], pos + 8
+    if tag == 0x64:    # d
+        return _F64.unpack_from(buf, pos)[0], pos + 8
+    (n,) = _U32.unpack_from(buf, pos)
+    pos += 4
+    if tag == 0x73:    # s
+        return str(buf[pos:pos + n], "utf-8"), pos + n
+    if tag == 0x62:    # b
+        return (buf[pos:pos + n] if views else bytes(buf[pos:pos + n])), pos + n
+    if tag == 0x4C:    # L
+        return int(str(buf[pos:pos + n], "ascii")), pos + n
+    if tag == 0x61:    # a
+        _, shape, value = unpackage_message(buf[pos:pos + n])
+        if not shape and isinstance(value, np.ndarray) and value.size == 1:
+            value = value.reshape(())[()]   # numpy scalar
+        return value, pos + n
+    if tag == 0x6D:    # m
+        out = {}
+        for _ in range(n):
+            key, pos = _decode_item(buf, pos, views)
+            out[key], pos = _decode_item(buf, pos, views)
+        return out, pos
+    if tag in (0x6C, 0x74):    # l, t
+        items = []
+        for _ in range(n):
+            value, pos = _decode_item(buf, pos, views)
+            items.append(value)
+        return (tuple(items) if tag == 0x74 else items), pos
+    raise ValueError(f"Unknown object tag {tag!r} at offset {pos - 1}")
+
+
+def decode_object(buf, views: bool = False):
+    """Inverse of encode_object. ndarrays are returned as views on buf, and bytes too with views."""
+    value, _ = _decode_item(memoryview(buf).cast("B"), 0, views)
+    return value
+
+
+# ---------- Bundles ----------
+# A bundle payload is a sequence of named, individually packaged messages:
+#   count (uint32) | per part: name length (uint32) | name (utf8) | part length (uint64) | part
+_U64 = struct.Struct("!Q")
+
+
+class Bundle(dict):
+    """
+    Named message parts sent as one frame, e.g.
+        Bundle(image=image, dose_map=dose_map, atom_count=n, params={...})
+    Every part keeps its own dtype and shape; arrays are neither copied on send
+    nor on receive.
+    """
+
+
+class PackagedMessage:
+    """
+    An already packaged message (e.g. a backend reply relayed by Central),
+    placed in a Bundle as is instead of being encoded again.
+    """
+
+    __slots__ = ("parts",)
+
+    def __init__(self, packet):
+        self.parts = set_tag([packet], None)
+
+
+def _bundle_parts(bundle: Bundle, compression=None) -> list:
+    parts = [_U32.pack(len(bundle))]
+    for name, value in bundle.items():
+        enc = str(name).encode("utf-8")
+        if isinstance(value, PackagedMessage):
+            sub = value.parts
+        else:
+            sub = package_message_parts(value, legacy=False, compression=compression)
+        parts.append(_U32.pack(len(enc)) + enc + _U64.pack(sum(len(p) for p in sub)))
+        parts.extend(sub)
+    return parts
+
+
+def decode_bundle(buf) -> Bundle:
+    """Inverse of the bundle encoding; parts are decoded with unpackage_message."""
+    buf = memoryview(buf).cast("B")
+    (count,) = _U32.unpack_from(buf, 0)
+    pos = 4
+    out = Bundle()
+    for _ in range(count):
+        (n,) = _U32.unpack_from(buf, pos)
+        name = str(buf[pos + 4:pos + 4 + n], "utf-8")
+        pos += 4 + n
+        (size,) = _U64.unpack_from(buf, pos)
+        pos += 8
+        out[name] = unpackage_message(buf[pos:pos + size])[2]
+        pos += size
+    return out
+
+
+# ---------- Stream framing ----------
+def is_stream_head(packet) -> bool:
+    """True if packet is the head frame of a chunked stream."""
+    return packet[:4] == MAGIC and bool(packet[_FLAGS_OFFSET] & FLAG_CHUNKED)
+
+
+def is_stream_end(packet) -> bool:
+    """True if packet is the terminator frame of a chunked stream."""
+    return packet[:4] == MAGIC and bool(packet[_FLAGS_OFFSET] & FLAG_END)
+
+
+def message_frames(parts, chunk_size: int = STREAM_CHUNK_SIZE) -> list:
+    """
+    Split a packaged message (a list of buffers, header first) into frames.
+    Messages with a binary header and a payload larger than chunk_size become
+    a chunked stream; everything else is returned as a single frame.
+    Chunks are memoryview slices of the original buffers (no copy).
+    """
+    first = memoryview(parts[0]).cast("B")
+    size = sum(len(p) for p in parts) - HEADER_SIZE
+    if first[:4] != MAGIC or size <= chunk_size:
+        return [parts]
+
+    head = bytearray(first[:HEADER_SIZE])
+    head[_FLAGS_OFFSET] |= FLAG_CHUNKED
+    frames = [[bytes(head) + _U64.pack(size)]]
+    current, filled = [], 0
+    for part in [first[HEADER_SIZE:], *parts[1:]]:
+        view = memoryview(part).cast("B")
+        while len(view):
+            take = min(chunk_size - filled, len(view))
+            current.append(view[:take])
+            filled += take
+            view = view[take:]
+            if filled == chunk_size:
+                frames.append([pack_header("chunk", (filled,)), *current])
+                current, filled = [], 0
+    if filled:
+        frames.append([pack_header("chunk", (filled,)), *current])
+    frames.append([pack_header("chunk", (0,), flags=FLAG_END)])
+    return frames
+
+
+class StreamAssembler:
+    """
+    Reassembles a chunked stream into one preallocated message buffer.
+    Either feed() whole chunk frames, or - when reading from a socket - pass the
+    chunk header to feed_header() and recv_into the view returned by reserve().
+    """
+
+    def __init__(self, head):
+        dtype, shape, flags, offset = parse_header(head)
+        (total,) = _U64.unpack_from(head, offset)
+        self.buffer = bytearray(offset + total)
+        self.buffer[:offset] = head[:offset]
+        self.buffer[_FLAGS_OFFSET] &= ~FLAG_CHUNKED
+        self.pos = offset
+        self.done = False
+
+    def feed_header(self, header) -> int:
+        """Parse a chunk header; returns the chunk payload length (0 at the end)."""
+        dtype, shape, flags, offset = parse_header(header)
+        if dtype != "chunk":
+            raise ValueError(f"Expected a stream chunk, got '{dtype}'")
+        if flags & FLAG_END:
+            if self.pos != len(self.buffer):
+                raise ValueError("Stream ended before the announced length")
+            self.done = True
+        return shape[0]
+
+    def reserve(self, n: int) -> memoryview:
+        """Return the slice of the buffer the next n payload bytes go to."""
+        if self.pos + n > len(self.buffer):
+            raise ValueError("Stream longer than the announced length")
+        view = memoryview(self.buffer)[self.pos:self.pos + n]
+        self.pos += n
+        return view
+
+    def feed(self, frame) -> bool:
+        """Add one chunk frame; returns True once the terminator has been seen."""
+        n = self.feed_header(frame)
+        if n:
+            self.reserve(n)[:] = memoryview(frame)[len(frame) - n:]
+        return self.done
+
+
+def _encode(data, structured: bool = True):
+    """
+    Normalise data into (dtype name, shape, payload buffer).
+    ndarray payloads are returned as a memoryview of the array, not a copy.
+    Without structured, dicts and non-numeric lists are stringified (legacy clients).
     """
     # Strings
     if isinstance(data, str):
         enc = data.encode("utf-8")
-        header = f"[str,{len(enc)}]".encode("ascii")
-        return header + enc
+        return "str", (len(enc),), enc
 
     # Raw bytes
     if isinstance(data, (bytes, bytearray)):
-        arr = np.frombuffer(data, dtype=np.uint8)
-        header = f"[uint8,{arr.size}]".encode("ascii")
-        return header + bytes(data)
+        return "uint8", (len(data),), data
 
-    # Scalars -> treat as float32 vector length 1
+    # Python scalars -> vector of length 1 of their dtype (int64, float64, bool)
     if isinstance(data, (int, float)):
-        arr = np.array([data], dtype=np.float32)
-        header = f"[float32,1]".encode("ascii")
-        return header + arr.tobytes()
+        arr = np.asarray([data])
+        if arr.dtype.kind in "biuf":   # not an int beyond int64
+            data = arr
+    # numpy scalars -> 0-d array of their dtype
+    elif isinstance(data, np.generic):
+        arr = np.asarray(data)
+        if arr.dtype.kind in "biufc":
+            data = arr
 
-    # Lists/tuples -> numpy array
+    # Dicts -> structured payload
+    if isinstance(data, dict) and structured:
+        enc = encode_object(data)
+        return "object", (len(enc),), enc
+
+    # Lists/tuples -> numpy array when numeric, structured payload otherwise
     if isinstance(data, (list, tuple)):
-        data = np.asarray(data)
+        try:
+            arr = np.asarray(data)
+        except ValueError:   # ragged
+            arr = None
+        if arr is not None and arr.dtype.kind in "biufc":
+            data = arr
+        elif structured:
+            enc = encode_object(data)
+            return "object", (len(enc),), enc
 
     # numpy arrays
     if isinstance(data, np.ndarray):
-        dtype = data.dtype.name  # e.g. 'uint8', 'float32'
-        shape = ",".join(str(x) for x in data.shape)
-        header = f"[{dtype},{shape}]".encode("ascii")
-        return header + data.tobytes()
+        if data.ndim == 0 and not structured:
+            data = data.reshape(1)   # the text header cannot express ndim 0
+        flat = np.ascontiguousarray(data).reshape(-1).view(np.uint8)
+        return data.dtype.name, data.shape, memoryview(flat)
 
     # fallback: stringify
     txt = str(data).encode("utf-8")
-    header = f"[str,{len(txt)}]".encode("ascii")
-    return header + txt
+    return "str", (len(txt),), txt
+
+
+def package_message(data, legacy: bool | None = None, compression: Compression | None = None) -> bytes:
+    """
+    Produce bytes matching the client's expected format:
+      <binary header><payload>, or b"[dtype,shape...]<payload>" in legacy mode
+
+    Handles:
+      - str -> str, (len,) <utf8 bytes>
+      - bytes/bytearray -> uint8, (n,) <raw bytes>
+      - numpy arrays -> <dtype>, <shape> <array buffer>
+      - int/float/bool and numpy scalars -> their dtype (int64, float64, bool, ...), (1,)
+      - dict -> object, (n,) <encode_object bytes>
+      - Bundle -> bundle, (parts,) <named packaged messages>
+      - list/tuple -> converted to numpy array if numeric, else like dict
+      - fallback: str(data)
+
+    legacy defaults to LEGACY_HEADERS (env ASYNCROSCOPY_LEGACY_HEADERS=1).
+    compression (binary header only) compresses payloads above its threshold.
+    """
+    return b"".join(package_message_parts(data, legacy=legacy, compression=compression))
+
+
+def package_message_parts(data, legacy: bool | None = None, compression: Compression | None = None) -> list:
+    """
+    Same as package_message, but returns [header, payload, ...] without joining them.
+    ndarray payloads are memoryviews of the array buffer, so a protocol can
+    hand them to a FrameWriter without ever copying the array.
+    A Bundle yields its index entries and the parts of every member.
+    """
+    if legacy is None:
+        legacy = LEGACY_HEADERS
+    if isinstance(data, Bundle):
+        if legacy:
+            raise ValueError("Bundles need the binary header")
+        return [pack_header("bundle", (len(data),)), *_bundle_parts(data, compression)]
+    dtype, shape, payload = _encode(data, structured=not legacy)
+    if compression is not None and not legacy and dtype in DTYPE_CODES:
+        result = _compressed(dtype, payload, compression)
+        if result is not None:
+            flags, packed = result
+            return [pack_header(dtype, shape, flags=flags), packed]
+    return [pack_header(dtype, shape, legacy=legacy), payload]
+
+
+def package_request(command: str, args: dict | None = None, destination: str | None = None,
+                    tag: int | None = None, timeout_s: float | None = None, shm: bool = False) -> bytes:
+    """
+    Build a typed request envelope: {["timeout_s",] "cmd", "args"[, "dest"][, "shm"]} in the structured encoding.
+    Argument values keep their types (numbers, lists, dicts, ndarrays, strings with spaces).
+    destination is the route prefix ("AS", "Ceos", "Central", ...) used by Central.
+    tag is an optional request id, echoed by every frame of the reply.
+    timeout_s is the time left, in seconds, before nobody waits for the reply any more. It is
+    relative so that hosts need no synchronised clocks: each hop turns it into a local deadline
+    (request_deadline) and forwards what is left of it (with_timeout).
+    shm asks for a large reply to be passed in shared memory (the client runs on the backend's host).
+    """
+    envelope = {}
+    if timeout_s is not None:
+        envelope["timeout_s"] = float(timeout_s)   # first, so that with_timeout finds it
+    envelope["cmd"] = command
+    envelope["args"] = args or {}
+    if destination is not None:
+        envelope["dest"] = destination
+    if shm:
+        envelope["shm"] = True
+    enc = encode_object(envelope)
+    if tag is None:
+        return pack_header("request", (len(enc),)) + enc
+    return pack_header("request", (len(enc),), flags=FLAG_TAGGED) + _TAG.pack(tag & 0xFFFFFFFF) + enc
+
+
+def is_error_reply(packet) -> bool:
+    """
+    True for replies that are not packaged messages: the raw tracebacks a
+    failing handler sends (wrapped into a "bytes" message when tagged).
+    """
+    if packet[:4] == MAGIC:
+        try:
+            dtype, shape, flags, offset = parse_header(packet)
+        except ValueError:
+            return True
+        if dtype != "bytes":
+            return False
+        # a legacy-header message wrapped to carry a tag (and maybe compressed by Central) is not an error
+        if not flags & FLAG_WRAPPED:
+            return True
+        if flags & FLAG_CODEC_MASK:
+            return _decompress_head(memoryview(packet)[offset:], flags & FLAG_CODEC_MASK, 1) != b"["
+        return packet[offset:offset + 1] != b"["
+    return packet[:1] != b"["
+
+
+def error_text(packet) -> str:
+    """The traceback carried by an error reply (see is_error_reply), as text."""
+    data = b"".join(bytes(p) for p in set_tag([packet], None))
+    if data[:4] == MAGIC:
+        data = bytes(unpackage_message(data)[2])
+    return data.decode("utf-8", "replace").strip()
+
+
+# encoding of the "timeout_s" key and the float tag of its value, at the start of an envelope's dict
+_TIMEOUT_ITEM = b"s" + _U32.pack(len("timeout_s")) + b"timeout_s" + b"d"
+
+
+def request_deadline(request: dict) -> float | None:
+    """Local time.monotonic() deadline of a parsed request, from its timeout_s budget (None without one)."""
+    timeout_s = request.get("timeout_s")
+    return None if timeout_s is None else time.monotonic() + timeout_s
+
+
+def with_timeout(command, timeout_s: float):
+    """
+    A request envelope with its timeout_s budget replaced, for forwarding what is left of it.
+    Only the 8 bytes of the value change; text commands and envelopes without a budget are returned as they are.
+    """
+    if command[:4] != MAGIC:
+        return command
+    pos = parse_header(command)[3] + 1 + _U32.size   # "m" and the item count
+    if command[pos:pos + len(_TIMEOUT_ITEM)] != _TIMEOUT_ITEM:
+        return command
+    pos += len(_TIMEOUT_ITEM)
+    return b"".join((command[:pos], _F64.pack(max(timeout_s, 0.0)), command[pos + _F64.size:]))
+
+
+def parse_request(data):
+    """
+    Parse an incoming command frame.
+    Returns the envelope dict for typed requests; text commands of the form
+    "cmd key=value ..." are returned as {"cmd": cmd, "args": {key: "value"}}.
+    Returns None for an empty command.
+    """
+    if data[:4] == MAGIC:
+        dtype, shape, envelope = unpackage_message(data)
+        if dtype != "request":
+            raise ValueError(f"Expected a request envelope, got '{dtype}'")
+        return envelope
+    parts = bytes(data).decode("utf-8").split()
+    if not parts:
+        return None
+    cmd, *args = parts
+    return {"cmd": cmd, "args": dict(arg.split("=", 1) for arg in args if "=" in arg)}
+
 
 def unpackage_message(packet: bytes):
     """
     Inverse of package_message. Returns (dtype: str, shape: tuple[int,...], payload_data)
-    payload_data is bytes for binary dtypes, or decoded string for 'str', or numpy array for numeric types.
+    payload_data is bytes for binary dtypes, decoded string for 'str', dict/list for 'object',
+    a Bundle of decoded parts for 'bundle', or numpy array for numeric types.
+    Accepts both the binary and the legacy text header; arrays are views on packet (no copy).
+    Compressed payloads are decompressed transparently.
     """
     try:
-        end_idx = packet.index(b']') + 1
-        header = packet[:end_idx].decode("ascii")
-        payload = packet[end_idx:]
-        parts = header[1:-1].split(",")
-        dtype, *shape_parts = parts
-        shape = tuple(int(x) for x in shape_parts) if shape_parts else ()
+        dtype, shape, flags, offset = parse_header(packet)
     except Exception:
         # malformed header -> return raw bytes
         return "bytes", (), packet
+    if flags & FLAG_CODEC_MASK:
+        packet = _decompress(memoryview(packet)[offset:], flags & FLAG_CODEC_MASK)
+        if flags & FLAG_SHUFFLE:
+            packet = _unshuffle(packet, _itemsize(dtype))
+        offset = 0
     if dtype == "str":
-        return dtype, shape, payload.decode("utf-8")
-    if dtype == "uint8":
-        arr = np.frombuffer(payload, dtype=np.uint8)
-        if shape:
-            arr = arr.reshape(shape)
-        return dtype, shape, arr
-    if dtype.startswith("float") or dtype.startswith("int"):
-        dtype_np = np.dtype(dtype)
-        arr = np.frombuffer(payload, dtype=dtype_np)
-        if shape:
+        return dtype, shape, str(memoryview(packet)[offset:], "utf-8")
+    if dtype in ("object", "request", "shm"):
+        return dtype, shape, decode_object(memoryview(packet)[offset:])
+    if dtype == "bundle":
+        return dtype, shape, decode_bundle(memoryview(packet)[offset:])
+    if dtype in NUMERIC_DTYPES:
+        arr = np.frombuffer(packet, dtype=np.dtype(dtype), offset=offset)
+        if shape or arr.size == 1:   # shape () is a 0-d array
             arr = arr.reshape(shape)
         return dtype, shape, arr
+    if dtype == "bytes" and flags & FLAG_WRAPPED and packet[offset:offset + 1] == b"[":
+        # a legacy-header message wrapped to carry a tag
+        return unpackage_message(memoryview(packet)[offset:])
     # unknown dtype -> return raw bytes
-    return dtype, shape, payload
\ No newline at end of file
+    return dtype, shape, packet[offset:]
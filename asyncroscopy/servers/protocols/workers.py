@@ -0,0 +1,104 @@
+'''
+Multi-process Central: workers sharing one listening port (SO_REUSEPORT) and
+the control channel that keeps their configuration in step.
+'''
+
+import logging
+import socket
+import subprocess
+import sys
+
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+
+from asyncroscopy.servers.protocols.utils import encode_object, decode_object
+
+log = logging.getLogger("central")
+
+# control ports are port + CONTROL_OFFSET + worker index, on the loopback interface
+CONTROL_OFFSET = 1000
+
+
+def listen_reuseport(port: int, factory, interface: str = ""):
+    """
+    Listen on port with SO_REUSEPORT, so that several processes can: the kernel
+    spreads incoming connections over them. Returns the Twisted listening port.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("SO_REUSEPORT is not available on this platform; run a single Central")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((interface, port))
+    sock.listen(128)
+    sock.setblocking(False)
+    try:
+        return reactor.adoptStreamPort(sock.fileno(), socket.AF_INET, factory)
+    finally:
+        sock.close()   # the reactor holds its own duplicate of the descriptor
+
+
+class ControlChannel(DatagramProtocol):
+    """
+    Datagrams between the workers of one Central, over loopback UDP.
+    A message is a TLV-encoded dict with an "op" key; broadcast() sends one to
+    every other worker and received ones go to the handler registered for the op.
+    Loopback datagrams are not lost in practice, but there is no retransmission:
+    this carries configuration changes and cache invalidations, not replies.
+    """
+
+    def __init__(self, worker: int, peers):
+        self.worker = worker
+        self.peers = list(peers)   # (host, port) of the other workers
+        self.handlers = {}         # op -> callable(message dict)
+
+    def on(self, op: str, handler):
+        self.handlers[op] = handler
+
+    def broadcast(self, op: str, **fields):
+        if self.transport is None:
+            return
+        data = encode_object({"op": op, "worker": self.worker, **fields})
+        for peer in self.peers:
+            self.transport.write(data, peer)
+
+    def datagramReceived(self, data, addr):
+        try:
+            message = decode_object(data)
+            handler = self.handlers[message["op"]]
+        except Exception:
+            log.exception("[Central] Bad control message from %s", addr)
+            return
+        try:
+            handler(message)
+        except Exception:
+            log.exception("[Central] Failed to apply control message '%s'", message.get("op"))
+
+
+def control_peers(worker: int, workers: int, control_port: int):
+    return [("127.0.0.1", control_port + i) for i in range(workers) if i != worker]
+
+
+def spawn_workers(module: str, workers: int, port: int, control_port: int):
+    """
+    Run `workers` processes of `python -m module --port port --worker i --workers n`
+    and wait for them; stopping this process stops them.
+    """
+    procs = [
+        subprocess.Popen([sys.executable, "-m", module, "--port", str(port), "--workers", str(workers),
+                          "--worker", str(i), "--control-port", str(control_port)])
+        for i in range(workers)
+    ]
+    log.info("Central running as %d workers on port %d (pids %s)", workers, port,
+             ", ".join(str(p.pid) for p in procs))
+    try:
+        for proc in procs:
+            proc.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in procs:
+            proc.wait()